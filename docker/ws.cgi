@@ -22,10 +22,14 @@ case "$PATH_INFO" in
 	./src/pipeline-advanced/weaviate_infos.py
 	;;
 
-    /clear) # init or clear Weaviate
+    /clear) # init or clear Weaviate; behind an alias, create an empty generation to load then --promote
 	./src/pipeline-advanced/init_or_reset_collection.py 2>&1
 	;;
 
+    /rebuild) # re-ingest all the documents into a new collection, then switch queries to it
+	./scripts/rebuild-collection.sh ../awsgpu-docs/collection 2>&1
+	;;
+
     /ps) # dump process list
 	ps -fauxgww
 	;;
@@ -42,6 +46,11 @@ case "$PATH_INFO" in
 	nohup sleep 3600 >& /dev/null
 	;;
 
+    /start-retrieval) # start the retrieval service used by /request* (models kept loaded between requests)
+	nohup ./src/pipeline-advanced/retrieval_server.py >& /tmp/retrieval_server.log &
+	echo "retrieval service starting, log in /tmp/retrieval_server.log"
+	;;
+
     /launch-pipeline-advanced) # run launch-pipeline-advanced.sh
 	./scripts/launch-pipeline-advanced.sh 2>&1
 	;;
@@ -66,13 +75,8 @@ case "$PATH_INFO" in
 
     /embeddings) # create chunks and embeddings, then update Weaviate
 	FILENAME=$(echo $QUERY_STRING | sed 's/&/\n/' | egrep '^filename=' | sed 's/^filename=//' | base64 -d)
-	echo "creating chunks from file: $FILENAME"
-	./src/pipeline-advanced/create_chunks.py ../awsgpu-docs/collection/"$FILENAME".html.md.converted.md 2>&1
-	echo "creating embeddings from file: $FILENAME"
-	rm -f ../awsgpu-docs/collection/"$FILENAME".html.md.converted.md.chunks.jq.paraphrase-xlm-r-multilingual-v1.emb_cache.jsonl 2>&1
-	./src/pipeline-advanced/create_embeddings.py ../awsgpu-docs/collection/"$FILENAME".html.md.converted.md.chunks.jq 2>&1
-	echo "updating Weaviate from file: $FILENAME"
-	./src/pipeline-advanced/update_weaviate.py ../awsgpu-docs/collection/"$FILENAME".html.md.converted.md.chunks.jq.embeddings.ndjson 2>&1
+	echo "creating chunks and embeddings, updating Weaviate from file: $FILENAME"
+	./src/pipeline-advanced/ingest.py --keep-files ../awsgpu-docs/collection/"$FILENAME".html.md.converted.md 2>&1
 	;;
 
     /request) # request local model
@@ -2,11 +2,14 @@
 
 # Options:
 # -m: do not convert document to markdown, start from the md file
+# -c COLLECTION: Weaviate collection (or generation, see init_or_reset_collection.py) to update
 NO_CONVERT=""
-while getopts "nmh" opt; do
+COLLECTION=rag_chunks
+while getopts "nmhc:" opt; do
   case "$opt" in
       m) NO_CONVERT="-m" ;;
-      h) echo 'Usage: "$0" [-h] [-n] [-m] DOCUMENT' ; exit 0 ;;
+      c) COLLECTION="$OPTARG" ;;
+      h) echo 'Usage: "$0" [-h] [-n] [-m] [-c COLLECTION] DOCUMENT' ; exit 0 ;;
     *) ;;
   esac
 done
@@ -29,15 +32,5 @@ then
     ./src/pipeline-advanced/describe_images.py -t $INPUT_FILE.html.md
 fi
 
-echo creating chunks for text content:
-./src/pipeline-advanced/create_chunks.py $INPUT_FILE.html.md.converted.md
-
-echo removing embeddings cache:
-rm -f $INPUT_FILE.docx.html.md.converted.md.chunks.jq.paraphrase-xlm-r-multilingual-v1.emb_cache.jsonl
-
-echo creating embeddings for text content:
-./src/pipeline-advanced/create_embeddings.py $INPUT_FILE.html.md.converted.md.chunks.jq
-
-echo updating Weaviate for text content:
-./src/pipeline-advanced/update_weaviate.py $INPUT_FILE.html.md.converted.md.chunks.jq.embeddings.ndjson
-
+echo creating chunks and embeddings, updating Weaviate for text content:
+./src/pipeline-advanced/ingest.py --keep-files -c $COLLECTION $INPUT_FILE.html.md.converted.md
@@ -8,19 +8,25 @@ date
 #echo starting Weaviate:
 ./scripts/start-weaviate.sh
 
-echo init or reset collection:
-./src/pipeline-advanced/init_or_reset_collection.py
+# The documents go to a new generation of the collection, while the alias rag_chunks keeps
+# serving the current one; the alias is repointed once they are all in
+echo creating a new generation of the collection:
+GENERATION=$(./src/pipeline-advanced/init_or_reset_collection.py --blue-green) || exit 1
+echo $GENERATION
 
 #echo adding: CCTP.docx
-#./scripts/add-file.sh ../awsgpu-docs/collection/CCTP.docx
+#./scripts/add-file.sh -c $GENERATION ../awsgpu-docs/collection/CCTP.docx
 
 echo adding: CCTP_accueil.docx
-./scripts/add-file.sh ../awsgpu-docs/collection/CCTP_accueil.docx
+./scripts/add-file.sh -c $GENERATION ../awsgpu-docs/collection/CCTP_accueil.docx
 
 #echo adding new document directly from MarkDown: ../awsgpu-docs/MESDMP_Annexe_12.docx
-#./scripts/add-file.sh -m ../awsgpu-docs/MESDMP_Annexe_12.docx
+#./scripts/add-file.sh -m -c $GENERATION ../awsgpu-docs/MESDMP_Annexe_12.docx
 
 #echo adding new document directly from MarkDown: ../awsgpu-docs/Memoire_Technique.docx
-#./scripts/add-file.sh -m ../awsgpu-docs/Memoire_Technique.docx
+#./scripts/add-file.sh -m -c $GENERATION ../awsgpu-docs/Memoire_Technique.docx
+
+echo switching the collection to the new generation:
+./src/pipeline-advanced/init_or_reset_collection.py --promote $GENERATION
 
 date
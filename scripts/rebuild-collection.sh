@@ -0,0 +1,21 @@
+#!/bin/zsh
+
+# Rebuild the Weaviate collection from the Markdown files of a directory, without interrupting
+# queries: the files are ingested into a new generation of the collection, then the alias is
+# switched to it (see init_or_reset_collection.py --blue-green / --promote).
+# Usage: ./scripts/rebuild-collection.sh [DIRECTORY] (default: ../awsgpu-docs/collection)
+
+DIRECTORY=${1:-../awsgpu-docs/collection}
+
+echo creating a new generation of the collection:
+GENERATION=$(./src/pipeline-advanced/init_or_reset_collection.py --blue-green) || exit 1
+echo $GENERATION
+
+for FILE in "$DIRECTORY"/*.html.md.converted.md(N)
+do
+    echo "adding: $FILE"
+    ./src/pipeline-advanced/ingest.py --keep-files -c $GENERATION "$FILE" || exit 1
+done
+
+echo switching the collection to the new generation:
+./src/pipeline-advanced/init_or_reset_collection.py --promote $GENERATION
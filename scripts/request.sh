@@ -5,19 +5,28 @@ set -euo pipefail
 # -n: dry-run (propagate to merge step)
 # -r: enable reranking pipeline
 # -o: use OpenAI LLM in merge step
+# -H: hybrid search (vector + BM25 in one Weaviate query, see search_chunks.py)
+# -m: multi-query search (variants of the question generated by the local LLM, see query_variants.py)
+# $RERANK_TOP_M: candidates kept by the BM25 prefilter for the cross-encoder with -r (default: 100,
+#   0 to rerank all of them, see rerank.py)
 DRY_RUN=0
 RERANK=0
 OPENAI_LLM=0
+HYBRID=0
+MULTI_QUERY=0
+RERANK_TOP_M="${RERANK_TOP_M:-100}"
 
 usage() {
-  echo 'Usage: request.sh [-h] [-n] [-r] [-o] REQUEST'
+  echo 'Usage: request.sh [-h] [-n] [-r] [-o] [-H] [-m] REQUEST'
 }
 
-while getopts "nhro" opt; do
+while getopts "nhroHm" opt; do
   case "$opt" in
     n) DRY_RUN=1 ;;
     r) RERANK=1 ;;
     o) OPENAI_LLM=1 ;;
+    H) HYBRID=1 ;;
+    m) MULTI_QUERY=1 ;;
     h) usage; exit 0 ;;
     *) usage; exit 2 ;;
   esac
@@ -36,21 +45,46 @@ date
 PREFIX=$(mktemp /tmp/chunks-XXXXXXXXXX)
 JSONL="${PREFIX}.jsonl"
 
-if [[ $RERANK -eq 0 ]]; then
+typeset -a search_args
+search_args=()
+if [[ $HYBRID -eq 1 ]]; then
+  search_args+=(--hybrid)
+fi
+if [[ $MULTI_QUERY -eq 1 ]]; then
+  search_args+=(--expand)
+fi
+
+# The retrieval steps run in retrieval_server.py when it is up (models and Weaviate connection
+# kept warm), else each step runs as a script
+export RETRIEVAL_URL="${RETRIEVAL_URL:-http://127.0.0.1:8124}"
+if curl -sf -m 2 "$RETRIEVAL_URL/health" > /dev/null 2>&1; then
+  if [[ $RERANK -eq 0 ]]; then
+    echo "collecting 50 chunks for text content, adding titles (retrieval service):"
+  else
+    echo "collecting 500 candidate chunks for text content, reranking the $RERANK_TOP_M best of a BM25 prefilter, filtering 50 best chunks, adding titles (retrieval service):"
+  fi
+  jq -nc --arg question "$QUESTION" --argjson rerank $RERANK --argjson hybrid $HYBRID --argjson expand $MULTI_QUERY \
+    --argjson top_m "$RERANK_TOP_M" \
+    '{question: $question, rerank: ($rerank == 1), hybrid: ($hybrid == 1), expand: ($expand == 1), top_m: $top_m}' \
+    | curl -sSf -H "Content-Type: application/json" --data-binary @- "$RETRIEVAL_URL/retrieve" > "${JSONL}.embeddings.ndjson"
+  echo "${JSONL}.embeddings.ndjson"
+elif [[ $RERANK -eq 0 ]]; then
   echo "collecting 50 chunks for text content:"
-  ./src/pipeline-advanced/search_chunks.py "$QUESTION" > "$JSONL"
+  ./src/pipeline-advanced/search_chunks.py "${search_args[@]}" "$QUESTION" > "$JSONL"
 else
   echo "collecting 500 candidate chunks for text content:"
-  ./src/pipeline-advanced/search_chunks.py -k 500 "$QUESTION" > "${PREFIX}.initial-ranking.jsonl"
-  echo "reranking candidate chunks:"
-  ./src/pipeline-advanced/rerank.py "$QUESTION" "${PREFIX}.initial-ranking.jsonl"
+  ./src/pipeline-advanced/search_chunks.py "${search_args[@]}" -k 500 "$QUESTION" > "${PREFIX}.initial-ranking.jsonl"
+  echo "reranking the $RERANK_TOP_M best candidate chunks of a BM25 prefilter:"
+  ./src/pipeline-advanced/rerank.py --top-m "$RERANK_TOP_M" "$QUESTION" "${PREFIX}.initial-ranking.jsonl"
   echo "filtering 50 best chunks:"
   head -50 "${PREFIX}.initial-ranking.jsonl.reranked.jq" > "$JSONL"
 fi
-echo "$JSONL"
+if [[ ! -e "${JSONL}.embeddings.ndjson" ]]; then
+  echo "$JSONL"
 
-echo -n "updating chunks (adding titles): "
-./src/pipeline-advanced/process_chunks_add_title.py "$JSONL"
+  echo -n "updating chunks (adding titles): "
+  ./src/pipeline-advanced/process_chunks_add_title.py "$JSONL"
+fi
 
 echo
 echo "making request:"
@@ -5,9 +5,19 @@
 rm -f "$1".emb_values
 rm -f "$1".emb_names
 
+# Vectors are in the .npy file written next to the NDJSON by create_embeddings.py, or inline in older files
+VECTORS="${1%.ndjson}.npy"
+if test -f "$VECTORS"
+then
+    python3 -c 'import sys, numpy as np; np.savetxt(sys.argv[2], np.load(sys.argv[1]), fmt="%.8g", delimiter="\t")' "$VECTORS" "$1".emb_values
+fi
+
 for i in {1..$(wc -l "$1" | awk '{print $1;}' )}
 do
-    echo $(cat "$1" | sed -n "$i"p | jq -r '.embedding[]') | tr ' ' '\t' >> "$1".emb_values
+    if ! test -f "$VECTORS"
+    then
+        echo $(cat "$1" | sed -n "$i"p | jq -r '.embedding[]') | tr ' ' '\t' >> "$1".emb_values
+    fi
 
     #echo $(cat "$1" | sed -n "$i"p | jq -r .chunk_id) | tr ' ' '\t' >> "$1".emb_names
 
@@ -16,12 +16,14 @@ from typing import Optional, List
 import sys
 import argparse
 
+import model_registry
+
 try:
     from transformers import AutoTokenizer  # type: ignore
 except Exception as e:  # pragma: no cover
     AutoTokenizer = None  # type: ignore
 
-def _load_tokenizer(model_name: str):
+def load_tokenizer(model_name: str):
     if AutoTokenizer is None:
         raise RuntimeError(
             "transformers is not installed. Install it with: pip install transformers"
@@ -35,9 +37,10 @@ def _load_tokenizer(model_name: str):
 
 
 def count_tokens(text: str, model_name: str = "openai/gpt-oss-20b", add_special_tokens: bool = True) -> int:
-    tokenizer = _load_tokenizer(model_name)
-    # Use encode to directly control add_special_tokens behavior
-    input_ids = tokenizer.encode(text, add_special_tokens=add_special_tokens)
+    # Loaded once per process, see model_registry.py (fast tokenizers are not thread-safe: lock held)
+    with model_registry.using(("tokenizer", model_name), lambda: load_tokenizer(model_name)) as tokenizer:
+        # Use encode to directly control add_special_tokens behavior
+        input_ids = tokenizer.encode(text, add_special_tokens=add_special_tokens)
     return len(input_ids)
 
 
@@ -11,34 +11,55 @@ Create chunks from a Markdown file for a simple RAG pipeline.
       "heading": {"h2": "..."},
       "full_headings": "...",
       "keywords": ["...", ...],
-      "approx_tokens": 123
+      "approx_tokens": 123,
+      "content_hash": "..."
     }
+- Diff: <input>.chunks.diff.json lists the chunks added, removed and unchanged since the previous .chunks.jq.
 
 Constraints and behavior:
 - Chunk size ~200 tokens by default, configurable via CLI.
 - Simple token estimation without external libraries (based on word count).
+- Optionally (--tokenizer), token counts come from the embedding model's own Hugging Face fast tokenizer,
+  so chunks can be packed to the model's window (e.g. -s 126 for paraphrase-xlm-r-multilingual-v1, whose
+  128 word-pieces include <s> and </s>). Blocks are encoded in batches and their lengths memoized by hash.
+- Each line is classified once by a small block lexer (tokenize_markdown); the chunk packer only consumes these tokens.
 - No chunk crosses heading boundaries.
+- The input is streamed: chunks are written as soon as their heading section is closed.
 - List blocks are kept intact (never split across chunks), even if that exceeds the token budget.
 - Additionally, if a list block immediately follows paragraphs within the same heading level, the two preceding paragraphs (if present) are merged with the list into the same chunk.
 - Markdown tables are converted to simple text preserving their content.
 - HTML tables (<table>...</table>) are treated as atomic blocks that are never split; they also include up to the two immediately preceding paragraphs within the same heading (never across headings).
 - IMAGE DESCRIPTION blocks delimited by <IMAGE DESCRIPTION START> ... <IMAGE DESCRIPTION END> are atomic and include at least the two immediately preceding paragraphs within the same heading (never across headings). Tags may appear mid-line, and start and end may be on the same line.
 - Top-level fields include:
-  - Keywords extracted from the chunk text (simple top-N by frequency, minus stopwords).
+  - Keywords extracted from the chunk text: top-N terms (minus stopwords) by TF-IDF over the chunks of the
+    document, so that terms common to the whole document give way to the ones specific to the chunk.
+    --keywords freq restores the former top-N by raw frequency.
   - The active heading levels for the chunk.
   - The deepest heading for the chunk as "heading".
   - "full_headings": concatenation of all heading titles from h1 to hn, separated by ", ".
+  - "content_hash": SHA-256 of the heading path and whitespace-normalized text. Unlike chunk_id, which
+    is a sequence number, it does not change when an edit elsewhere in the document renumbers the chunks.
 """
 
 from __future__ import annotations
 
 import argparse
+import glob
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import operator
+import os
 import re
 import sys
-from collections import Counter
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 
 # Minimal bilingual (FR/EN) stopwords for simple keyword extraction.
@@ -68,10 +89,249 @@ def estimate_tokens(text: str) -> int:
     return len(text.split())
 
 
+def _load_tokenizer(model_name: str):
+    # Imported lazily: transformers is slow to import and only needed with --tokenizer
+    try:
+        from transformers import AutoTokenizer  # type: ignore
+    except Exception as exc:  # pragma: no cover
+        raise RuntimeError("transformers is not installed. Install it with: pip install transformers") from exc
+    return AutoTokenizer.from_pretrained(model_name, use_fast=True)
+
+
+class TokenCounter:
+    """
+    Token counts (special tokens excluded) from a Hugging Face fast tokenizer,
+    memoized by a hash of the counted text.
+    prime() encodes many blocks in one batched call so that count() is then a cache hit.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 1024, max_cache_entries: int = 500_000) -> None:
+        self.model_name = model_name
+        self.tokenizer = _load_tokenizer(model_name)
+        self.batch_size = batch_size
+        self.max_cache_entries = max_cache_entries
+        self._lengths: Dict[bytes, int] = {}
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _encode(self, texts: List[str]) -> List[int]:
+        encoded = self.tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _store(self, key: bytes, length: int) -> None:
+        if len(self._lengths) >= self.max_cache_entries:
+            self._lengths.clear()
+        self._lengths[key] = length
+
+    def prime(self, texts: Iterable[str]) -> None:
+        pending: Dict[bytes, str] = {}
+        for text in texts:
+            key = self._key(text)
+            if key not in self._lengths:
+                pending[key] = text
+        keys = list(pending)
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start : start + self.batch_size]
+            for key, length in zip(batch, self._encode([pending[k] for k in batch])):
+                self._store(key, length)
+
+    def count(self, text: str) -> int:
+        key = self._key(text)
+        length = self._lengths.get(key)
+        if length is None:
+            length = self._encode([text])[0]
+            self._store(key, length)
+        return length
+
+
+_token_counters: Dict[str, TokenCounter] = {}
+
+
+def get_token_counter(model_name: str) -> TokenCounter:
+    """
+    One TokenCounter per model and per process, so that its cache is shared by all the documents of a batch.
+    """
+    counter = _token_counters.get(model_name)
+    if counter is None:
+        counter = _token_counters[model_name] = TokenCounter(model_name)
+    return counter
+
+
 _heading_re = re.compile(r"^(?P<hashes>#{1,6})\s+(?P<title>.+?)\s*$")
+_list_item_re = re.compile(r"^\s*(?:[-*+]\s+|\d+[.)]\s+)")
+_continuation_re = re.compile(r"^\s{2,}\S")
+_table_sep_re = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)+\|?\s*$")
+_html_table_open_re = re.compile(r"^\s*<table\b", flags=re.IGNORECASE)
+_html_table_tag_re = re.compile(r"<table\b", flags=re.IGNORECASE)
+_html_table_close_re = re.compile(r"</table\s*>", flags=re.IGNORECASE)
+# Words of 3 chars or more; shorter runs are never keywords, so they are not even extracted.
+_keyword_token_re = re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿ0-9\-]{3,}")
+
+_IMAGE_START_TAG = "<IMAGE DESCRIPTION START>"
+_IMAGE_END_TAG = "<IMAGE DESCRIPTION END>"
+
+# Line token kinds produced by tokenize_markdown().
+TOK_BLANK = "blank"
+TOK_HEADING = "heading"
+TOK_HTML_TABLE = "html_table"
+TOK_IMAGE = "image"
+TOK_TABLE_ROW = "table_row"
+TOK_LIST_ITEM = "list_item"
+TOK_CONTINUATION = "continuation"
+TOK_PARAGRAPH = "paragraph"
+
+
+class LineToken(NamedTuple):
+    """
+    A Markdown line classified once by tokenize_markdown().
+
+    "kind" is the block role of the line when it starts a block, following the
+    chunker's priority order (heading, HTML table, image description, table row,
+    list item, continuation, paragraph). The boolean fields keep the other
+    properties of the line, since a line may be several things at once
+    (e.g. "  - item" is both a list item and an indented continuation).
+
+    "para_start" and "prev_text" are line indices maintained by the lexer so that
+    paragraph boundaries never need a backward scan: para_start is the first line
+    of the run of non-blank lines containing this line (the line itself for a
+    blank line), prev_text is the closest non-blank line before this one (-1 if none).
+    """
+
+    kind: str
+    text: str
+    level: int = 0
+    title: str = ""
+    blank: bool = False
+    list_start: bool = False
+    continuation: bool = False
+    pipe: bool = False
+    table_sep: bool = False
+    table_opens: int = 0
+    table_closes: int = 0
+    para_start: int = 0
+    prev_text: int = -1
+
+
+# NamedTuple.__new__ without its keyword-argument handling: the lexer builds one
+# token per line, so the constructor cost matters on large documents.
+_new_token = tuple.__new__
+_BLANK_FIELDS = (0, "", True, False, False, False, False, 0, 0)
+
+
+def _classify_line(line: str, idx: int, para_start: int, prev_text: int) -> LineToken:
+    stripped = line.lstrip()
+    if not stripped:
+        return _new_token(LineToken, (TOK_BLANK, line) + _BLANK_FIELDS + (idx, prev_text))
+
+    # Cheap character tests first; the regexes only confirm likely candidates.
+    first = stripped[0]
+    level = 0
+    title = ""
+    if first == "#" and line[0] == "#":
+        m = _heading_re.match(line)
+        if m:
+            level = len(m.group("hashes"))
+            title = m.group("title").strip()
+
+    list_start = (first in "-*+" or first.isdigit()) and _list_item_re.match(line) is not None
+    continuation = line[0] == "\t" or (line[0] != first and _continuation_re.match(line) is not None)
+    pipe = "|" in line
+    table_sep = pipe and "-" in line and _table_sep_re.match(line) is not None
+
+    html_open = False
+    image = False
+    table_opens = 0
+    table_closes = 0
+    if "<" in line:
+        html_open = first == "<" and _html_table_open_re.match(line) is not None
+        image = _IMAGE_START_TAG in line
+        table_opens = len(_html_table_tag_re.findall(line))
+        table_closes = len(_html_table_close_re.findall(line))
+
+    if level:
+        kind = TOK_HEADING
+    elif html_open:
+        kind = TOK_HTML_TABLE
+    elif image:
+        kind = TOK_IMAGE
+    elif pipe:
+        kind = TOK_TABLE_ROW
+    elif list_start:
+        kind = TOK_LIST_ITEM
+    elif continuation:
+        kind = TOK_CONTINUATION
+    else:
+        kind = TOK_PARAGRAPH
+
+    return _new_token(
+        LineToken,
+        (
+            kind, line, level, title, False, list_start, continuation, pipe, table_sep,
+            table_opens, table_closes, para_start, prev_text,
+        ),
+    )
 
 
-def parse_table_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
+def tokenize_markdown(lines: Iterable[str]) -> Iterator[LineToken]:
+    """
+    Single-pass block lexer: classify each line once into a LineToken.
+    The chunk packer and the block parsers below only look at these tokens,
+    so no line is probed by the same regex twice.
+    """
+    prev_text = -1
+    para_start = 0
+    for idx, line in enumerate(lines):
+        if prev_text != idx - 1:
+            para_start = idx
+        tok = _classify_line(line, idx, para_start, prev_text)
+        if not tok.blank:
+            prev_text = idx
+        yield tok
+
+
+class TokenStream:
+    """
+    Lazily filled window over the tokens produced by tokenize_markdown().
+
+    Tokens are addressed by absolute line index and pulled from the lexer only
+    when a parser looks ahead, so the whole document never has to be in memory.
+    release() drops the tokens of sections that have already been emitted.
+    """
+
+    def __init__(self, tokens: Iterable[LineToken]) -> None:
+        self._source = iter(tokens)
+        self._window: List[LineToken] = []
+        self.first = 0  # absolute index of self._window[0]
+
+    def has(self, idx: int) -> bool:
+        """Return True if a token exists at idx, reading ahead from the lexer as needed."""
+        while idx - self.first >= len(self._window):
+            tok = next(self._source, None)
+            if tok is None:
+                return False
+            self._window.append(tok)
+        return True
+
+    def __getitem__(self, idx: int) -> LineToken:
+        if idx < self.first or not self.has(idx):
+            raise IndexError(idx)
+        return self._window[idx - self.first]
+
+    def release(self, idx: int) -> None:
+        """Forget every token before idx."""
+        if idx > self.first:
+            del self._window[: idx - self.first]
+            self.first = idx
+
+
+def parse_table_block(tokens: TokenStream, start_idx: int) -> Tuple[str, int]:
     """
     Parse a GitHub-flavored Markdown table starting at start_idx.
     Returns a textual representation of the table and the index of the next line after the table.
@@ -81,27 +341,21 @@ def parse_table_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
     - Continue collecting rows while they contain '|'.
     """
     i = start_idx
-    if i >= len(lines):
+    if not tokens.has(i):
         return "", i
 
-    header_line = lines[i]
-    if "|" not in header_line:
+    if not tokens[i].pipe:
         return "", i
 
     # Must have a separator line next, consisting of dashes and pipes (roughly).
-    if i + 1 >= len(lines):
-        return "", i
-
-    sep_line = lines[i + 1]
-    sep_ok = bool(re.match(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)+\|?\s*$", sep_line))
-    if not sep_ok:
+    if not tokens.has(i + 1) or not tokens[i + 1].table_sep:
         return "", i
 
     # Collect table lines
-    table_lines = [header_line]
+    table_lines = [tokens[i].text]
     i += 2  # skip header and separator
-    while i < len(lines) and "|" in lines[i]:
-        table_lines.append(lines[i])
+    while tokens.has(i) and tokens[i].pipe:
+        table_lines.append(tokens[i].text)
         i += 1
 
     def split_row(row: str) -> List[str]:
@@ -129,28 +383,22 @@ def parse_table_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
     return table_text, i
 
 
-def parse_html_table_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
+def parse_html_table_block(tokens: TokenStream, start_idx: int) -> Tuple[str, int]:
     """
     Parse an HTML <table>...</table> block starting at start_idx (case-insensitive).
     Returns (block_text, next_index). The block is kept intact.
     """
     i = start_idx
-    if i >= len(lines):
-        return "", i
-
-    line = lines[i]
-    if not re.match(r"^\s*<table\b", line, flags=re.IGNORECASE):
+    if not tokens.has(i) or tokens[i].kind != TOK_HTML_TABLE:
         return "", i
 
     depth = 0
     collected: List[str] = []
-    while i < len(lines):
-        cur = lines[i]
-        opens = len(re.findall(r"<table\b", cur, flags=re.IGNORECASE))
-        closes = len(re.findall(r"</table\s*>", cur, flags=re.IGNORECASE))
-        depth += opens
-        collected.append(cur)
-        depth -= closes
+    while tokens.has(i):
+        cur = tokens[i]
+        depth += cur.table_opens
+        collected.append(cur.text)
+        depth -= cur.table_closes
         i += 1
         if depth <= 0:
             break
@@ -158,7 +406,7 @@ def parse_html_table_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
     return "\n".join(collected), i
 
 
-def parse_image_description_block(lines: List[str], start_idx: int) -> Tuple[str, int, str, str]:
+def parse_image_description_block(tokens: TokenStream, start_idx: int) -> Tuple[str, int, str, str]:
     """
     Parse a block delimited by <IMAGE DESCRIPTION START> ... <IMAGE DESCRIPTION END>.
     The tags may be mid-line and start/end may be on the same line.
@@ -169,14 +417,11 @@ def parse_image_description_block(lines: List[str], start_idx: int) -> Tuple[str
       - after_text is any text on the end line that appears after the end tag.
     """
     i = start_idx
-    if i >= len(lines):
+    if not tokens.has(i):
         return "", i, "", ""
 
-    start_tag = "<IMAGE DESCRIPTION START>"
-    end_tag = "<IMAGE DESCRIPTION END>"
-
-    line = lines[i]
-    start_pos = line.find(start_tag)
+    line = tokens[i].text
+    start_pos = line.find(_IMAGE_START_TAG)
     if start_pos == -1:
         return "", i, "", ""
 
@@ -185,13 +430,13 @@ def parse_image_description_block(lines: List[str], start_idx: int) -> Tuple[str
     after_text = ""
     first_line = True
 
-    while i < len(lines):
-        cur = lines[i]
+    while tokens.has(i):
+        cur = tokens[i].text
         segment = cur[start_pos:] if first_line else cur
 
-        end_pos = segment.find(end_tag)
+        end_pos = segment.find(_IMAGE_END_TAG)
         if end_pos != -1:
-            end_idx = end_pos + len(end_tag)
+            end_idx = end_pos + len(_IMAGE_END_TAG)
             collected.append(segment[:end_idx])
             after_text = segment[end_idx:]
             i += 1
@@ -206,12 +451,10 @@ def parse_image_description_block(lines: List[str], start_idx: int) -> Tuple[str
 
 
 def _is_list_item_start(line: str) -> bool:
-    return bool(re.match(r"^\s*(?:[-*+]\s+|\d+[.)]\s+)", line))
+    return _list_item_re.match(line) is not None
 
-def _is_indented_continuation(line: str) -> bool:
-    return bool(re.match(r"^\s{2,}\S", line)) or line.startswith("\t")
 
-def _parse_list_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
+def _parse_list_block(tokens: TokenStream, start_idx: int) -> Tuple[str, int]:
     """
     Parse a contiguous Markdown list block starting at start_idx.
     Keeps all list items (and their indented continuations) together.
@@ -219,19 +462,19 @@ def _parse_list_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
     """
     i = start_idx
     collected: List[str] = []
-    if i >= len(lines) or not _is_list_item_start(lines[i]):
+    if not tokens.has(i) or not tokens[i].list_start:
         return "", i
 
-    while i < len(lines):
-        ln = lines[i]
-        if _is_list_item_start(ln) or _is_indented_continuation(ln):
-            collected.append(ln)
+    while tokens.has(i):
+        tok = tokens[i]
+        if tok.list_start or tok.continuation:
+            collected.append(tok.text)
             i += 1
             continue
-        if not ln.strip():
+        if tok.blank:
             # Blank line: include it only if the following line continues the list.
-            if i + 1 < len(lines) and (_is_list_item_start(lines[i + 1]) or _is_indented_continuation(lines[i + 1])):
-                collected.append(ln)
+            if tokens.has(i + 1) and (tokens[i + 1].list_start or tokens[i + 1].continuation):
+                collected.append(tok.text)
                 i += 1
                 continue
             break
@@ -240,146 +483,241 @@ def _parse_list_block(lines: List[str], start_idx: int) -> Tuple[str, int]:
     return "\n".join(collected), i
 
 
-def _collect_previous_paragraph(lines: List[str], list_start_idx: int) -> Tuple[Optional[List[str]], int]:
+def _collect_previous_paragraph(tokens: TokenStream, list_start_idx: int) -> Tuple[int, int]:
     """
     If a list block at list_start_idx is immediately preceded (ignoring blank lines)
     by one or two regular paragraphs within the same heading (i.e., no intervening heading),
-    return (para_lines, gap_blank_count), where para_lines may span up to two paragraphs.
-    Otherwise return (None, 0).
-    """
-    # Move to previous non-blank line (end of the closest paragraph)
-    j = list_start_idx - 1
-    gap_blank_count = 0
-    while j >= 0 and lines[j].strip() == "":
-        gap_blank_count += 1
-        j -= 1
+    return (para_line_count, gap_blank_count): the lines list_start_idx - gap_blank_count - para_line_count
+    up to list_start_idx - gap_blank_count - 1 hold the paragraphs (blank separators included).
+    Otherwise return (0, 0).
 
+    Runs in O(1) using the paragraph indices recorded by the lexer.
+    """
+    # Closest non-blank line before the list (end of the closest paragraph)
+    j = tokens[list_start_idx].prev_text
     if j < 0:
-        return None, 0
+        return 0, 0
+    gap_blank_count = list_start_idx - 1 - j
 
     # If the previous non-blank line is a heading or a list start, do not include it.
-    if _heading_re.match(lines[j]) or _is_list_item_start(lines[j]):
-        return None, 0
-
-    # Collect paragraph 1 (the closest one).
-    p1_end = j
-    k = p1_end - 1
-    while k >= 0 and lines[k].strip() != "":
-        k -= 1
-    p1_start = k + 1
+    if tokens[j].kind == TOK_HEADING or tokens[j].list_start:
+        return 0, 0
 
-    # Initialize range to include p1.
-    include_start = p1_start
-    include_end = p1_end
+    # Paragraph 1 (the closest one).
+    include_start = tokens[j].para_start
+    if include_start <= tokens.first:
+        # The paragraph reaches back to the section heading (or the document start):
+        # nothing earlier can be merged, and the lines before it are no longer loaded.
+        return j - include_start + 1, gap_blank_count
 
     # Look for a second previous paragraph separated by blank lines,
     # but stop if we encounter a heading or list start (to avoid crossing headings).
-    j2 = p1_start - 1
-    # Skip blanks between paragraphs
-    while j2 >= 0 and lines[j2].strip() == "":
-        j2 -= 1
-
-    if j2 >= 0 and not _heading_re.match(lines[j2]) and not _is_list_item_start(lines[j2]):
-        # Collect paragraph 2
-        p2_end = j2
-        k2 = p2_end - 1
-        while k2 >= 0 and lines[k2].strip() != "":
-            k2 -= 1
-        p2_start = k2 + 1
-        include_start = p2_start
+    j2 = tokens[include_start].prev_text
+    if j2 >= 0 and tokens[j2].kind != TOK_HEADING and not tokens[j2].list_start:
+        include_start = tokens[j2].para_start
 
-    para_lines = lines[include_start : include_end + 1]
-    return para_lines, gap_blank_count
+    return j - include_start + 1, gap_blank_count
 
 
-def _collect_previous_paragraph_from_buffer_blocks(buffer_blocks: List[str]) -> Tuple[Optional[List[str]], int]:
+def _is_plain_block(block: str) -> bool:
     """
-    Inspect buffer_blocks to collect up to two previous plain-text paragraphs (single-line blocks).
-    This avoids mismatches with previously transformed blocks (e.g., Markdown tables converted to "TABLE: ...").
-    Returns (para_lines, gap_blank_count) where para_lines is a list of lines or None.
+    A "plain" block is a single-line paragraph line (not list, not table, not image block).
+    """
+    if not block or "\n" in block:
+        return False
+    st = block.strip()
+    if not st:
+        return False
+    first = st[0]
+    if (first in "-*+" or first.isdigit()) and _is_list_item_start(st):
+        return False
+    if st[:6].lower() in ("table:", "<table"):
+        return False
+    if "<" in st and "<image description start>" in st.lower():
+        return False
+    return True
+
+
+class _BlockBuffer:
+    """
+    Blocks buffered for the current heading section.
+
+    Alongside each block, the length of the run ending at that block is kept for
+    three properties, updated incrementally on append:
+    - verbatim: the block is the unchanged text of a single source line,
+    - plain: the block is a plain single-line paragraph (see _is_plain_block),
+    - blank: the block is whitespace only.
+    This turns the "two preceding paragraphs" lookups into O(1) operations instead
+    of backward scans of the buffer.
     """
-    j = len(buffer_blocks) - 1
-    gap_blank_count = 0
-    # Skip trailing blanks between the last paragraph and the current block
-    while j >= 0 and buffer_blocks[j].strip() == "":
-        gap_blank_count += 1
-        j -= 1
-
-    if j < 0:
-        return None, 0
-
-    def is_plain_line(s: str) -> bool:
-        # A "plain line" is a single-line paragraph line (not list, not table, not image block)
-        if not s or "\n" in s:
-            return False
-        st = s.strip()
-        if not st:
-            return False
-        if _is_list_item_start(st):
-            return False
-        low = st.lower()
-        if low.startswith("table:") or low.startswith("<table") or "<image description start>" in low:
-            return False
-        return True
-
-    # Collect paragraph 1 (closest to the end)
-    p1: List[str] = []
-    while j >= 0 and is_plain_line(buffer_blocks[j]):
-        p1.append(buffer_blocks[j])
-        j -= 1
-    p1.reverse()
-    if not p1:
-        return None, 0
-
-    # Skip blanks between paragraphs
-    while j >= 0 and buffer_blocks[j].strip() == "":
-        j -= 1
-
-    # Collect paragraph 2 if present
-    p2: List[str] = []
-    while j >= 0 and is_plain_line(buffer_blocks[j]):
-        p2.append(buffer_blocks[j])
-        j -= 1
-    p2.reverse()
-
-    para_lines = (p2 + p1) if p2 else p1
-    return para_lines, gap_blank_count
-
 
-def extract_keywords(text: str, top_n: int = 5) -> List[str]:
+    def __init__(self) -> None:
+        self.blocks: List[str] = []
+        self._runs: List[Tuple[int, int, int]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.blocks)
+
+    def append(self, block: str, verbatim: bool = False) -> None:
+        prev_verbatim, prev_plain, prev_blank = self._runs[-1] if self._runs else (0, 0, 0)
+        blank = not block.strip()
+        self.blocks.append(block)
+        self._runs.append(
+            (
+                prev_verbatim + 1 if verbatim else 0,
+                prev_plain + 1 if not blank and _is_plain_block(block) else 0,
+                prev_blank + 1 if blank else 0,
+            )
+        )
+
+    def drop_tail(self, count: int) -> List[str]:
+        if count <= 0:
+            return []
+        dropped = self.blocks[-count:]
+        del self.blocks[-count:]
+        del self._runs[-count:]
+        return dropped
+
+    def pop_trailing_blanks(self) -> List[bool]:
+        """
+        Remove trailing blank blocks. Returns, for each of them, whether restoring
+        it as "" keeps it equal to its source line (see restore_blanks).
+        """
+        count = self._runs[-1][2] if self._runs else 0
+        restorable = [
+            self.blocks[k] == "" and self._runs[k][0] > 0
+            for k in range(len(self.blocks) - count, len(self.blocks))
+        ]
+        self.drop_tail(count)
+        return restorable
+
+    def restore_blanks(self, restorable: List[bool]) -> None:
+        # Popped blanks come back as empty strings.
+        for verbatim in restorable:
+            self.append("", verbatim)
+
+    def verbatim_tail(self) -> int:
+        """Number of trailing blocks that are unchanged single source lines."""
+        return self._runs[-1][0] if self._runs else 0
+
+    def previous_plain_paragraphs(self) -> Tuple[int, int, int]:
+        """
+        Describe up to two plain paragraphs at the end of the buffer:
+        returns (p1_count, gap_blank_count, p2_count), where p1 is the closest
+        paragraph and gap_blank_count the number of blank blocks between p2 and p1.
+        """
+        if not self._runs:
+            return 0, 0, 0
+        end = len(self._runs) - 1
+        p1_count = self._runs[end][1]
+        if not p1_count:
+            return 0, 0, 0
+        k = end - p1_count
+        gap = self._runs[k][2] if k >= 0 else 0
+        k -= gap
+        p2_count = self._runs[k][1] if k >= 0 else 0
+        return p1_count, gap, p2_count
+
+    def clear(self) -> None:
+        self.blocks = []
+        self._runs = []
+
+
+def keyword_terms(text: str) -> List[str]:
     """
-    Simple keyword extraction:
+    Candidate keywords of a text:
     - Lowercase
     - Strip punctuation except intra-word hyphens
-    - Remove stopwords and tokens shorter than 3 chars
-    - Count frequency and return top_n
+    - Remove stopwords, numbers and tokens shorter than 3 chars
     """
     # Normalize and split on non-letters/digits/hyphens
-    tokens = re.findall(r"[A-Za-zÀ-ÖØ-öø-ÿ0-9\-]+", text.lower())
-    tokens = [t for t in tokens if len(t) >= 3 and t not in _STOPWORDS and not t.isdigit()]
-    counts = Counter(tokens)
+    tokens = _keyword_token_re.findall(text.lower())
+    return [t for t in tokens if t not in _STOPWORDS and not t.isdigit()]
+
+
+def extract_keywords(text: str, top_n: int = 5) -> List[str]:
+    """
+    Simple keyword extraction: the top_n most frequent keyword_terms() of text.
+    """
+    counts = Counter(keyword_terms(text))
     if not counts:
         return []
     # Most common, preserving order deterministically
     return [tok for tok, _ in counts.most_common(top_n)]
 
 
-def build_chunks_from_markdown(
-    md_text: str, chunk_size_tokens: int, source: str
-) -> List[Dict]:
+def inverse_document_frequencies(document_frequencies: Counter, n_chunks: int) -> Dict[str, float]:
+    """
+    Smoothed IDF, each chunk of the document being a "document": ln((1 + n) / (1 + df)) + 1.
+    """
+    return {
+        term: math.log((1 + n_chunks) / (1 + df)) + 1.0 for term, df in document_frequencies.items()
+    }
+
+
+def top_tfidf_terms(term_counts: Counter, idf: Dict[str, float], top_n: int = 5) -> List[str]:
+    """
+    The top_n terms of a chunk by tf * idf; ties keep the order of first occurrence.
+    """
+    # (score, -rank, term) tuples built in C: no Python-level key function per term
+    scored = zip(map(operator.mul, term_counts.values(), map(idf.__getitem__, term_counts)), itertools.count(0, -1), term_counts)
+    return [term for _, _, term in heapq.nlargest(top_n, scored)]
+
+
+def assign_tfidf_keywords(chunks: List[Dict], top_n: int = 5) -> None:
+    """
+    Set the "keywords" of every chunk of a document, in place, by TF-IDF over these chunks.
+    Each chunk is tokenized once; term counts are kept as sparse term -> count mappings.
+    """
+    term_counts = [Counter(keyword_terms(ch["text"])) for ch in chunks]
+    df: Counter = Counter()
+    for counts in term_counts:
+        df.update(counts.keys())
+    idf = inverse_document_frequencies(df, len(chunks))
+    for ch, counts in zip(chunks, term_counts):
+        ch["keywords"] = top_tfidf_terms(counts, idf, top_n)
+
+
+def content_hash(headings: Dict[str, str], text: str) -> str:
+    """
+    Content-addressed identity of a chunk: SHA-256 of its heading path (h1..hn) and its text,
+    whitespace-normalized so that re-exports that only reflow lines keep the same hash.
+    """
+    path = "\x1f".join(f"{lvl}={title}" for lvl, title in headings.items())
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{path}\x1e{normalized}".encode("utf-8")).hexdigest()
+
+
+def iter_chunks_from_markdown(
+    lines: Iterable[str],
+    chunk_size_tokens: int,
+    source: str,
+    token_counter: Optional[TokenCounter] = None,
+    with_keywords: bool = True,
+) -> Iterator[Dict]:
     """
     Build chunks by walking the Markdown:
     - Maintain heading context (h1..h6).
     - Convert tables into plain text blocks.
     - Accumulate lines within the same heading context up to the token budget.
     - Emit chunks that never cross heading boundaries.
+
+    Chunks are yielded as soon as their heading section is closed, with their final
+    chunk_id, so memory stays bounded by the largest section rather than the document.
+
+    Token counts use token_counter when given, estimate_tokens otherwise.
+    Keywords are computed per chunk by raw frequency (extract_keywords); with
+    with_keywords=False they are left empty for a document-level pass such as
+    assign_tfidf_keywords(), which needs every chunk of the document first.
     """
-    lines = md_text.splitlines()
-    chunks: List[Dict] = []
+    measure = token_counter.count if token_counter is not None else estimate_tokens
+    tokens = TokenStream(tokenize_markdown(lines))
+    stem = Path(source).stem
+    emitted = 0
 
     # Active heading context, mapping level -> title
     headings: Dict[int, str] = {}
-    buffer_blocks: List[str] = []
+    buffer = _BlockBuffer()
 
     def current_headings_meta() -> Dict[str, str]:
         # Build an ordered dict-like mapping h1..h6 for metadata
@@ -388,21 +726,20 @@ def build_chunks_from_markdown(
             meta[f"h{lvl}"] = headings[lvl]
         return meta
 
-    def emit_buffer_as_chunks():
-        nonlocal buffer_blocks
-        if not buffer_blocks:
-            return
+    def emit_buffer_as_chunks() -> List[Dict]:
+        chunks: List[Dict] = []
+        if not buffer:
+            return chunks
 
         # Pack blocks (list blocks or single lines) into chunks without splitting list blocks.
         out_blocks: List[str] = []
         approx = 0
-        chunk_idx_local = 0
 
         def finalize_one(out_text: str):
-            nonlocal chunk_idx_local
-            chunk_idx_local += 1
+            nonlocal emitted
+            emitted += 1
             meta_headings = current_headings_meta()
-            keywords = extract_keywords(out_text, top_n=5)
+            keywords = extract_keywords(out_text, top_n=5) if with_keywords else []
             # Compute deepest heading and concatenated full headings
             deepest_heading: Dict[str, str] = {}
             if headings:
@@ -413,18 +750,21 @@ def build_chunks_from_markdown(
 
             chunks.append(
                 {
-                    "chunk_id": f"{Path(source).name}-h{'.'.join(str(k) for k in sorted(headings.keys())) or '0'}-{len(chunks)+1}",
+                    "chunk_id": f"{stem}-{emitted}",
                     "text": out_text,
                     "headings": meta_headings,
                     "heading": deepest_heading,
                     "full_headings": full_headings,
                     "keywords": keywords,
-                    "approx_tokens": estimate_tokens(out_text),
+                    "approx_tokens": measure(out_text),
+                    "content_hash": content_hash(meta_headings, out_text),
                 }
             )
 
-        for block in buffer_blocks:
-            block_tokens = estimate_tokens(block)
+        if token_counter is not None:
+            token_counter.prime(buffer.blocks)
+        for block in buffer.blocks:
+            block_tokens = measure(block)
             # If adding this block would exceed the budget and we already have content, flush first.
             if out_blocks and (approx + block_tokens) > chunk_size_tokens:
                 finalize_one("\n".join(out_blocks).strip())
@@ -438,23 +778,23 @@ def build_chunks_from_markdown(
         if out_blocks:
             finalize_one("\n".join(out_blocks).strip())
 
-        buffer_blocks = []
+        buffer.clear()
+        return chunks
 
     i = 0
-    while i < len(lines):
-        line = lines[i]
+    while tokens.has(i):
+        tok = tokens[i]
 
         # Heading?
-        m = _heading_re.match(line)
-        if m:
+        if tok.kind == TOK_HEADING:
             # New heading -> finish current buffer into chunks first
-            emit_buffer_as_chunks()
+            yield from emit_buffer_as_chunks()
+            tokens.release(i)
 
-            level = len(m.group("hashes"))
-            title = m.group("title").strip()
+            level = tok.level
 
             # Update heading context: set this level and drop deeper ones
-            headings[level] = title
+            headings[level] = tok.title
             for deeper in list(headings.keys()):
                 if deeper > level:
                     del headings[deeper]
@@ -462,152 +802,430 @@ def build_chunks_from_markdown(
             continue
 
         # HTML table block?
-        html_table_text, next_i = parse_html_table_block(lines, i)
-        if html_table_text:
+        if tok.kind == TOK_HTML_TABLE:
+            html_table_text, next_i = parse_html_table_block(tokens, i)
             # Include up to two immediately preceding paragraphs within the same heading.
-            para_lines, gap_blanks = _collect_previous_paragraph(lines, i)
-            if para_lines:
-                popped_blanks = 0
-                while buffer_blocks and buffer_blocks[-1].strip() == "":
-                    buffer_blocks.pop()
-                    popped_blanks += 1
-
-                idx_end = len(buffer_blocks)
-                if idx_end >= len(para_lines) and buffer_blocks[idx_end - len(para_lines) : idx_end] == para_lines:
-                    del buffer_blocks[idx_end - len(para_lines) : idx_end]
+            para_count, gap_blanks = _collect_previous_paragraph(tokens, i)
+            if para_count:
+                popped_blanks = buffer.pop_trailing_blanks()
+
+                # The paragraph lines are merged only if they are still buffered unchanged.
+                if buffer.verbatim_tail() >= para_count:
+                    para_lines = buffer.drop_tail(para_count)
                     separator = "\n\n" if gap_blanks > 0 else "\n"
                     combined = "\n".join(para_lines) + separator + html_table_text
-                    buffer_blocks.append(combined)
+                    buffer.append(combined)
                     i = next_i
                     continue
                 else:
                     # Restore popped blanks; fall back to plain table handling.
-                    buffer_blocks.extend([""] * popped_blanks)
+                    buffer.restore_blanks(popped_blanks)
 
-            buffer_blocks.append(html_table_text)
+            buffer.append(html_table_text, verbatim=next_i == i + 1)
             i = next_i
             continue
 
         # IMAGE DESCRIPTION block?
-        if "<IMAGE DESCRIPTION START>" in line:
-            img_text, next_i, pre_text, post_text = parse_image_description_block(lines, i)
+        if tok.kind == TOK_IMAGE:
+            img_text, next_i, pre_text, post_text = parse_image_description_block(tokens, i)
 
             # Build an atomic block including any inline prefix/suffix on the same line
             atomic_img = f"{pre_text or ''}{img_text}{post_text or ''}"
 
             # Include at least the two immediately preceding paragraphs within the same heading.
             # Prefer collecting from the buffer to avoid mismatches with transformed blocks (e.g., tables).
-            popped_blanks = 0
-            while buffer_blocks and buffer_blocks[-1].strip() == "":
-                buffer_blocks.pop()
-                popped_blanks += 1
-
-            para_lines, gap_blanks = _collect_previous_paragraph_from_buffer_blocks(buffer_blocks)
-            if para_lines:
-                # Remove those paragraph lines from the buffer tail (they are single-line blocks)
-                if len(buffer_blocks) >= len(para_lines) and buffer_blocks[-len(para_lines):] == para_lines:
-                    del buffer_blocks[-len(para_lines):]
+            popped_blanks = buffer.pop_trailing_blanks()
+
+            p1_count, p2_gap, p2_count = buffer.previous_plain_paragraphs()
+            if p1_count:
+                p1_lines = buffer.drop_tail(p1_count)
+                if p2_count and p2_gap:
+                    # Paragraph 2 is separated by blank blocks: it is copied into the
+                    # combined block but stays in the buffer.
+                    p2_lines = buffer.blocks[len(buffer.blocks) - p2_gap - p2_count : len(buffer.blocks) - p2_gap]
                 else:
-                    # Fallback removal if there is a slight mismatch; match from the end line-by-line.
-                    k = len(para_lines) - 1
-                    while buffer_blocks and k >= 0 and buffer_blocks[-1] == para_lines[k]:
-                        buffer_blocks.pop()
-                        k -= 1
-                separator = "\n\n" if gap_blanks > 0 else "\n"
-                combined = "\n".join(para_lines) + separator + atomic_img
-                buffer_blocks.append(combined)
+                    p2_lines = buffer.drop_tail(p2_count)
+                # Trailing blanks were popped above, so the paragraphs directly precede the block.
+                combined = "\n".join(p2_lines + p1_lines) + "\n" + atomic_img
+                buffer.append(combined)
                 i = next_i
                 continue
             else:
                 # Restore popped blanks; fall back to plain handling.
-                buffer_blocks.extend([""] * popped_blanks)
+                buffer.restore_blanks(popped_blanks)
 
             # No paragraph merge; keep the atomic image block as-is.
-            buffer_blocks.append(atomic_img)
+            buffer.append(atomic_img, verbatim=next_i == i + 1)
             i = next_i
             continue
 
         # Markdown table block?
-        table_text, next_i = parse_table_block(lines, i)
-        if table_text:
-            buffer_blocks.append(table_text)
-            i = next_i
-            continue
-        
+        if tok.kind == TOK_TABLE_ROW:
+            table_text, next_i = parse_table_block(tokens, i)
+            if table_text:
+                buffer.append(table_text)
+                i = next_i
+                continue
+
         # List block?
-        if _is_list_item_start(line):
-            list_text, next_i = _parse_list_block(lines, i)
+        if tok.list_start:
+            list_text, next_i = _parse_list_block(tokens, i)
             if list_text:
                 # Try to include the immediately preceding paragraph in the same chunk,
                 # as long as there is no intervening heading (to avoid spanning headings).
-                para_lines, gap_blanks = _collect_previous_paragraph(lines, i)
-                if para_lines:
+                para_count, gap_blanks = _collect_previous_paragraph(tokens, i)
+                if para_count:
                     # Remove the paragraph lines (and trailing blanks) that were already buffered.
-                    popped_blanks = 0
-                    while buffer_blocks and buffer_blocks[-1].strip() == "":
-                        buffer_blocks.pop()
-                        popped_blanks += 1
-
-                    idx_end = len(buffer_blocks)
-                    if idx_end >= len(para_lines) and buffer_blocks[idx_end - len(para_lines) : idx_end] == para_lines:
-                        del buffer_blocks[idx_end - len(para_lines) : idx_end]
+                    popped_blanks = buffer.pop_trailing_blanks()
+
+                    if buffer.verbatim_tail() >= para_count:
+                        para_lines = buffer.drop_tail(para_count)
                         # Build a combined block so it can't be split across chunks.
                         separator = "\n\n" if gap_blanks > 0 else "\n"
                         combined = "\n".join(para_lines) + separator + list_text
-                        buffer_blocks.append(combined)
+                        buffer.append(combined)
                         i = next_i
                         continue
                     else:
                         # Restore popped blanks; fall back to regular list handling.
-                        buffer_blocks.extend([""] * popped_blanks)
+                        buffer.restore_blanks(popped_blanks)
 
-                buffer_blocks.append(list_text)
+                buffer.append(list_text, verbatim=next_i == i + 1)
                 i = next_i
                 continue
 
         # Regular text line
-        buffer_blocks.append(line)
+        buffer.append(tok.text, verbatim=True)
         i += 1
 
     # Flush any remaining content
-    emit_buffer_as_chunks()
+    yield from emit_buffer_as_chunks()
 
-    # Ensure chunk_ids are sequential and stable
-    for idx, ch in enumerate(chunks, start=1):
-        ch["chunk_id"] = f"{Path(source).stem}-{idx}"
 
+def build_chunks_from_markdown(
+    md_text: str,
+    chunk_size_tokens: int,
+    source: str,
+    token_counter: Optional[TokenCounter] = None,
+    keywords: str = "tfidf",
+) -> List[Dict]:
+    """
+    In-memory variant of iter_chunks_from_markdown(): returns all chunks of md_text,
+    with keywords by TF-IDF over the document ("tfidf") or by raw frequency ("freq").
+    """
+    chunks = list(
+        iter_chunks_from_markdown(
+            md_text.splitlines(),
+            chunk_size_tokens=chunk_size_tokens,
+            source=source,
+            token_counter=token_counter,
+            with_keywords=keywords == "freq",
+        )
+    )
+    if keywords == "tfidf":
+        assign_tfidf_keywords(chunks)
     return chunks
 
 
-def write_chunks_jsonl(chunks: List[Dict], outpath: Path) -> None:
+def read_markdown_lines(path: Path) -> Iterator[str]:
+    """
+    Stream the lines of a Markdown file, split exactly like str.splitlines() on the whole text.
+    """
+    with path.open("r", encoding="utf-8") as f:
+        for physical_line in f:
+            yield from physical_line.splitlines()
+
+
+def write_chunks_jsonl(chunks: Iterable[Dict], outpath: Path) -> int:
+    """
+    Write chunks as JSONL, one line per chunk as they come. Returns the number of chunks written.
+    """
+    count = 0
     with outpath.open("w", encoding="utf-8") as f:
         for ch in chunks:
             f.write(json.dumps(ch, ensure_ascii=False) + "\n")
+            count += 1
+    return count
 
 
-def convert_markdown_to_chunks(input_path: str, chunk_size_tokens: int = 200) -> str:
+def read_chunk_identities(path: Path) -> List[Tuple[str, str]]:
     """
-    Convert a Markdown file into chunked JSONL (.chunks.jq).
-    Returns the output file path as a string.
+    Return (chunk_id, content_hash) for each chunk of an existing .chunks.jq.
+    Hashes are recomputed for files written before content_hash existed.
     """
+    identities: List[Tuple[str, str]] = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ch = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            digest = ch.get("content_hash") or content_hash(ch.get("headings") or {}, ch.get("text", ""))
+            identities.append((ch.get("chunk_id"), digest))
+    return identities
+
+
+def diff_chunks(previous: List[Tuple[str, str]], current: List[Tuple[str, str]]) -> Dict[str, List[Dict]]:
+    """
+    Match chunks by content_hash between two runs over the same document.
+    Identical chunks occurring several times are paired in document order.
+    """
+    pool: Dict[str, deque] = {}
+    for chunk_id, digest in previous:
+        pool.setdefault(digest, deque()).append(chunk_id)
+
+    added: List[Dict] = []
+    unchanged: List[Dict] = []
+    for chunk_id, digest in current:
+        candidates = pool.get(digest)
+        if candidates:
+            unchanged.append({"chunk_id": chunk_id, "previous_chunk_id": candidates.popleft(), "content_hash": digest})
+        else:
+            added.append({"chunk_id": chunk_id, "content_hash": digest})
+
+    leftover = {chunk_id for ids in pool.values() for chunk_id in ids}
+    removed = [{"chunk_id": chunk_id, "content_hash": digest} for chunk_id, digest in previous if chunk_id in leftover]
+    return {"added": added, "removed": removed, "unchanged": unchanged}
+
+
+_EMPTY_KEYWORDS = '"keywords": []'
+
+
+def _rewrite_with_tfidf_keywords(
+    path: Path, terms_path: Path, document_frequencies: Counter, n_chunks: int, top_n: int = 5
+) -> None:
+    """
+    Second pass over a streamed .chunks.jq: fill in the TF-IDF keywords once the document
+    frequencies of the whole document are known. terms_path holds, line by line, the
+    keyword_terms() of each chunk computed during the first pass, so chunks are neither
+    tokenized nor parsed again. Only one chunk is held in memory at a time.
+    """
+    idf = inverse_document_frequencies(document_frequencies, n_chunks)
+    rewritten = Path(f"{path}.kw")
+    try:
+        with path.open("r", encoding="utf-8") as src, terms_path.open("r", encoding="utf-8") as terms, rewritten.open(
+            "w", encoding="utf-8"
+        ) as out:
+            for line, chunk_terms in zip(src, terms):
+                found = top_tfidf_terms(Counter(chunk_terms.split()), idf, top_n)
+                # Inside a JSON string every '"' is escaped, so this can only match the "keywords" field itself.
+                out.write(line.replace(_EMPTY_KEYWORDS, f'"keywords": {json.dumps(found, ensure_ascii=False)}', 1))
+        os.replace(rewritten, path)
+    finally:
+        if rewritten.exists():
+            rewritten.unlink()
+
+
+def _convert_file(
+    input_path: str,
+    chunk_size_tokens: int,
+    with_diff: bool = True,
+    tokenizer: Optional[str] = None,
+    keywords: str = "tfidf",
+) -> Tuple[str, int, Optional[Dict]]:
     src = Path(input_path)
     if not src.exists():
         raise FileNotFoundError(f"Input file not found: {src}")
-    text = src.read_text(encoding="utf-8")
 
-    chunks = build_chunks_from_markdown(text, chunk_size_tokens=chunk_size_tokens, source=str(src))
     out_path = Path(f"{input_path}.chunks.jq")
-    write_chunks_jsonl(chunks, out_path)
-    return str(out_path)
+    tmp_path = Path(f"{out_path}.tmp")
+    terms_path = Path(f"{out_path}.terms.tmp")
+    previous = read_chunk_identities(out_path) if with_diff and out_path.exists() else []
+    current: List[Tuple[str, str]] = []
+    token_counter = get_token_counter(tokenizer) if tokenizer else None
+    document_frequencies: Counter = Counter()
+
+    def record(chunks: Iterable[Dict], terms_file) -> Iterator[Dict]:
+        for ch in chunks:
+            current.append((ch["chunk_id"], ch["content_hash"]))
+            if terms_file is not None:
+                chunk_terms = keyword_terms(ch["text"])
+                document_frequencies.update(set(chunk_terms))
+                terms_file.write(" ".join(chunk_terms) + "\n")
+            yield ch
+
+    try:
+        chunks = iter_chunks_from_markdown(
+            read_markdown_lines(src),
+            chunk_size_tokens=chunk_size_tokens,
+            source=str(src),
+            token_counter=token_counter,
+            with_keywords=keywords == "freq",
+        )
+        if keywords == "tfidf":
+            with terms_path.open("w", encoding="utf-8") as terms_file:
+                count = write_chunks_jsonl(record(chunks, terms_file), tmp_path)
+            _rewrite_with_tfidf_keywords(tmp_path, terms_path, document_frequencies, count)
+        else:
+            count = write_chunks_jsonl(record(chunks, None), tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        for leftover in (tmp_path, terms_path):
+            if leftover.exists():
+                leftover.unlink()
+
+    if not with_diff:
+        return str(out_path), count, None
+
+    delta = diff_chunks(previous, current)
+    with open(f"{input_path}.chunks.diff.json", "w", encoding="utf-8") as f:
+        json.dump({"source": str(src), "previous_chunks": len(previous), "chunks": count, **delta}, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return str(out_path), count, {k: len(v) for k, v in delta.items()}
+
+
+def convert_markdown_to_chunks(
+    input_path: str,
+    chunk_size_tokens: int = 200,
+    with_diff: bool = True,
+    tokenizer: Optional[str] = None,
+    keywords: str = "tfidf",
+) -> str:
+    """
+    Convert a Markdown file into chunked JSONL (.chunks.jq).
+    Returns the output file path as a string.
+
+    The input is streamed: chunks are written as each heading section closes.
+    They go to a temporary file first, renamed at the end, so that a failed run
+    never leaves a truncated .chunks.jq behind.
+
+    Unless with_diff is False, <input>.chunks.diff.json is also written, listing the
+    chunks added, removed and unchanged (matched by content_hash) since the previous
+    .chunks.jq, so that downstream stages can process only the delta.
+
+    When tokenizer names a Hugging Face model, chunk_size_tokens is measured with its
+    tokenizer instead of by word count.
+
+    keywords selects TF-IDF over the chunks of the document ("tfidf", filled in by a
+    second pass over the output) or raw frequency per chunk ("freq").
+    """
+    produced, _, _ = _convert_file(
+        input_path, chunk_size_tokens, with_diff=with_diff, tokenizer=tokenizer, keywords=keywords
+    )
+    return produced
+
+
+_BATCH_PATTERN = "*.converted.md"
+_MANIFEST_NAME = "chunks.manifest.json"
+
+
+def _is_glob(value: str) -> bool:
+    return any(c in value for c in "*?[")
+
+
+def expand_inputs(inputs: List[str], pattern: str = _BATCH_PATTERN) -> List[str]:
+    """
+    Expand command-line inputs into Markdown file paths:
+    - a directory contributes its files matching pattern (non-recursive),
+    - a glob pattern is expanded (for callers whose shell did not do it),
+    - any other value is kept as a file path.
+    Order is preserved and duplicates are removed.
+    """
+    files: List[str] = []
+    for value in inputs:
+        path = Path(value)
+        if path.is_dir():
+            files.extend(str(p) for p in sorted(path.glob(pattern)) if p.is_file())
+        elif _is_glob(value):
+            files.extend(p for p in sorted(glob.glob(value)) if Path(p).is_file())
+        else:
+            files.append(value)
+    return list(dict.fromkeys(files))
+
+
+def _chunk_one(
+    input_path: str, chunk_size_tokens: int, with_diff: bool, tokenizer: Optional[str], keywords: str
+) -> Dict:
+    """
+    Process-pool worker: chunk one document and report what happened.
+    """
+    started = time.perf_counter()
+    rec: Dict = {"input": input_path, "output": None, "chunks": 0}
+    try:
+        rec["output"], rec["chunks"], delta = _convert_file(
+            input_path, chunk_size_tokens, with_diff=with_diff, tokenizer=tokenizer, keywords=keywords
+        )
+        if delta is not None:
+            rec.update(delta)
+    except Exception as exc:
+        rec["error"] = str(exc)
+    rec["seconds"] = round(time.perf_counter() - started, 3)
+    return rec
+
+
+def convert_collection_to_chunks(
+    inputs: List[str],
+    chunk_size_tokens: int = 200,
+    jobs: Optional[int] = None,
+    manifest_path: Optional[str] = None,
+    pattern: str = _BATCH_PATTERN,
+    with_diff: bool = True,
+    tokenizer: Optional[str] = None,
+    keywords: str = "tfidf",
+) -> Tuple[str, List[Dict]]:
+    """
+    Chunk every document designated by inputs (files, directories or glob patterns)
+    in a process pool, writing one .chunks.jq per document as convert_markdown_to_chunks does.
+
+    A JSON manifest listing, per document, the output file, the chunk count, the
+    processing time, the added/removed/unchanged counts and any error is written to manifest_path (default:
+    chunks.manifest.json in the deepest directory common to all documents).
+    Returns (manifest_path, per-document records in input order).
+    """
+    files = expand_inputs(inputs, pattern=pattern)
+    if not files:
+        raise FileNotFoundError(f"No Markdown file found in: {' '.join(inputs)}")
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(files)))
+    started = time.perf_counter()
+    if jobs == 1:
+        results = [_chunk_one(f, chunk_size_tokens, with_diff, tokenizer, keywords) for f in files]
+    else:
+        # Largest documents first so that one big file does not end up alone at the tail.
+        by_size = sorted(files, key=lambda f: os.path.getsize(f) if os.path.exists(f) else 0, reverse=True)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                f: pool.submit(_chunk_one, f, chunk_size_tokens, with_diff, tokenizer, keywords) for f in by_size
+            }
+            results = [futures[f].result() for f in files]
+    elapsed = time.perf_counter() - started
+
+    if manifest_path is None:
+        common_dir = os.path.commonpath([str(Path(f).resolve().parent) for f in files])
+        manifest_path = str(Path(common_dir) / _MANIFEST_NAME)
+
+    manifest = {
+        "created_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z"),
+        "chunk_size_tokens": chunk_size_tokens,
+        "tokenizer": tokenizer,
+        "keywords": keywords,
+        "jobs": jobs,
+        "documents": len(results),
+        "chunks": sum(r["chunks"] for r in results),
+        "errors": sum(1 for r in results if "error" in r),
+        "seconds": round(elapsed, 3),
+        "files": results,
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return manifest_path, results
 
 
 def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(
-        description="Create simple RAG chunks from a Markdown file."
+        description="Create simple RAG chunks from a Markdown file, or from a whole collection in parallel."
     )
     parser.add_argument(
         "input",
-        help="Path to the input Markdown file",
+        nargs="+",
+        help=(
+            "Path to the input Markdown file. Several files, directories (scanned for --pattern) "
+            "or glob patterns switch to batch mode."
+        ),
     )
     parser.add_argument(
         "-s",
@@ -616,16 +1234,90 @@ def main(argv: Optional[List[str]] = None) -> int:
         default=200,
         help="Approximate token size of chunks (default: 200)",
     )
+    parser.add_argument(
+        "-t",
+        "--tokenizer",
+        default=None,
+        help=(
+            "Hugging Face model whose fast tokenizer measures the chunk size, instead of a word count "
+            "(e.g. sentence-transformers/paraphrase-xlm-r-multilingual-v1 with -s 126)"
+        ),
+    )
+    parser.add_argument(
+        "-k",
+        "--keywords",
+        choices=["tfidf", "freq"],
+        default="tfidf",
+        help="Keyword ranking: TF-IDF over the chunks of each document, or raw frequency per chunk (default: tfidf)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Batch mode: number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        default=None,
+        help=f"Batch mode: manifest path (default: {_MANIFEST_NAME} in the documents' common directory)",
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        default=_BATCH_PATTERN,
+        help=f'Batch mode: file pattern used inside directories (default: "{_BATCH_PATTERN}")',
+    )
+    parser.add_argument(
+        "--no-diff",
+        action="store_true",
+        help="Do not write <input>.chunks.diff.json (added/removed/unchanged chunks since the previous run)",
+    )
     args = parser.parse_args(argv)
 
+    batch = len(args.input) > 1 or any(Path(v).is_dir() or _is_glob(v) for v in args.input)
+    if not batch:
+        try:
+            produced = convert_markdown_to_chunks(
+                args.input[0],
+                chunk_size_tokens=args.chunk_size_tokens,
+                with_diff=not args.no_diff,
+                tokenizer=args.tokenizer,
+                keywords=args.keywords,
+            )
+        except Exception as exc:
+            print(f"Error: {exc}", file=sys.stderr)
+            return 1
+
+        print(produced)
+        return 0
+
     try:
-        produced = convert_markdown_to_chunks(args.input, chunk_size_tokens=args.chunk_size_tokens)
+        manifest_path, results = convert_collection_to_chunks(
+            args.input,
+            chunk_size_tokens=args.chunk_size_tokens,
+            jobs=args.jobs,
+            manifest_path=args.manifest,
+            pattern=args.pattern,
+            with_diff=not args.no_diff,
+            tokenizer=args.tokenizer,
+            keywords=args.keywords,
+        )
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
 
-    print(produced)
-    return 0
+    failed = 0
+    for rec in results:
+        if "error" in rec:
+            failed += 1
+            print(f"Error: {rec['input']}: {rec['error']}", file=sys.stderr)
+        else:
+            print(rec["output"])
+    print(manifest_path)
+    return 1 if failed else 0
+
 
 if __name__ == "__main__":
     raise SystemExit(main())
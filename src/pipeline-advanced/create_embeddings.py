@@ -3,24 +3,46 @@
 Create embeddings from Markdown chunks for a simple RAG pipeline.
 
 - Input: a JSONL file of chunks (as produced by create_chunks.py).
-- Output: NDJSON (.embeddings.ndjson) where each line is:
+- Output:
+  - .embeddings.npy: the vectors, one row per chunk, as a float32 (or float16, see --dtype) NumPy array;
+  - .embeddings.meta.json: what is common to all the chunks, written once:
     {
-      "chunk_id": "...",
-      "text": "...",
-      "embedding": [floats],
       "model": {"name": "...", "version": "..."},
       "created_at": "YYYY-MM-DDTHH:MM:SSZ",
+      "source": "<input>",
+      "records": 123,
+      "vectors": {"file": "<input>.embeddings.npy", "dtype": "float32", "shape": [123, 768]}
+    }
+  - .embeddings.ndjson: the metadata of each chunk, where each line is:
+    {
+      "chunk_id": "...",
+      "text": "...",
+      "embedding_row": 0,  (row of the vector in .embeddings.npy)
       "approx_tokens": 123,
       "keywords": ["...", ...],
       "headings": {"h1": "...", "h2": "...", ...},
       "heading": {"hN": "..."},
-      "full_headings": "..."
+      "full_headings": "...",
+      "content_hash": "..."  (when present in the input chunk)
     }
+  With --inline-vectors, each line also carries its vector as "embedding": [floats], as before.
+  Former versions repeated "model" and "created_at" on every line, which readers still accept.
 
 Behavior:
-- Uses sentence-transformers with the 'paraphrase-xlm-r-multilingual-v1' model.
-- Caches embeddings on disk to avoid recomputation across runs (per-model cache).
-- Streams input and encodes in small batches to limit memory use.
+- Uses sentence-transformers with the 'paraphrase-xlm-r-multilingual-v1' model, run by PyTorch,
+  or by ONNX Runtime with --backend onnx / onnx-int8 (see embedding_models.py).
+- Caches embeddings on disk to avoid recomputation across runs and documents: the cache
+  (embedding_cache.py) is shared by all inputs, keyed by model and version, and size-bounded.
+  Per-input caches left by former versions (.emb_cache.jsonl, or .emb_cache.f32/.keys/.json)
+  are imported into it on first use, then deleted.
+- Encodes the texts missing from the cache across the whole input at once, in batches of texts of
+  similar token lengths (so that little compute is spent on padding), then writes the outputs
+  in input order. With --workers, local encoding is spread over sentence-transformers'
+  multi-process pool, one single-threaded worker per core.
+- With --openai, requests are packed by token count and sent --openai-concurrency at a time,
+  rate limits and rejected batches being handled by openai_embeddings.py.
+- Logs to stderr, one JSON object per line: the start and end of the run, and progress events
+  sampled at most every --log-interval seconds, each with an excerpt of a text being embedded.
 - Prints the produced output filename.
 """
 
@@ -28,26 +50,39 @@ from __future__ import annotations
 
 import argparse
 import json
-import hashlib
 import os
+import struct
 import sys
+import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
-import sentence_transformers
 from sentence_transformers import SentenceTransformer
 
+from embedding_cache import EmbeddingCache
+from embedding_models import BACKENDS, backend_version, default_backend, load_model
+from openai_embeddings import OpenAIEmbedder
 
-_MODEL_NAME = "paraphrase-xlm-r-multilingual-v1"
-#_MODEL_NAME = "all-mpnet-base-v2"
-
-_OPENAI_MODEL_NAME = "text-embedding-3-large"
-_BATCH_SIZE = 64
 
+MODEL_NAME = "paraphrase-xlm-r-multilingual-v1"
+#MODEL_NAME = "all-mpnet-base-v2"
 
-def _iso_utc_now() -> str:
+OPENAI_MODEL_NAME = "text-embedding-3-large"
+_BATCH_SIZE = 64
+# Local encoding batches are sized so that texts x longest text (in tokens) stays below this budget:
+# as many texts as before when they are long, more of them when they are short
+_TOKEN_BUDGET = _BATCH_SIZE * 128
+_MAX_BATCH_SIZE = 1024
+# Below this number of texts to encode, starting worker processes costs more than it saves
+_POOL_MIN_TEXTS = 4 * _BATCH_SIZE
+WRITE_BUFFER = 1024 * 1024
+_LOOKUP_BLOCK = 4096
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def iso_utc_now() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
 
@@ -70,207 +105,422 @@ def _extract_meta(chunk: Dict) -> tuple[List[str], Dict[str, str], Dict[str, str
     return keywords, headings, heading, full_headings
 
 
-def convert_chunks_to_embeddings(input_path: str, use_openai: bool = False) -> str:
+def _iter_chunks(lines: Iterable[str]) -> Iterator[Dict]:
+    for line in lines:
+        ln = line.strip()
+        if not ln:
+            continue
+        try:
+            yield json.loads(ln)
+        except json.JSONDecodeError:
+            # Skip malformed lines
+            continue
+
+
+def chunk_text(item: Dict) -> str:
+    txt = item.get("text", "")
+    if not isinstance(txt, str):
+        txt = str(txt)
+    return txt
+
+
+def embedding_record(item: Dict, row: int) -> Dict:
+    """
+    NDJSON record of a chunk whose vector is at the given row of the .npy file.
+    """
+    keywords, headings, heading, full_headings = _extract_meta(item)
+    rec = {
+        "chunk_id": item.get("chunk_id"),
+        "text": chunk_text(item),
+        "embedding_row": row,
+        "approx_tokens": item.get("approx_tokens"),
+        "keywords": keywords,
+        "headings": headings,
+        "heading": heading,
+        "full_headings": full_headings,
+    }
+    if item.get("content_hash"):
+        rec["content_hash"] = item["content_hash"]
+    return rec
+
+
+def physical_cores() -> int:
+    """
+    Number of physical cores this process may run on, hyperthreads counted once
+    (from /proc/cpuinfo, falling back to the number of logical CPUs elsewhere).
+    """
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    cores = set()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            physical_id = core_id = None
+            for line in f:
+                name, _, value = line.partition(":")
+                name = name.strip()
+                if name == "physical id":
+                    physical_id = value.strip()
+                elif name == "core id":
+                    core_id = value.strip()
+                elif not name:
+                    # A blank line ends the description of a logical CPU
+                    if core_id is not None:
+                        cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+    except OSError:
+        pass
+    return max(1, min(available, len(cores) or available))
+
+
+def length_sorted_batches(
+    lengths: List[int], token_budget: int = _TOKEN_BUDGET, max_batch_size: int = _MAX_BATCH_SIZE
+) -> List[List[int]]:
+    """
+    Group the indices of texts of the given token lengths into batches of similar lengths, longest first.
+    Each batch holds as many texts as fit in token_budget once padded to its longest one, so that
+    short and long texts are never padded together.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for i in order:
+        # The first text of a batch is its longest one, the length the others are padded to
+        if batch and ((len(batch) + 1) * max(lengths[batch[0]], 1) > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _token_lengths(model: SentenceTransformer, texts: List[str]) -> List[int]:
+    max_length = model.max_seq_length or None
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        lengths = [max(1, len(t) // 4) for t in texts]
+        return [min(n, max_length) for n in lengths] if max_length else lengths
+    lengths: List[int] = []
+    for start in range(0, len(texts), 4096):
+        enc = tokenizer(
+            texts[start : start + 4096],
+            add_special_tokens=True,
+            truncation=max_length is not None,
+            max_length=max_length,
+        )
+        lengths.extend(len(ids) for ids in enc["input_ids"])
+    return lengths
+
+
+def encode_local(
+    model: SentenceTransformer, texts: List[str], pool: Optional[Dict] = None
+) -> Iterator[Tuple[List[int], np.ndarray]]:
+    """
+    Encode texts by length-sorted batches, yielding (indices into texts, float32 vectors) per batch.
+    With a multi-process pool, consecutive batches are handed out to the workers a group at a time,
+    in chunks of _BATCH_SIZE texts (the pool splits its input in fixed-size chunks).
+    """
+    batches = length_sorted_batches(_token_lengths(model, texts))
+    if pool is None:
+        for batch in batches:
+            vecs = model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            yield batch, np.asarray(vecs, dtype=np.float32).reshape(len(batch), -1)
+        return
+    order = [i for batch in batches for i in batch]
+    group_size = 4 * len(pool["processes"]) * _BATCH_SIZE
+    for start in range(0, len(order), group_size):
+        group = order[start : start + group_size]
+        vecs = model.encode(
+            [texts[i] for i in group],
+            pool=pool,
+            chunk_size=_BATCH_SIZE,
+            batch_size=_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        yield group, np.asarray(vecs, dtype=np.float32).reshape(len(group), -1)
+
+
+def _start_pool(model: SentenceTransformer, workers: int) -> Dict:
+    # Each worker gets a single-threaded torch, so that N workers share N cores instead of
+    # each of them spreading over all the cores; spawned processes read these at startup.
+    saved = {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")}
+    os.environ.update({name: "1" for name in saved})
+    try:
+        return model.start_multi_process_pool(["cpu"] * workers)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class _RunLog:
+    """
+    Structured log of a run on stderr, one JSON object per line. Progress events are sampled:
+    at most one every interval seconds.
+    """
+
+    def __init__(self, interval: float = 5.0) -> None:
+        self.interval = interval
+        self._last_progress: Optional[float] = None
+
+    def event(self, event: str, **fields) -> None:
+        fields = {"ts": iso_utc_now(), "event": event, **fields}
+        print(JSON_ENCODER.encode(fields), file=sys.stderr, flush=True)
+
+    def progress(self, **fields) -> None:
+        now = time.monotonic()
+        if self._last_progress is not None and now - self._last_progress < self.interval:
+            return
+        self._last_progress = now
+        self.event("progress", **fields)
+
+
+class NpyRowWriter:
     """
-    Read chunks JSONL and write embeddings NDJSON to <input>.embeddings.ndjson.
+    Write a 2-D .npy file by blocks of rows, without knowing the number of rows in advance:
+    a fixed-size header is reserved first and filled in with the final shape by close().
+    """
+
+    _HEADER_SIZE = 128
+
+    def __init__(self, path: Path, dtype: str = "float32") -> None:
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.dim = 0
+        self._f = path.open("wb", buffering=WRITE_BUFFER)
+        self._f.write(b"\0" * self._HEADER_SIZE)
+
+    def write(self, block: np.ndarray) -> None:
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if not self.rows:
+            self.dim = int(block.shape[1])
+        self._f.write(block.tobytes())
+        self.rows += len(block)
+
+    def close(self) -> None:
+        header = repr(
+            {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (self.rows, self.dim)}
+        ).encode("latin1")
+        # NPY format 1.0: magic, version, header length, then the header padded with spaces and ending with a newline
+        header += b" " * (self._HEADER_SIZE - 10 - len(header) - 1) + b"\n"
+        self._f.seek(0)
+        self._f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header)
+        self._f.close()
+
+
+def convert_chunks_to_embeddings(
+    input_path: str,
+    use_openai: bool = False,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: Optional[int] = None,
+    dtype: str = "float32",
+    inline_vectors: bool = False,
+    log_interval: float = 5.0,
+    workers: int = 1,
+    backend: Optional[str] = None,
+    openai_concurrency: int = 8,
+) -> str:
+    """
+    Read chunks JSONL and write embeddings NDJSON to <input>.embeddings.ndjson, with the vectors
+    in <input>.embeddings.npy (dtype float32 or float16) unless inline_vectors is True, in which
+    case they are written to both.
     Returns the output file path as a string.
-    If use_openai is True, embeddings are computed via OpenAI API (model: text-embedding-3-large).
+    If use_openai is True, embeddings are computed via OpenAI API (model: text-embedding-3-large),
+    with up to openai_concurrency requests in flight (see openai_embeddings.py).
+    The model and creation date go to <input>.embeddings.meta.json; progress is logged to stderr
+    at most every log_interval seconds.
+    cache_dir and cache_max_mb override the location and size bound of the shared embedding cache.
+    workers > 1 spreads local encoding over that many processes (0: one per physical core).
+    backend selects how the local model runs (see embedding_models.py; default: $EMB_BACKEND or torch).
     """
     src = Path(input_path)
     if not src.exists():
         raise FileNotFoundError(f"Input file not found: {src}")
 
     out_path = Path(f"{input_path}.embeddings.ndjson")
+    vectors_path = Path(f"{input_path}.embeddings.npy")
+    meta_path = Path(f"{input_path}.embeddings.meta.json")
+    log = _RunLog(log_interval)
+    started = time.monotonic()
 
     # Initialize encoder or OpenAI client based on mode
     local_model: Optional[SentenceTransformer] = None
-    client = None
+    embedder: Optional[OpenAIEmbedder] = None
+    backend = backend or default_backend()
     if not use_openai:
-        local_model = SentenceTransformer(_MODEL_NAME)
+        local_model = load_model(MODEL_NAME, backend)
 
-    created_at = _iso_utc_now()
+    created_at = iso_utc_now()
     if use_openai:
         try:
             import openai as _openai_pkg  # lazy import to avoid dependency when not used
-            from openai import OpenAI as _OpenAI
         except Exception as e:
             raise RuntimeError("OpenAI package not installed. Install with: pip install openai") from e
         api_key = os.environ.get("OPENAIAPIKEY")
         if not api_key:
             raise RuntimeError("Environment variable OPENAIAPIKEY is not set.")
-        client = _OpenAI(api_key=api_key)
-        model_name = _OPENAI_MODEL_NAME
+        embedder = OpenAIEmbedder(OPENAI_MODEL_NAME, api_key, concurrency=openai_concurrency)
+        model_name = OPENAI_MODEL_NAME
         model_version = getattr(_openai_pkg, "__version__", "unknown")
     else:
-        model_name = _MODEL_NAME
-        model_version = getattr(sentence_transformers, "__version__", "unknown")
+        model_name = MODEL_NAME
+        model_version = backend_version(backend)
     model_info = {
         "name": model_name,
         "version": model_version,
     }
 
-    # Simple on-disk cache for embeddings to avoid recomputation across runs.
-    # One cache file per input and model name.
-    cache_path = Path(f"{input_path}.{model_name}.emb_cache.jsonl")
-    emb_cache: Dict[str, List[float]] = {}
-
-    def _cache_key(text: str) -> str:
-        """
-        Build a stable key for the given text, including model name and version to avoid collisions.
-        """
-        ver = model_info.get("version", "unknown")
-        payload = f"{model_name}\n{ver}\n".encode("utf-8") + (text if isinstance(text, bytes) else str(text)).encode("utf-8")
-        return hashlib.sha256(payload).hexdigest()
-
-    # Load existing cache entries
-    if cache_path.exists():
-        with cache_path.open("r", encoding="utf-8") as cf:
-            for ln in cf:
-                try:
-                    rec = json.loads(ln)
-                except json.JSONDecodeError:
-                    continue
-                k = rec.get("k")
-                v = rec.get("v")
-                if isinstance(k, str) and isinstance(v, list):
-                    try:
-                        emb_cache[k] = [float(x) for x in v]
-                    except Exception:
-                        continue
-
-    def _persist_cache_items(items: List[tuple[str, List[float]]]) -> None:
-        if not items:
-            return
-        with cache_path.open("a", encoding="utf-8") as cf:
-            for k, v in items:
-                cf.write(json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n")
-
-    texts: List[str] = []
-    rows: List[Dict] = []
-
-    def flush_batch():
-        nonlocal texts, rows
-        if not texts:
-            return
+    # On-disk cache for embeddings, shared by all inputs, to avoid recomputation across runs and documents.
+    emb_cache = EmbeddingCache(model_name, model_version, cache_dir=cache_dir, max_mb=cache_max_mb)
+    # Former versions only computed vectors with OpenAI or the torch backend
+    if use_openai or backend == "torch":
+        legacy_cache_base = f"{input_path}.{model_name}.emb_cache"
+        if Path(f"{legacy_cache_base}.jsonl").exists():
+            emb_cache.import_jsonl(Path(f"{legacy_cache_base}.jsonl"))
+        if Path(f"{legacy_cache_base}.json").exists():
+            emb_cache.import_binary(legacy_cache_base)
+
+    # First pass: collect the texts missing from the cache across the whole input, each once,
+    # so that they are encoded together in batches of similar lengths rather than in file order
+    missing: Dict[bytes, str] = {}
+    n_chunks = 0
+    # Looked up in the cache by blocks, with one binary search per segment
+    pending: Dict[bytes, str] = {}
+
+    def lookup_pending():
+        for (key, txt), vec in zip(pending.items(), emb_cache.get_many(list(pending))):
+            if vec is None:
+                missing[key] = txt
+        pending.clear()
 
-        # Resolve text embeddings using cache when possible
-        text_keys = [_cache_key(t) for t in texts]
-        text_embs: List[Optional[List[float]]] = [emb_cache.get(k) for k in text_keys]
-        to_compute_idx = [i for i, e in enumerate(text_embs) if e is None]
-        if to_compute_idx:
-            to_compute_texts = [texts[i] for i in to_compute_idx]
-            for t in to_compute_texts:
-                print(f"computing embedding for: {t}")
-            if use_openai:
-                # Normalize inputs for OpenAI API: replace newlines, avoid empty strings
-                norm_texts: List[str] = []
-                for s in to_compute_texts:
-                    s = s.replace("\r", " ").replace("\n", " ")
-                    s = s.strip()
-                    if not s:
-                        s = " "
-                    norm_texts.append(s)
-                try:
-                    resp = client.embeddings.create(
-                        model=model_name,
-                        input=norm_texts,
-                        encoding_format="float",
-                    )
-                    computed_list = [list(map(float, d.embedding)) for d in resp.data]
-                except Exception:
-                    # Fallback to per-item requests to isolate problematic inputs
-                    computed_list = []
-                    for s in norm_texts:
-                        try:
-                            r = client.embeddings.create(
-                                model=model_name,
-                                input=s,
-                                encoding_format="float",
-                            )
-                            computed_list.append(list(map(float, r.data[0].embedding)))
-                        except Exception:
-                            # As a last resort, embed a single space to ensure progress
-                            r = client.embeddings.create(
-                                model=model_name,
-                                input=" ",
-                                encoding_format="float",
-                            )
-                            computed_list.append(list(map(float, r.data[0].embedding)))
-            else:
-                computed = local_model.encode(
-                    to_compute_texts,
-                    batch_size=min(_BATCH_SIZE, len(to_compute_texts)),
-                    convert_to_numpy=True,
-                    show_progress_bar=False,
-                )
-                if isinstance(computed, np.ndarray):
-                    computed_list: List[List[float]] = computed.astype(float).tolist()
-                elif isinstance(computed, list):
-                    computed_list = [list(map(float, e)) for e in computed]
-                else:
-                    computed_list = [list(map(float, np.array(computed).astype(float).tolist()))]
-
-            new_cache_items: List[tuple[str, List[float]]] = []
-            for pos, vec in zip(to_compute_idx, computed_list):
-                k = text_keys[pos]
-                emb_cache[k] = vec
-                text_embs[pos] = vec
-                new_cache_items.append((k, vec))
-            _persist_cache_items(new_cache_items)
-
-        # At this point, all text_embs are filled
-        text_embs_filled: List[List[float]] = [e for e in text_embs if e is not None]  # type: ignore
-
-
-        with out_path.open("a", encoding="utf-8") as out_f:
-            for item, text_emb in zip(rows, text_embs_filled):
-                keywords, headings, heading, full_headings = _extract_meta(item)
-                text = item.get("text", "")
-                if not isinstance(text, str):
-                    text = str(text)
-                rec = {
-                    "chunk_id": item.get("chunk_id"),
-                    "text": text,
-                    "embedding": text_emb,
-                    "model": model_info,
-                    "created_at": created_at,
-                    "approx_tokens": item.get("approx_tokens"),
-                    "keywords": keywords,
-                    "headings": headings,
-                    "heading": heading,
-                    "full_headings": full_headings,
-                }
-                out_f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-        texts = []
-        rows = []
+    with src.open("r", encoding="utf-8") as f:
+        for item in _iter_chunks(f):
+            n_chunks += 1
+            txt = chunk_text(item)
+            key = emb_cache.key(txt)
+            if key not in missing:
+                pending[key] = txt
+                if len(pending) >= _LOOKUP_BLOCK:
+                    lookup_pending()
+    lookup_pending()
+
+    pool = None
+    workers = workers or physical_cores()
+    # ONNX Runtime already spreads each batch over all the cores
+    if local_model is not None and backend == "torch" and workers > 1 and len(missing) >= _POOL_MIN_TEXTS:
+        pool = _start_pool(local_model, workers)
+
+    log.event("start", input=str(src), model=model_info, chunks=n_chunks, to_compute=len(missing))
+
+    # Vectors of texts the API only accepted truncated (see openai_embeddings.py): kept out of the
+    # cache, which would otherwise serve them as vectors of the whole texts
+    truncated: Dict[bytes, np.ndarray] = {}
+
+    def compute(to_compute_texts: List[str]) -> Iterator[Tuple[List[int], np.ndarray]]:
+        # Yield (positions in to_compute_texts, vectors) batch by batch
+        if embedder is not None:
+            batches = embedder.iter_embeddings(to_compute_texts)
+        else:
+            batches = encode_local(local_model, to_compute_texts, pool=pool)
+        computed = 0
+        for positions, vecs in batches:
+            computed += len(positions)
+            if embedder is not None:
+                for pos, vec in zip(positions, vecs):
+                    if pos in embedder.truncated:
+                        truncated[emb_cache.key(to_compute_texts[pos])] = vec
+            log.progress(computed=computed, total=len(to_compute_texts), sample=to_compute_texts[positions[0]][:80])
+            yield positions, vecs
+        if embedder is not None:
+            log.event(
+                "openai",
+                requests=embedder.requests,
+                retries=embedder.retries,
+                splits=embedder.splits,
+                truncated=len(embedder.truncated),
+            )
 
     # Ensure output file is empty before writing
     if out_path.exists():
         out_path.unlink()
 
-    with src.open("r", encoding="utf-8") as f:
-        for line in f:
-            ln = line.strip()
-            if not ln:
-                continue
-            try:
-                item = json.loads(ln)
-            except json.JSONDecodeError:
-                # Skip malformed lines
-                continue
-            txt = item.get("text", "")
-            if not isinstance(txt, str):
-                txt = str(txt)
-            rows.append(item)
-            texts.append(txt)
-
-            if len(texts) >= _BATCH_SIZE:
-                flush_batch()
-
-    # Flush any remaining
-    flush_batch()
-
+    vectors_out = NpyRowWriter(vectors_path, dtype=dtype)
+    try:
+        if missing:
+            missing_keys = list(missing)
+            # Stored batch by batch, so that an interrupted run keeps what it has computed
+            for positions, vecs in compute(list(missing.values())):
+                emb_cache.put_many([(missing_keys[pos], vec) for pos, vec in zip(positions, vecs) if missing_keys[pos] not in truncated])
+
+        # Second pass: write the vectors and metadata in input order
+        rows: List[Dict] = []
+
+        def flush_rows():
+            text_keys = [emb_cache.key(chunk_text(item)) for item in rows]
+            text_embs: List[Optional[np.ndarray]] = [
+                truncated[k] if k in truncated else vec for k, vec in zip(text_keys, emb_cache.get_many(text_keys))
+            ]
+            # Only when the input holds more vectors than the cache: some of them were evicted by the first pass
+            evicted = [i for i, e in enumerate(text_embs) if e is None]
+            if evicted:
+                for positions, vecs in compute([chunk_text(rows[i]) for i in evicted]):
+                    emb_cache.put_many(
+                        [(text_keys[evicted[pos]], vec) for pos, vec in zip(positions, vecs) if text_keys[evicted[pos]] not in truncated]
+                    )
+                    for pos, vec in zip(positions, vecs):
+                        text_embs[evicted[pos]] = vec
+
+            first_row = vectors_out.rows
+            vectors_out.write(np.stack(text_embs))
+
+            for row, (item, text_emb) in enumerate(zip(rows, text_embs), start=first_row):
+                rec = embedding_record(item, row)
+                if inline_vectors:
+                    rec["embedding"] = np.asarray(text_emb, dtype=np.float32).tolist()
+                out_f.write(JSON_ENCODER.encode(rec))
+                out_f.write("\n")
+            rows.clear()
+
+        with src.open("r", encoding="utf-8") as f, out_path.open("w", encoding="utf-8", buffering=WRITE_BUFFER) as out_f:
+            for item in _iter_chunks(f):
+                rows.append(item)
+                if len(rows) >= _BATCH_SIZE:
+                    flush_rows()
+            if rows:
+                flush_rows()
+    finally:
+        if pool is not None:
+            local_model.stop_multi_process_pool(pool)
+        vectors_out.close()
+        emb_cache.close()
+
+    meta = {
+        "model": model_info,
+        "created_at": created_at,
+        "source": str(src),
+        "records": vectors_out.rows,
+        "vectors": {"file": str(vectors_path), "dtype": dtype, "shape": [vectors_out.rows, vectors_out.dim]},
+    }
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    log.event(
+        "done",
+        output=str(out_path),
+        records=vectors_out.rows,
+        computed=len(missing),
+        seconds=round(time.monotonic() - started, 3),
+    )
     return str(out_path)
 
 
@@ -288,10 +538,69 @@ def main(argv: Optional[List[str]] = None) -> int:
         action="store_true",
         help="Use OpenAI API (model: text-embedding-3-large) instead of local sentence-transformers.",
     )
+    parser.add_argument(
+        "--openai-concurrency",
+        type=int,
+        default=8,
+        help="Number of OpenAI requests in flight (default: 8)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Shared embedding cache directory (default: $EMB_CACHE_DIR or ~/.cache/awsgpu/embeddings)",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=None,
+        help="Size bound of the embedding cache, least recently used entries evicted first (default: $EMB_CACHE_MAX_MB or 2048)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float32", "float16"],
+        default="float32",
+        help="Type of the vectors written to <input>.embeddings.npy (default: float32)",
+    )
+    parser.add_argument(
+        "--inline-vectors",
+        action="store_true",
+        help='Also write each vector as "embedding": [floats] in the NDJSON, as former versions did',
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Encoding processes for the local model with the torch backend, 0 for one per physical core (default: 1)",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Inference backend of the local model, see embedding_models.py (default: $EMB_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--log-interval",
+        type=float,
+        default=5.0,
+        help="Minimum number of seconds between two progress lines on stderr, 0 for one per batch (default: 5)",
+    )
     args = parser.parse_args(argv)
 
     try:
-        produced = convert_chunks_to_embeddings(args.input, use_openai=args.openai)
+        produced = convert_chunks_to_embeddings(
+            args.input,
+            use_openai=args.openai,
+            cache_dir=args.cache_dir,
+            cache_max_mb=args.cache_max_mb,
+            dtype=args.dtype,
+            inline_vectors=args.inline_vectors,
+            log_interval=args.log_interval,
+            workers=args.workers,
+            backend=args.backend,
+            openai_concurrency=args.openai_concurrency,
+        )
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Shared on-disk embedding cache, content-addressed, used by every document and every run
+(create_embeddings.py) and by the query path (search_chunks.py).
+
+- Location: $EMB_CACHE_DIR, or ~/.cache/awsgpu/embeddings by default, with one subdirectory
+  per model name and model version.
+- Keys: SHA-256 of the model name, the model version and the text (see cache_key()).
+- Storage: append-only segments, each made of two files:
+  - seg-NNNNNN.f32: float32 vectors, one row per entry, read through a read-only memmap;
+  - seg-NNNNNN.keys: the 32-byte keys, the i-th key owning row i of the .f32 file;
+  - seg-NNNNNN.idx: the first 8 bytes of the keys as sorted uint64, then the matching rows as
+    uint32. Lookups binary-search it through a memmap (np.searchsorted) and check the whole key
+    in the .keys file, so that opening the cache reads no key.
+  New entries are appended to the newest segment, with one write per file and per batch, then
+  its index is rewritten (to a temporary file, renamed over the former one); a new segment is
+  started once the newest one exceeds segment_mb. A segment whose index is missing or short
+  (written by a former version, or by an interrupted append) is indexed when the cache is opened.
+- Eviction: the cache is bounded to max_mb ($EMB_CACHE_MAX_MB, default 2048), least recently
+  used segments first. A segment counts as used when it is written to or serves a hit
+  (its .keys mtime is refreshed); the newest segment is never evicted.
+- Concurrency: appends, segment rotation and eviction hold an exclusive flock on <dir>/.lock,
+  opening the cache holds a shared one. Vectors are written before their keys, so a key is never
+  visible without its row; rows left without keys by an interrupted append are truncated by the
+  next writer.
+
+Run it to print the size of the cache, or to clear it:
+  ./src/pipeline-advanced/embedding_cache.py
+  ./src/pipeline-advanced/embedding_cache.py --clear
+"""
+
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+
+_KEY_SIZE = 32
+# Bytes per index entry: key prefix (uint64) and row (uint32)
+_INDEX_ENTRY_SIZE = 12
+_SEGMENT_RE = re.compile(r"^seg-(\d{6})\.keys$")
+_DEFAULT_MAX_MB = 2048
+_DEFAULT_SEGMENT_MB = 64
+
+
+def default_cache_dir() -> Path:
+    return Path(os.environ.get("EMB_CACHE_DIR") or Path.home() / ".cache" / "awsgpu" / "embeddings")
+
+
+def cache_key(model_name: str, model_version: str, text: str) -> bytes:
+    """
+    Build a stable key for the given text, including model name and version to avoid collisions.
+    """
+    payload = f"{model_name}\n{model_version}\n".encode("utf-8") + text.encode("utf-8")
+    return hashlib.sha256(payload).digest()
+
+
+def _key_prefixes(keys: bytes) -> np.ndarray:
+    # First 8 bytes of each key, as the uint64 sorted in the .idx files
+    return np.frombuffer(keys, dtype="<u8").reshape(-1, _KEY_SIZE // 8)[:, 0]
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name) or "_"
+
+
+class EmbeddingCache:
+    """
+    Embedding cache of one model and version, stored in segments under the shared cache directory.
+    get() and get_many() return views into segment memmaps; put_many() appends a whole batch at once.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        model_version: str,
+        cache_dir: Optional[str] = None,
+        max_mb: Optional[int] = None,
+        segment_mb: int = _DEFAULT_SEGMENT_MB,
+    ) -> None:
+        self.model_name = model_name
+        self.model_version = model_version
+        self.dir = Path(cache_dir or default_cache_dir()) / _safe_name(model_name) / _safe_name(model_version)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if max_mb is None:
+            max_mb = int(os.environ.get("EMB_CACHE_MAX_MB") or _DEFAULT_MAX_MB)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.segment_bytes = segment_mb * 1024 * 1024
+        self.dim: Optional[int] = None
+        # Segments present when the cache was opened: (sorted key prefixes, their rows, keys, vectors)
+        self._segments: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+        # Vectors stored by this process since the cache was opened
+        self._fresh: Dict[bytes, np.ndarray] = {}
+        # Segments that served a hit and whose mtime has not been refreshed yet
+        self._used: Set[int] = set()
+        self._open()
+
+    def __enter__(self) -> "EmbeddingCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(len(segment[0]) for segment in self._segments.values()) + len(self._fresh)
+
+    def key(self, text: str) -> bytes:
+        return cache_key(self.model_name, self.model_version, text)
+
+    # Files and locking
+
+    def _vectors_path(self, seg: int) -> Path:
+        return self.dir / f"seg-{seg:06d}.f32"
+
+    def _keys_path(self, seg: int) -> Path:
+        return self.dir / f"seg-{seg:06d}.keys"
+
+    def _index_path(self, seg: int) -> Path:
+        return self.dir / f"seg-{seg:06d}.idx"
+
+    def _list_segments(self) -> List[int]:
+        segs = []
+        for entry in os.scandir(self.dir):
+            m = _SEGMENT_RE.match(entry.name)
+            if m:
+                segs.append(int(m.group(1)))
+        return sorted(segs)
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        with open(self.dir / ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_dim(self) -> Optional[int]:
+        meta_path = self.dir / "meta.json"
+        if not meta_path.exists():
+            return None
+        with meta_path.open("r", encoding="utf-8") as f:
+            return int(json.load(f)["dim"])
+
+    def _complete_rows(self, seg: int) -> Tuple[int, int, int]:
+        """
+        (rows, keys file size, vectors file size) of a segment, rows counting complete entries only.
+        """
+        keys_size = self._keys_path(seg).stat().st_size
+        vectors_path = self._vectors_path(seg)
+        vectors_size = vectors_path.stat().st_size if vectors_path.exists() else 0
+        rows = min(keys_size // _KEY_SIZE, vectors_size // (4 * self.dim)) if self.dim else 0
+        return rows, keys_size, vectors_size
+
+    def _read_index(self, seg: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        # (sorted key prefixes, rows) of a segment, memmapped; None without an index file
+        path = self._index_path(seg)
+        try:
+            entries = path.stat().st_size // _INDEX_ENTRY_SIZE
+        except FileNotFoundError:
+            return None
+        if not entries:
+            return np.empty(0, dtype="<u8"), np.empty(0, dtype="<u4")
+        prefixes = np.memmap(path, dtype="<u8", mode="r", shape=(entries,))
+        rows = np.memmap(path, dtype="<u4", mode="r", offset=8 * entries, shape=(entries,))
+        return prefixes, rows
+
+    def _write_index(self, seg: int, rows: int) -> None:
+        """
+        Index the first rows of a segment, reading only the keys its current index does not cover.
+        Called with a lock held: concurrent openers write the same content, each to its own file.
+        """
+        index = self._read_index(seg)
+        if index is None or len(index[0]) > rows:
+            index = np.empty(0, dtype="<u8"), np.empty(0, dtype="<u4")
+        covered = len(index[0])
+        with self._keys_path(seg).open("rb") as f:
+            f.seek(covered * _KEY_SIZE)
+            keys = f.read((rows - covered) * _KEY_SIZE)
+        prefixes = np.concatenate([index[0], _key_prefixes(keys)])
+        row_ids = np.concatenate([index[1], np.arange(covered, rows, dtype="<u4")])
+        order = np.argsort(prefixes, kind="stable")
+        path = self._index_path(seg)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("wb") as f:
+            f.write(prefixes[order].astype("<u8").tobytes())
+            f.write(row_ids[order].astype("<u4").tobytes())
+        os.replace(tmp_path, path)
+
+    def _open(self) -> None:
+        with self._locked(exclusive=False):
+            self.dim = self._read_dim()
+            if self.dim is None:
+                return
+            for seg in self._list_segments():
+                try:
+                    rows, _, _ = self._complete_rows(seg)
+                    if not rows:
+                        continue
+                    index = self._read_index(seg)
+                    if index is None or len(index[0]) != rows:
+                        self._write_index(seg, rows)
+                        index = self._read_index(seg)
+                    keys = np.memmap(self._keys_path(seg), dtype=np.uint8, mode="r", shape=(rows, _KEY_SIZE))
+                    vectors = np.memmap(self._vectors_path(seg), dtype=np.float32, mode="r", shape=(rows, self.dim))
+                except FileNotFoundError:
+                    # Evicted by another process meanwhile
+                    continue
+                self._segments[seg] = (index[0], index[1], keys, vectors)
+
+    # Lookups and appends
+
+    def _locate(self, keys: Sequence[bytes]) -> List[Optional[Tuple[int, int]]]:
+        # (segment, row) of each key in the segments present when the cache was opened
+        found: List[Optional[Tuple[int, int]]] = [None] * len(keys)
+        pending = list(range(len(keys)))
+        for seg, (prefixes, row_ids, seg_keys, _) in self._segments.items():
+            if not pending:
+                break
+            query = _key_prefixes(b"".join(keys[i] for i in pending))
+            pos = np.searchsorted(prefixes, query)
+            hit = pos < len(prefixes)
+            hit[hit] = prefixes[pos[hit]] == query[hit]
+            for j in np.flatnonzero(hit):
+                # Several keys may share a prefix: they are next to each other
+                p = int(pos[j])
+                while p < len(prefixes) and prefixes[p] == query[j]:
+                    row = int(row_ids[p])
+                    if seg_keys[row].tobytes() == keys[pending[j]]:
+                        found[pending[j]] = (seg, row)
+                        break
+                    p += 1
+            pending = [i for i in pending if found[i] is None]
+        return found
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Vectors of the given keys (None when missing), looked up in each segment in one pass.
+        """
+        vectors: List[Optional[np.ndarray]] = []
+        for key, loc in zip(keys, self._locate(keys)):
+            if loc is not None:
+                seg, row = loc
+                self._used.add(seg)
+                vectors.append(self._segments[seg][3][row])
+            else:
+                vectors.append(self._fresh.get(key))
+        return vectors
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def put_many(self, items: Sequence[Tuple[bytes, Sequence[float]]]) -> None:
+        new_items: Dict[bytes, Sequence[float]] = {}
+        for key, vec in items:
+            if key not in self._fresh:
+                new_items[key] = vec
+        stored = self._locate(list(new_items))
+        for key, loc in zip(list(new_items), stored):
+            if loc is not None:
+                del new_items[key]
+        if not new_items:
+            return
+        block = np.asarray(list(new_items.values()), dtype=np.float32)
+
+        with self._locked(exclusive=True):
+            if self.dim is None:
+                self.dim = self._read_dim()
+            if self.dim is None:
+                self.dim = int(block.shape[1])
+                with (self.dir / "meta.json").open("w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "version": self.model_version, "dim": self.dim, "dtype": "float32"}, f)
+            if block.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {block.shape[1]} does not match cache dimension {self.dim}")
+
+            segs = self._list_segments()
+            seg = segs[-1] if segs else 0
+            if not segs:
+                self._keys_path(seg).touch()
+            rows, keys_size, vectors_size = self._complete_rows(seg)
+            if vectors_size >= self.segment_bytes:
+                seg += 1
+                rows = 0
+                self._keys_path(seg).touch()
+            else:
+                # Drop whatever an interrupted append left behind
+                if keys_size != rows * _KEY_SIZE:
+                    os.truncate(self._keys_path(seg), rows * _KEY_SIZE)
+                if vectors_size != rows * 4 * self.dim:
+                    os.truncate(self._vectors_path(seg), rows * 4 * self.dim)
+
+            with self._vectors_path(seg).open("ab") as f:
+                f.write(block.tobytes())
+            with self._keys_path(seg).open("ab") as f:
+                f.write(b"".join(new_items))
+            self._write_index(seg, rows + len(block))
+
+            self._touch_used()
+            self._evict(keep=seg)
+
+        for key, row in zip(new_items, block):
+            self._fresh[key] = row
+
+    def close(self) -> None:
+        self._touch_used()
+
+    # LRU bookkeeping
+
+    def _touch_used(self) -> None:
+        now = time.time()
+        for seg in self._used:
+            try:
+                os.utime(self._keys_path(seg), (now, now))
+            except FileNotFoundError:
+                pass
+        self._used.clear()
+
+    def _evict(self, keep: int) -> None:
+        # Called with the exclusive lock held
+        usage: List[Tuple[float, int, int]] = []
+        total = 0
+        for seg in self._list_segments():
+            try:
+                st = self._keys_path(seg).stat()
+                vectors_size = self._vectors_path(seg).stat().st_size if self._vectors_path(seg).exists() else 0
+                index_size = self._index_path(seg).stat().st_size if self._index_path(seg).exists() else 0
+            except FileNotFoundError:
+                continue
+            size = st.st_size + vectors_size + index_size
+            total += size
+            if seg != keep:
+                usage.append((st.st_mtime, seg, size))
+        for _, seg, size in sorted(usage):
+            if total <= self.max_bytes:
+                break
+            # Processes that already mapped this segment keep reading it until they close their mapping
+            for path in (self._keys_path(seg), self._vectors_path(seg), self._index_path(seg)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    # Imports of the former per-input caches
+
+    def import_jsonl(self, path: Path, batch_size: int = 4096) -> int:
+        """
+        Import a legacy {"k": <hex sha256>, "v": [floats]} JSONL cache, then delete it.
+        Returns the number of entries read.
+        """
+        count = 0
+        batch: List[Tuple[bytes, List[float]]] = []
+        with path.open("r", encoding="utf-8") as cf:
+            for ln in cf:
+                try:
+                    rec = json.loads(ln)
+                    key = bytes.fromhex(rec["k"])
+                    vec = [float(x) for x in rec["v"]]
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    continue
+                if len(key) != _KEY_SIZE or (self.dim is not None and len(vec) != self.dim):
+                    continue
+                batch.append((key, vec))
+                count += 1
+                if len(batch) >= batch_size:
+                    self.put_many(batch)
+                    batch = []
+        self.put_many(batch)
+        path.unlink()
+        return count
+
+    def import_binary(self, base: str, batch_size: int = 4096) -> int:
+        """
+        Import a per-input binary cache (<base>.f32, <base>.keys, <base>.json), then delete it.
+        Returns the number of entries read.
+        """
+        paths = [Path(f"{base}.f32"), Path(f"{base}.keys"), Path(f"{base}.json")]
+        with paths[2].open("r", encoding="utf-8") as f:
+            dim = int(json.load(f)["dim"])
+        keys = paths[1].read_bytes() if paths[1].exists() else b""
+        vectors = np.fromfile(paths[0], dtype=np.float32) if paths[0].exists() else np.empty(0, dtype=np.float32)
+        rows = min(len(keys) // _KEY_SIZE, len(vectors) // dim)
+        if self.dim is None or dim == self.dim:
+            vectors = vectors[: rows * dim].reshape(rows, dim)
+            for start in range(0, rows, batch_size):
+                stop = min(rows, start + batch_size)
+                self.put_many([(keys[i * _KEY_SIZE : (i + 1) * _KEY_SIZE], vectors[i]) for i in range(start, stop)])
+        for path in paths:
+            if path.exists():
+                path.unlink()
+        return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Print the size of the shared embedding cache, or clear it.")
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Cache directory (default: $EMB_CACHE_DIR or ~/.cache/awsgpu/embeddings)",
+    )
+    parser.add_argument("--clear", action="store_true", help="Delete the whole cache")
+    args = parser.parse_args(argv)
+
+    root = Path(args.cache_dir) if args.cache_dir else default_cache_dir()
+    if args.clear:
+        if root.exists():
+            shutil.rmtree(root)
+        return 0
+    if not root.exists():
+        print(f"{root}: empty")
+        return 0
+
+    for model_dir in sorted(p for p in root.iterdir() if p.is_dir()):
+        for version_dir in sorted(p for p in model_dir.iterdir() if p.is_dir()):
+            entries = 0
+            size = 0
+            for entry in os.scandir(version_dir):
+                if entry.name.endswith((".keys", ".f32", ".idx")):
+                    size += entry.stat().st_size
+                    if entry.name.endswith(".keys"):
+                        entries += entry.stat().st_size // _KEY_SIZE
+            print(f"{model_dir.name} {version_dir.name}: {entries} entries, {size / (1024 * 1024):.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Inference backends for the local sentence-transformers embedding model, shared by
+create_embeddings.py, search_chunks.py and get_emb_distance.py.
+
+- torch: the PyTorch fp32 model, as loaded by SentenceTransformer(name).
+- onnx: the model exported to ONNX, run by ONNX Runtime.
+- onnx-int8: the ONNX model with dynamic int8 quantization of its weights, for the instruction
+  set of this CPU (avx512_vnni, avx512, avx2 or arm64): several times faster on CPU-only hosts,
+  at the cost of a small drift of the vectors (see the drift command below).
+
+The backend is chosen with --backend, or $EMB_BACKEND (default: torch), so that documents
+and queries are embedded the same way. The ONNX backends require Optimum and ONNX Runtime:
+  pip install 'sentence-transformers[onnx]'
+The model is exported on first use under $EMB_MODEL_DIR (default: ~/.cache/awsgpu/models),
+one directory per model and backend. Each backend reports its own model version (see
+backend_version()), so that the embedding cache never mixes vectors of different backends.
+
+Usage:
+  ./src/pipeline-advanced/embedding_models.py export -b onnx-int8
+  ./src/pipeline-advanced/embedding_models.py drift -b onnx-int8 doc.docx.converted.md.chunks.jsonl.embeddings.ndjson
+
+The drift command re-embeds the texts of NDJSON files produced by create_embeddings.py with
+the torch backend, and prints one JSON line comparing the new vectors to the stored ones:
+cosine drift (1 - cosine similarity) and agreement of the 10 nearest neighbours of each text.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import sentence_transformers
+from sentence_transformers import SentenceTransformer
+
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+_MODEL_NAME = "paraphrase-xlm-r-multilingual-v1"
+_NEIGHBORS = 10
+
+
+def default_backend() -> str:
+    return os.environ.get("EMB_BACKEND") or "torch"
+
+
+def default_model_dir() -> Path:
+    return Path(os.environ.get("EMB_MODEL_DIR") or Path.home() / ".cache" / "awsgpu" / "models")
+
+
+def quantization_config() -> str:
+    """
+    Name of the dynamic quantization configuration matching this CPU, as expected by
+    sentence_transformers.export_dynamic_quantized_onnx_model().
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    flags: set = set()
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.partition(":")[2].split())
+                    break
+    except OSError:
+        pass
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def _backend_dir_name(backend: str) -> str:
+    # The quantized graph depends on the instruction set it was built for
+    return f"onnx-int8-{quantization_config()}" if backend == "onnx-int8" else backend
+
+
+def backend_version(backend: Optional[str] = None) -> str:
+    """
+    Model version to record with vectors computed by the given backend: the sentence-transformers
+    version, followed by the backend when it is not torch (e.g. "5.1.0+onnx-int8-avx2").
+    """
+    backend = backend or default_backend()
+    version = getattr(sentence_transformers, "__version__", "unknown")
+    if backend == "torch":
+        return version
+    return f"{version}+{_backend_dir_name(backend)}"
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", name) or "_"
+
+
+def _onnx_file_name(backend: str) -> str:
+    if backend == "onnx-int8":
+        return f"onnx/model_qint8_{quantization_config()}.onnx"
+    return "onnx/model.onnx"
+
+
+def export_model(model_name: str, backend: str, model_dir: Optional[str] = None) -> Path:
+    """
+    Export model_name for an ONNX backend, unless already done, and return its directory.
+    The export is built in a temporary directory renamed at the end, so that concurrent
+    processes never load a partial export.
+    """
+    path = Path(model_dir or default_model_dir()) / _safe_name(model_name) / _backend_dir_name(backend)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save_pretrained(str(tmp))
+        if backend == "onnx-int8":
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            export_dynamic_quantized_onnx_model(model, quantization_config(), str(tmp))
+            # Only the quantized graph is loaded from this directory
+            (tmp / "onnx" / "model.onnx").unlink()
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Exported meanwhile by another process
+            if not path.exists():
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def load_model(model_name: str, backend: Optional[str] = None, model_dir: Optional[str] = None) -> SentenceTransformer:
+    """
+    Load model_name for the given backend (default: $EMB_BACKEND or torch), exporting it first if needed.
+    """
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of: {', '.join(BACKENDS)}")
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    path = export_model(model_name, backend, model_dir=model_dir)
+    return SentenceTransformer(str(path), backend="onnx", model_kwargs={"file_name": _onnx_file_name(backend)})
+
+
+def _read_reference(paths: List[str]) -> Tuple[str, List[str], np.ndarray]:
+    # Texts and fp32 vectors of NDJSON files written by create_embeddings.py with the torch backend
+    model_name: Optional[str] = None
+    texts: List[str] = []
+    vectors: List[np.ndarray] = []
+    for path in paths:
+        npy_path = Path(path).with_suffix(".npy")
+        sidecar = np.load(npy_path, mmap_mode="r") if npy_path.exists() else None
+        meta_path = Path(path).with_suffix(".meta.json")
+        file_model = json.loads(meta_path.read_text(encoding="utf-8")).get("model") if meta_path.exists() else None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                model = rec.get("model") or file_model or {}
+                if "+" in str(model.get("version", "")):
+                    raise ValueError(f"{path}: not computed with the torch backend ({model.get('version')})")
+                if model_name is None:
+                    model_name = model.get("name") or _MODEL_NAME
+                elif model.get("name", model_name) != model_name:
+                    raise ValueError(f"{path}: mixes models {model_name} and {model.get('name')}")
+                if sidecar is not None and rec.get("embedding_row") is not None:
+                    vec = sidecar[rec["embedding_row"]]
+                elif rec.get("embedding") is not None:
+                    vec = rec["embedding"]
+                else:
+                    continue
+                texts.append(rec.get("text") or "")
+                vectors.append(np.asarray(vec, dtype=np.float32))
+    if not texts:
+        raise ValueError("No embeddings found in the input files")
+    return model_name or _MODEL_NAME, texts, np.stack(vectors)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0.0, 1.0, norms)
+
+
+def measure_drift(paths: List[str], backend: str, sample: int = 1000, model_dir: Optional[str] = None) -> Dict:
+    """
+    Re-embed (a sample of) the texts of the given NDJSON files with backend, and compare
+    the results to the stored fp32 vectors.
+    """
+    model_name, texts, reference = _read_reference(paths)
+    if sample and len(texts) > sample:
+        picked = sorted(random.Random(0).sample(range(len(texts)), sample))
+        texts = [texts[i] for i in picked]
+        reference = reference[picked]
+
+    model = load_model(model_name, backend, model_dir=model_dir)
+    start = time.perf_counter()
+    vectors = model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
+    seconds = time.perf_counter() - start
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    ref_n = _normalize(reference)
+    new_n = _normalize(vectors)
+    drift = 1.0 - np.clip(np.sum(ref_n * new_n, axis=1), -1.0, 1.0)
+
+    # Share of the nearest neighbours of each text (within the compared texts) that both sets agree on
+    k = min(_NEIGHBORS, len(texts) - 1)
+    overlap = None
+    if k > 0:
+        agreed = 0
+        for start_row in range(0, len(texts), 1024):
+            rows = slice(start_row, start_row + 1024)
+            neighbors = []
+            for mat in (ref_n, new_n):
+                sims = mat[rows] @ mat.T
+                # Exclude each text itself
+                sims[np.arange(sims.shape[0]), np.arange(start_row, start_row + sims.shape[0])] = -np.inf
+                neighbors.append(np.argpartition(-sims, k - 1, axis=1)[:, :k])
+            agreed += sum(len(set(a) & set(b)) for a, b in zip(*neighbors))
+        overlap = agreed / (len(texts) * k)
+
+    return {
+        "model": {"name": model_name, "version": backend_version(backend)},
+        "backend": backend,
+        "compared": len(texts),
+        "cosine_drift": {
+            "mean": float(drift.mean()),
+            "p50": float(np.percentile(drift, 50)),
+            "p95": float(np.percentile(drift, 95)),
+            "p99": float(np.percentile(drift, 99)),
+            "max": float(drift.max()),
+        },
+        f"neighbors_at_{_NEIGHBORS}": overlap,
+        "texts_per_second": len(texts) / seconds if seconds > 0 else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the local embedding model for an ONNX backend, or measure its drift.")
+    parser.add_argument(
+        "--model-dir",
+        default=None,
+        help="Directory of the exported models (default: $EMB_MODEL_DIR or ~/.cache/awsgpu/models)",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_p = sub.add_parser("export", help="Export the model for a backend ahead of its first use")
+    export_p.add_argument("-b", "--backend", choices=BACKENDS[1:], default="onnx-int8", help="Backend (default: onnx-int8)")
+    export_p.add_argument("-m", "--model", default=_MODEL_NAME, help=f"Model name (default: {_MODEL_NAME})")
+
+    drift_p = sub.add_parser("drift", help="Compare a backend to the fp32 vectors of embeddings NDJSON files")
+    drift_p.add_argument("input", nargs="+", help="Embeddings NDJSON files written by create_embeddings.py")
+    drift_p.add_argument("-b", "--backend", choices=BACKENDS, default="onnx-int8", help="Backend (default: onnx-int8)")
+    drift_p.add_argument(
+        "-n",
+        "--sample",
+        type=int,
+        default=1000,
+        help="Number of texts to re-embed, picked at random; 0 for all of them (default: 1000)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            print(export_model(args.model, args.backend, model_dir=args.model_dir))
+        else:
+            report = measure_drift(args.input, args.backend, sample=args.sample, model_dir=args.model_dir)
+            print(json.dumps(report, ensure_ascii=False))
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
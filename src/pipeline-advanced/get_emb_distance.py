@@ -3,6 +3,7 @@
 Calcule la distance entre les embeddings de deux chaînes de caractères.
 
 - Utilise sentence-transformers avec le modèle 'paraphrase-xlm-r-multilingual-v1'.
+- Avec --backend onnx / onnx-int8 (ou $EMB_BACKEND), le modèle tourne sur ONNX Runtime (voir embedding_models.py).
 - Aligne la métrique sur celle utilisée par search_chunks.py / Weaviate (cosine distance),
   c'est-à-dire: distance = 1 - cosine_similarity.
 
@@ -29,8 +30,8 @@ import sys
 from typing import List
 
 import numpy as np
-import sentence_transformers
-from sentence_transformers import SentenceTransformer
+
+from embedding_models import BACKENDS, backend_version, load_model
 
 
 _MODEL_NAME = "paraphrase-xlm-r-multilingual-v1"
@@ -60,8 +61,8 @@ def _cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
     return 1.0 - cos_sim
 
 
-def _embed_texts(texts: List[str], model_name: str) -> np.ndarray:
-    model = SentenceTransformer(model_name)
+def _embed_texts(texts: List[str], model_name: str, backend: str | None = None) -> np.ndarray:
+    model = load_model(model_name, backend)
     vecs = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
     if isinstance(vecs, list):
         # Rare selon les versions, mais on gère le cas
@@ -69,15 +70,15 @@ def _embed_texts(texts: List[str], model_name: str) -> np.ndarray:
     return vecs.astype(float)
 
 
-def compute_distance(text1: str, text2: str, model_name: str = _MODEL_NAME) -> dict:
-    vecs = _embed_texts([text1, text2], model_name)
+def compute_distance(text1: str, text2: str, model_name: str = _MODEL_NAME, backend: str | None = None) -> dict:
+    vecs = _embed_texts([text1, text2], model_name, backend)
     a, b = vecs[0], vecs[1]
     dist = _cosine_distance(a, b)
     sim = 1.0 - dist
     return {
         "text1": text1,
         "text2": text2,
-        "model": {"name": model_name, "version": getattr(sentence_transformers, "__version__", "unknown")},
+        "model": {"name": model_name, "version": backend_version(backend)},
         "metric": "cosine",
         "distance": dist,
         "similarity": sim,
@@ -97,10 +98,17 @@ def main(argv: List[str] | None = None) -> int:
         default=_MODEL_NAME,
         help="Nom du modèle sentence-transformers à utiliser",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Moteur d'inférence du modèle, voir embedding_models.py (défaut : $EMB_BACKEND ou torch)",
+    )
     args = parser.parse_args(argv)
 
     try:
-        result = compute_distance(args.text1, args.text2, model_name=args.model)
+        result = compute_distance(args.text1, args.text2, model_name=args.model, backend=args.backend)
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
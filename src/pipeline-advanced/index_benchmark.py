@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Measure the recall and latency of the vector index of a Weaviate collection, against exact
+(brute-force) results computed from the vectors stored in the collection itself.
+
+- Reads every "text" vector of the collection (cursor over all objects).
+- Picks --queries stored vectors at random as queries; for each, the exact --k nearest neighbours
+  (the query object itself excluded) are computed with numpy, with the distance metric of the index,
+  and compared to the ones returned by a near_vector search.
+- recall@k: share of the exact neighbours found by the search, averaged over the queries.
+  Approximate indexes (hnsw) and quantization (pq, bq, sq) lose some; flat without quantization
+  should give 1.0.
+
+Set up the index with init_or_reset_collection.py, load the documents, then:
+  ./src/pipeline-advanced/index_benchmark.py
+  ./src/pipeline-advanced/index_benchmark.py -c rag_chunks -k 10 -n 500
+
+Prints one JSON line: index configuration, objects, recall@k, and search latencies (sequential
+queries, in milliseconds).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from weaviate.classes.query import MetadataQuery
+except Exception as exc:
+    print("Error: weaviate-client is required. Install with: pip install weaviate-client", file=sys.stderr)
+    raise
+
+from weaviate_pool import connect_local
+
+
+
+
+def _index_settings(coll) -> Dict[str, Any]:
+    # Type, metric and quantizer of the "text" vector index, as configured in Weaviate
+    try:
+        index = coll.config.get().vector_config["text"].vector_index_config
+    except Exception:
+        return {"distance": "cosine"}
+    # A dynamic index holds its quantizer in its hnsw part
+    quantizer = getattr(index, "quantizer", None) or getattr(getattr(index, "hnsw", None), "quantizer", None)
+    settings: Dict[str, Any] = {
+        "type": index.vector_index_type(),
+        "distance": getattr(getattr(index, "distance_metric", None), "value", "cosine"),
+        # _PQConfig -> pq
+        "quantizer": type(quantizer).__name__.strip("_").replace("Config", "").lower() if quantizer else None,
+    }
+    for name in ("ef", "ef_construction", "max_connections", "threshold"):
+        if getattr(index, name, None) is not None:
+            settings[name] = getattr(index, name)
+    return settings
+
+
+def _read_vectors(coll) -> Tuple[List[str], np.ndarray]:
+    uuids: List[str] = []
+    vectors: List[List[float]] = []
+    for obj in coll.iterator(include_vector=True, return_properties=[]):
+        vec = obj.vector.get("text") if isinstance(obj.vector, dict) else obj.vector
+        if vec:
+            uuids.append(str(obj.uuid))
+            vectors.append(vec)
+    if not vectors:
+        raise ValueError("No vectors found in the collection")
+    return uuids, np.asarray(vectors, dtype=np.float32)
+
+
+def exact_neighbors(vectors: np.ndarray, query_rows: List[int], k: int, distance: str) -> np.ndarray:
+    """
+    Rows of the k nearest neighbours of each query row, itself excluded, closest first.
+    """
+    if distance == "cosine":
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0.0, 1.0, norms)
+    out = np.empty((len(query_rows), k), dtype=np.int64)
+    for start in range(0, len(query_rows), 256):
+        rows = query_rows[start : start + 256]
+        queries = vectors[rows]
+        if distance == "l2-squared":
+            scores = -(np.sum(queries**2, axis=1, keepdims=True) - 2.0 * queries @ vectors.T + np.sum(vectors**2, axis=1))
+        else:
+            scores = queries @ vectors.T
+        scores[np.arange(len(rows)), rows] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        out[start : start + len(rows)] = np.take_along_axis(top, order, axis=1)
+    return out
+
+
+def run_benchmark(collection_name: str = "rag_chunks", k: int = 10, queries: int = 200, seed: int = 0) -> Dict[str, Any]:
+    client = connect_local()
+    try:
+        coll = client.collections.get(collection_name)
+        settings = _index_settings(coll)
+        uuids, vectors = _read_vectors(coll)
+        k = min(k, len(uuids) - 1)
+        if k < 1:
+            raise ValueError("The collection needs at least 2 objects")
+        query_rows = sorted(random.Random(seed).sample(range(len(uuids)), min(queries, len(uuids))))
+
+        start = time.perf_counter()
+        exact = exact_neighbors(vectors, query_rows, k, settings["distance"])
+        brute_force_ms = (time.perf_counter() - start) * 1000.0 / len(query_rows)
+
+        recalls: List[float] = []
+        latencies: List[float] = []
+        for row, expected in zip(query_rows, exact):
+            start = time.perf_counter()
+            resp = coll.query.near_vector(
+                near_vector=vectors[row].tolist(),
+                target_vector="text",
+                limit=k + 1,
+                return_metadata=MetadataQuery(distance=True),
+                return_properties=[],
+            )
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            found = [str(obj.uuid) for obj in resp.objects if str(obj.uuid) != uuids[row]][:k]
+            recalls.append(len(set(found) & {uuids[i] for i in expected}) / k)
+    finally:
+        client.close()
+
+    return {
+        "collection": collection_name,
+        "index": settings,
+        "objects": len(uuids),
+        "dimensions": int(vectors.shape[1]),
+        "vectors_mb": round(vectors.nbytes / (1024 * 1024), 1),
+        "queries": len(query_rows),
+        "k": k,
+        f"recall_at_{k}": {
+            "mean": float(np.mean(recalls)),
+            "p5": float(np.percentile(recalls, 5)),
+            "min": float(np.min(recalls)),
+        },
+        "latency_ms": {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        },
+        "brute_force_ms_per_query": brute_force_ms,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure recall@k and latency of a Weaviate vector index against brute force.")
+    parser.add_argument(
+        "-c",
+        "--collection-name",
+        default="rag_chunks",
+        help='Weaviate collection name (default: "rag_chunks")',
+    )
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours compared (default: 10)")
+    parser.add_argument(
+        "-n",
+        "--queries",
+        type=int,
+        default=200,
+        help="Number of stored vectors used as queries, picked at random (default: 200)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the choice of the queries (default: 0)")
+    args = parser.parse_args(argv)
+
+    try:
+        report = run_benchmark(args.collection_name, k=args.k, queries=args.queries, seed=args.seed)
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(report, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
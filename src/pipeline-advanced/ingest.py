@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Ingest a Markdown document into Weaviate in one process: chunking (create_chunks.py), embedding
+(create_embeddings.py) and upload (update_weaviate.py) run concurrently, as a pipeline.
+
+- Input: the Markdown file (.converted.md) that create_chunks.py takes.
+- Three threads connected by bounded queues (--queue-size batches each), so that a slow stage
+  holds back the faster ones instead of letting vectors pile up in memory (except the chunks of
+  TF-IDF keywords, see below):
+  1. chunking: chunks are emitted as heading sections close, by batches of 64;
+  2. embedding: cache lookups, then encoding of the misses in batches of similar lengths, over
+     up to --window chunks at a time (whatever is queued), with the local model or OpenAI;
+  3. upload: objects are upserted into the collection as their vectors come: only new or changed
+     chunks are sent, and those no longer in the document are deleted (see update_weaviate.py).
+  The wall time of a document approaches that of its slowest stage, usually the encoding,
+  instead of the sum of the three.
+- TF-IDF keywords (the default) need the whole document: the upload stage holds back the chunks
+  it receives until chunking is over. So that this happens long before encoding is, the queue
+  between chunking and embedding is then unbounded: chunking runs ahead over the whole document
+  (chunks are small, their vectors are not), and the upload starts after the first batches.
+- With --keep-files, the intermediate files of the three-script pipeline are also written:
+  <input>.chunks.jq and <input>.chunks.diff.json, and <input>.chunks.jq.embeddings.ndjson /
+  .npy / .meta.json. The first three are written under .tmp names and renamed together once the
+  upload succeeded: a failed run leaves the previous ones in place.
+
+Usage:
+  ./src/pipeline-advanced/ingest.py doc.docx.html.md.converted.md
+  ./src/pipeline-advanced/ingest.py --keep-files -c rag_chunks doc.docx.html.md.converted.md
+
+Prints the update_weaviate.py summary line on stdout, and the counts and busy time of each
+stage as one JSON line on stderr.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import create_chunks
+import create_embeddings
+import update_weaviate
+from embedding_cache import EmbeddingCache
+from embedding_models import BACKENDS, backend_version, default_backend, load_model
+from openai_embeddings import OpenAIEmbedder
+
+
+_CHUNK_BATCH = 64
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Pipeline:
+    """
+    State shared by the stages: stop flag, first error, counters and busy time of each stage.
+    """
+
+    def __init__(self) -> None:
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def put(self, q: queue.Queue, item: Any) -> None:
+        # Blocks while the queue is full, unless another stage failed
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def drain(self, q: queue.Queue) -> Iterator[Any]:
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def run(self, name: str, target: Callable[[], None], downstream: Optional[queue.Queue]) -> threading.Thread:
+        def wrapper() -> None:
+            try:
+                target()
+            except _Stopped:
+                pass
+            except BaseException as exc:
+                self.errors.append(exc)
+                self.stop.set()
+            finally:
+                if downstream is not None and not self.stop.is_set():
+                    self.put(downstream, _DONE)
+
+        thread = threading.Thread(target=wrapper, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def count(self, name: str, items: int, busy: float) -> None:
+        stage = self.stats.setdefault(name, {"items": 0, "busy_seconds": 0.0})
+        stage["items"] += items
+        stage["busy_seconds"] += busy
+
+
+def ingest_markdown(
+    input_path: str,
+    collection_name: str = "rag_chunks",
+    chunk_size_tokens: int = 200,
+    tokenizer: Optional[str] = None,
+    keywords: str = "tfidf",
+    use_openai: bool = False,
+    backend: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: Optional[int] = None,
+    openai_concurrency: int = 8,
+    window: int = 1024,
+    queue_size: int = 8,
+    keep_files: bool = False,
+    full: bool = False,
+) -> Dict[str, Any]:
+    """
+    Chunk, embed and upsert input_path, the three stages running concurrently (see
+    update_weaviate.sync_objects(), full sends unchanged objects too).
+    Returns the counts of inserted, unchanged and deleted objects, and the statistics of each stage.
+    """
+    src = Path(input_path)
+    if not src.exists():
+        raise FileNotFoundError(f"Input file not found: {src}")
+    started = time.monotonic()
+
+    backend = backend or default_backend()
+    local_model = None
+    embedder: Optional[OpenAIEmbedder] = None
+    if use_openai:
+        try:
+            import openai as _openai_pkg
+        except Exception as e:
+            raise RuntimeError("OpenAI package not installed. Install with: pip install openai") from e
+        api_key = os.environ.get("OPENAIAPIKEY")
+        if not api_key:
+            raise RuntimeError("Environment variable OPENAIAPIKEY is not set.")
+        embedder = OpenAIEmbedder(create_embeddings.OPENAI_MODEL_NAME, api_key, concurrency=openai_concurrency)
+        model_info = {"name": create_embeddings.OPENAI_MODEL_NAME, "version": getattr(_openai_pkg, "__version__", "unknown")}
+    else:
+        local_model = load_model(create_embeddings.MODEL_NAME, backend)
+        model_info = {"name": create_embeddings.MODEL_NAME, "version": backend_version(backend)}
+    meta = {"model": model_info, "created_at": create_embeddings.iso_utc_now()}
+
+    pipeline = _Pipeline()
+    # With TF-IDF, chunking must not wait for the encoding (see the module doc)
+    chunks_q: queue.Queue = queue.Queue(maxsize=0 if keywords == "tfidf" else queue_size)
+    vectors_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    chunking_done = threading.Event()
+    document_frequencies: Counter = Counter()
+    tfidf: Dict[str, Any] = {}
+
+    # 1. Chunking: (chunk, keyword terms) pairs, by batches
+    def chunk_stage() -> None:
+        token_counter = create_chunks.get_token_counter(tokenizer) if tokenizer else None
+        chunks = create_chunks.iter_chunks_from_markdown(
+            create_chunks.read_markdown_lines(src),
+            chunk_size_tokens=chunk_size_tokens,
+            source=str(src),
+            token_counter=token_counter,
+            with_keywords=keywords == "freq",
+        )
+        n_chunks = 0
+        batch: List[Tuple[Dict, List[str]]] = []
+        busy_from = time.monotonic()
+        for ch in chunks:
+            terms: List[str] = []
+            if keywords == "tfidf":
+                terms = create_chunks.keyword_terms(ch["text"])
+                document_frequencies.update(set(terms))
+            batch.append((ch, terms))
+            n_chunks += 1
+            if len(batch) >= _CHUNK_BATCH:
+                pipeline.count("chunking", len(batch), time.monotonic() - busy_from)
+                pipeline.put(chunks_q, batch)
+                batch = []
+                busy_from = time.monotonic()
+        pipeline.count("chunking", len(batch), time.monotonic() - busy_from)
+        tfidf["idf"] = create_chunks.inverse_document_frequencies(document_frequencies, n_chunks)
+        chunking_done.set()
+        if batch:
+            pipeline.put(chunks_q, batch)
+
+    # 2. Embedding: (chunk, keyword terms, vector) triples, in document order
+    emb_cache = EmbeddingCache(model_info["name"], model_info["version"], cache_dir=cache_dir, max_mb=cache_max_mb)
+
+    def embed_stage() -> None:
+        pending = pipeline.drain(chunks_q)
+        for first in pending:
+            batch = list(first)
+            # Take whatever else is already queued, so that encoding batches are as full as possible
+            while len(batch) < window:
+                try:
+                    more = chunks_q.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _DONE:
+                    # Put back for the next drain() to end on
+                    chunks_q.put(_DONE)
+                    break
+                batch.extend(more)
+            busy_from = time.monotonic()
+            texts = [create_embeddings.chunk_text(ch) for ch, _ in batch]
+            keys = [emb_cache.key(t) for t in texts]
+            vectors: List[Optional[np.ndarray]] = emb_cache.get_many(keys)
+            missing = [i for i, v in enumerate(vectors) if v is None]
+            if missing:
+                to_compute = [texts[i] for i in missing]
+                if embedder is not None:
+                    computed = embedder.iter_embeddings(to_compute)
+                else:
+                    computed = create_embeddings.encode_local(local_model, to_compute)
+                for positions, vecs in computed:
+                    # Vectors of truncated texts (openai_embeddings.py) are not those of the texts: not cached
+                    emb_cache.put_many(
+                        [
+                            (keys[missing[pos]], vec)
+                            for pos, vec in zip(positions, vecs)
+                            if embedder is None or pos not in embedder.truncated
+                        ]
+                    )
+                    for pos, vec in zip(positions, vecs):
+                        vectors[missing[pos]] = vec
+            pipeline.count("embedding", len(batch), time.monotonic() - busy_from)
+            pipeline.put(vectors_q, [(ch, terms, vec) for (ch, terms), vec in zip(batch, vectors)])
+
+    # 3. Upload (and intermediate files)
+    out_chunks = Path(f"{input_path}.chunks.jq")
+    out_embeddings = Path(f"{out_chunks}.embeddings.ndjson")
+    out_vectors = Path(f"{out_chunks}.embeddings.npy")
+    # Written under .tmp names, renamed together once the upload succeeded
+    outputs = [out_chunks, out_embeddings, out_vectors]
+    tmp_paths = {path: Path(f"{path}.tmp") for path in outputs}
+    previous = create_chunks.read_chunk_identities(out_chunks) if keep_files and out_chunks.exists() else []
+    current: List[Tuple[str, str]] = []
+    result: Dict[str, Any] = {}
+
+    def objects() -> Iterator[Tuple[Dict[str, Any], Any]]:
+        held: List[Tuple[Dict, List[str], np.ndarray]] = []
+        files = None
+        if keep_files:
+            files = (
+                tmp_paths[out_chunks].open("w", encoding="utf-8", buffering=create_embeddings.WRITE_BUFFER),
+                tmp_paths[out_embeddings].open("w", encoding="utf-8", buffering=create_embeddings.WRITE_BUFFER),
+                create_embeddings.NpyRowWriter(tmp_paths[out_vectors]),
+            )
+
+        def release() -> Iterator[Tuple[Dict[str, Any], Any]]:
+            busy_from = time.monotonic()
+            for ch, terms, vec in held:
+                if keywords == "tfidf":
+                    ch["keywords"] = create_chunks.top_tfidf_terms(Counter(terms), tfidf["idf"])
+                vec = np.asarray(vec, dtype=np.float32)
+                rec = create_embeddings.embedding_record(ch, len(current))
+                if files is not None:
+                    files[0].write(json.dumps(ch, ensure_ascii=False) + "\n")
+                    files[1].write(create_embeddings.JSON_ENCODER.encode(rec) + "\n")
+                    files[2].write(vec[None, :])
+                current.append((ch["chunk_id"], ch["content_hash"]))
+                yield update_weaviate.object_properties(rec, meta), vec
+            pipeline.count("upload", len(held), time.monotonic() - busy_from)
+            held.clear()
+
+        try:
+            for batch in pipeline.drain(vectors_q):
+                held.extend(batch)
+                if keywords == "tfidf" and not chunking_done.is_set():
+                    continue
+                yield from release()
+            # The chunking stage is over once the end of the stream gets here
+            yield from release()
+        finally:
+            if files is not None:
+                for f in files:
+                    f.close()
+
+    def upload_stage() -> None:
+        client = update_weaviate.connect_local()
+        try:
+            coll = client.collections.get(collection_name)
+            result.update(update_weaviate.sync_objects(coll, objects(), full=full))
+        finally:
+            client.close()
+
+    threads = [
+        pipeline.run("chunking", chunk_stage, chunks_q),
+        pipeline.run("embedding", embed_stage, vectors_q),
+        pipeline.run("upload", upload_stage, None),
+    ]
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        emb_cache.close()
+    if pipeline.errors:
+        for path in tmp_paths.values():
+            path.unlink(missing_ok=True)
+        raise pipeline.errors[0]
+
+    if keep_files:
+        for path in outputs:
+            os.replace(tmp_paths[path], path)
+        delta = create_chunks.diff_chunks(previous, current)
+        with open(f"{input_path}.chunks.diff.json", "w", encoding="utf-8") as f:
+            json.dump({"source": str(src), "previous_chunks": len(previous), "chunks": len(current), **delta}, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        vectors = np.load(out_vectors, mmap_mode="r")
+        file_meta = {
+            **meta,
+            "source": str(out_chunks),
+            "records": len(current),
+            "vectors": {"file": str(out_vectors), "dtype": "float32", "shape": list(vectors.shape)},
+        }
+        Path(f"{out_chunks}.embeddings.meta.json").write_text(json.dumps(file_meta, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+    # Busy time of the upload stage: building the objects plus the inserts, which pull them one at a time
+    return {
+        **result,
+        "chunks": len(current),
+        "seconds": round(time.monotonic() - started, 3),
+        "stages": {name: {"items": int(s["items"]), "busy_seconds": round(s["busy_seconds"], 3)} for name, s in pipeline.stats.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Chunk, embed and upload a Markdown document into Weaviate, the three stages running concurrently."
+    )
+    parser.add_argument("input", help="Path to the input Markdown file (.converted.md)")
+    parser.add_argument(
+        "-c",
+        "--collection-name",
+        default="rag_chunks",
+        help='Weaviate collection name (default: "rag_chunks")',
+    )
+    parser.add_argument(
+        "-s",
+        "--chunk-size",
+        type=int,
+        default=200,
+        help="Target chunk size in tokens (default: 200)",
+    )
+    parser.add_argument(
+        "-t",
+        "--tokenizer",
+        default=None,
+        help="Hugging Face model whose tokenizer measures chunk sizes (default: word-based estimate)",
+    )
+    parser.add_argument(
+        "-k",
+        "--keywords",
+        choices=["tfidf", "freq"],
+        default="tfidf",
+        help="Keyword ranking: TF-IDF over the document, or raw frequency per chunk (default: tfidf)",
+    )
+    parser.add_argument(
+        "--openai",
+        action="store_true",
+        help="Use OpenAI API (model: text-embedding-3-large) instead of local sentence-transformers.",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Inference backend of the local model, see embedding_models.py (default: $EMB_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--openai-concurrency",
+        type=int,
+        default=8,
+        help="Number of OpenAI requests in flight (default: 8)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Shared embedding cache directory (default: $EMB_CACHE_DIR or ~/.cache/awsgpu/embeddings)",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=None,
+        help="Size bound of the embedding cache (default: $EMB_CACHE_MAX_MB or 2048)",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=1024,
+        help="Maximum number of chunks embedded together (default: 1024)",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue-size",
+        type=int,
+        default=8,
+        help="Capacity of the queues between stages, in batches (default: 8)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Send every object to Weaviate, including those already stored unchanged",
+    )
+    parser.add_argument(
+        "--keep-files",
+        action="store_true",
+        help="Also write the .chunks.jq, .chunks.diff.json and .embeddings.* files of the three-script pipeline",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        stats = ingest_markdown(
+            args.input,
+            collection_name=args.collection_name,
+            chunk_size_tokens=args.chunk_size,
+            tokenizer=args.tokenizer,
+            keywords=args.keywords,
+            use_openai=args.openai,
+            backend=args.backend,
+            cache_dir=args.cache_dir,
+            cache_max_mb=args.cache_max_mb,
+            openai_concurrency=args.openai_concurrency,
+            window=args.window,
+            queue_size=args.queue_size,
+            keep_files=args.keep_files,
+            full=args.full,
+        )
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+    print(update_weaviate.summary(stats, args.collection_name, stats["seconds"]))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
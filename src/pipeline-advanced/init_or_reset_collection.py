@@ -1,33 +1,119 @@
 #!/usr/bin/env python3
+"""
+Create (or reset) the Weaviate collection of the chunks, with its vector index options.
+
+- Index type: hnsw (default), flat (brute force: no graph in memory, fine up to some
+  10k objects), or dynamic (flat, switched to hnsw once --dynamic-threshold objects are
+  reached; requires ASYNC_INDEXING=true on the Weaviate server).
+- HNSW: --ef (search list size, -1 for the server's dynamic ef), --ef-construction and
+  --max-connections (graph degree); larger values give better recall at the cost of latency,
+  import time and memory.
+- Distance metric: cosine (default), dot or l2-squared.
+- Vector quantization, to shrink the in-memory vectors (768 float32 = 3 KB per object):
+  sq (1 byte per dimension, 4x), pq (--pq-segments bytes per vector, 192 by default: 16x),
+  bq (1 bit per dimension, 32x). Quantized searches rescore their candidates with the full
+  vectors; flat indexes only support bq.
+
+Measure the recall of a configuration with index_benchmark.py once documents are loaded.
+
+Blue/green rebuilds (Weaviate >= 1.32): -c names an alias, which every script queries like a
+collection, pointing to a generation <name>_<UTC timestamp> of the collection.
+- --blue-green creates a new, empty generation and prints its name; the current one keeps
+  serving queries while documents are loaded into the new one (ingest.py -c <generation>).
+- --promote <generation> checks the new generation (at least --min-objects objects, and
+  --min-ratio times the objects of the current one), repoints the alias to it in one request,
+  then deletes the former generations after --grace-seconds (queries in flight end first),
+  except the --keep most recent ones, left for a rollback (--promote <older generation>).
+A collection that has the name of the alias (created before blue/green) counts as the current
+one; the first promotion validates the new generation against it, then deletes it and creates
+the alias right away (Weaviate refuses an alias named like a collection): the only moment
+without an index, the time of two requests.
+Without these options, the collection is recreated empty; behind an alias, a new empty
+generation is created and its name printed, the current one keeps serving queries until
+--promote.
+
+Usage:
+  ./src/pipeline-advanced/init_or_reset_collection.py
+  ./src/pipeline-advanced/init_or_reset_collection.py --index hnsw --ef 128 --max-connections 32 --quantizer sq
+  NEW=$(./src/pipeline-advanced/init_or_reset_collection.py --blue-green)
+  ./src/pipeline-advanced/ingest.py -c $NEW doc.docx.html.md.converted.md
+  ./src/pipeline-advanced/init_or_reset_collection.py --promote $NEW
+"""
 
 from __future__ import annotations
 
 import argparse
 import json
+import re
 import sys
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, List, Optional
-import os
 
 try:
-    import weaviate
-    from weaviate.classes.config import Configure, Property, DataType
+    from weaviate.classes.config import Configure, Property, DataType, Tokenization, VectorDistances
+    from weaviate.exceptions import WeaviateUnsupportedFeatureError
 except Exception as exc:
     print("Error: weaviate-client is required. Install with: pip install weaviate-client", file=sys.stderr)
     raise
 
+from weaviate_infos import invalidate_cache
+from weaviate_pool import connect_local
+
+
+
+
+INDEX_TYPES = ["hnsw", "flat", "dynamic"]
+DISTANCES = ["cosine", "dot", "l2-squared"]
+QUANTIZERS = ["none", "sq", "pq", "bq"]
 
-def _connect_local():
-    # Connect to a local Weaviate (default URL/env). Adjust here if needed.
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
-    else:
-        # Pas d'URL fournie, on utilise la connexion locale par défaut
-        return weaviate.connect_to_local()
 
+def _quantizer(name: str, training_limit: Optional[int] = None, pq_segments: Optional[int] = None):
+    if name == "sq":
+        return Configure.VectorIndex.Quantizer.sq(training_limit=training_limit)
+    if name == "pq":
+        return Configure.VectorIndex.Quantizer.pq(segments=pq_segments, training_limit=training_limit)
+    if name == "bq":
+        return Configure.VectorIndex.Quantizer.bq()
+    return None
 
-def _ensure_collection(client, name: str):
+
+def vector_index_config(
+    index_type: str = "hnsw",
+    distance: str = "cosine",
+    ef: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    max_connections: Optional[int] = None,
+    quantizer: str = "none",
+    training_limit: Optional[int] = None,
+    pq_segments: Optional[int] = None,
+    dynamic_threshold: Optional[int] = None,
+):
+    """
+    Vector index configuration of the "text" vector; options left to None keep the server defaults.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of: {', '.join(INDEX_TYPES)}")
+    if index_type == "flat" and quantizer not in ("none", "bq"):
+        raise ValueError(f"A flat index only supports bq quantization, not {quantizer}")
+    metric = VectorDistances(distance)
+    hnsw = Configure.VectorIndex.hnsw(
+        distance_metric=metric,
+        ef=ef,
+        ef_construction=ef_construction,
+        max_connections=max_connections,
+        quantizer=_quantizer(quantizer, training_limit, pq_segments),
+    )
+    if index_type == "hnsw":
+        return hnsw
+    flat = Configure.VectorIndex.flat(distance_metric=metric, quantizer=_quantizer(quantizer) if quantizer == "bq" else None)
+    if index_type == "flat":
+        return flat
+    return Configure.VectorIndex.dynamic(distance_metric=metric, threshold=dynamic_threshold, hnsw=hnsw, flat=flat)
+
+
+def _ensure_collection(client, name: str, index_config=None):
     """
     Ensure a collection exists with vectorizer disabled and an appropriate schema.
 
@@ -36,6 +122,9 @@ def _ensure_collection(client, name: str):
     """
     props = [
         Property(name="chunk_id", data_type=DataType.TEXT),
+        # Document of the chunk (chunk_id without its sequence number), grouped on by weaviate_infos.py;
+        # one token, so that update_weaviate.py selects a document by equality
+        Property(name="source_file", data_type=DataType.TEXT, tokenization=Tokenization.FIELD),
         Property(name="text", data_type=DataType.TEXT),
         Property(name="approx_tokens", data_type=DataType.INT),
         Property(name="keywords", data_type=DataType.TEXT_ARRAY),
@@ -73,14 +162,18 @@ def _ensure_collection(client, name: str):
             ],
         ),
         Property(name="full_headings", data_type=DataType.TEXT),
+        # Identity of the chunk content (create_chunks.py), from which update_weaviate.py derives object uuids
+        Property(name="content_hash", data_type=DataType.TEXT),
+        # Digest of the properties and model of the object, compared by update_weaviate.py before skipping it
+        Property(name="sync_digest", data_type=DataType.TEXT),
     ]
 
+    # Vectors are computed by create_embeddings.py (no vectorizer): only the main "text" vector
     vectors_conf = [
-        {
-            "name": "text",
-            "vectorizer": Configure.Vectorizer.none(),
-            "vector_index_config": Configure.VectorIndex.hnsw(),
-        },
+        Configure.Vectors.self_provided(
+            name="text",
+            vector_index_config=index_config if index_config is not None else vector_index_config(),
+        ),
     ]
 
     try:
@@ -93,6 +186,7 @@ def _ensure_collection(client, name: str):
         properties=props,
         vector_config=vectors_conf,
     )
+    invalidate_cache()
 
 def _to_float_list(vec: Any) -> Optional[List[float]]:
     if vec is None:
@@ -103,10 +197,105 @@ def _to_float_list(vec: Any) -> Optional[List[float]]:
         return None
 
 
-def do_job(collection_name: str = "rag_chunks"):
-    client = _connect_local()
+def _class_name(name: str) -> str:
+    # Weaviate stores collection and alias names with a capital first letter
+    return name[:1].upper() + name[1:]
+
+
+def alias_target(client, alias_name: str) -> Optional[str]:
     try:
-        _ensure_collection(client, collection_name)
+        alias = client.alias.get(alias_name=_class_name(alias_name))
+    except WeaviateUnsupportedFeatureError:
+        # Weaviate < 1.32: no aliases
+        return None
+    return alias.collection if alias is not None else None
+
+
+def count_objects(client, name: str) -> int:
+    return client.collections.get(name).aggregate.over_all(total_count=True).total_count or 0
+
+
+def generations(client, alias_name: str) -> List[str]:
+    """
+    Names of the generations of an alias (<alias>_<timestamp>), oldest first.
+    """
+    pattern = re.compile(re.escape(_class_name(alias_name)) + r"_\d{14}$")
+    return sorted(name for name in client.collections.list_all(simple=True) if pattern.match(name))
+
+
+def create_generation(client, alias_name: str, index_config=None) -> str:
+    name = f"{_class_name(alias_name)}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    while client.collections.exists(name):
+        # Two rebuilds within the same second
+        time.sleep(1.0)
+        name = f"{_class_name(alias_name)}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    _ensure_collection(client, name, index_config)
+    return name
+
+
+def promote(
+    client,
+    collection: str,
+    alias_name: str = "rag_chunks",
+    min_objects: int = 1,
+    min_ratio: float = 0.9,
+    keep: int = 0,
+    grace_seconds: float = 5.0,
+) -> Dict[str, Any]:
+    """
+    Point alias_name to collection once its object count is validated, then delete the former
+    generations but the keep most recent ones. Returns what was done.
+    """
+    collection = _class_name(collection)
+    alias = _class_name(alias_name)
+    if not client.collections.exists(collection):
+        raise ValueError(f"Collection {collection} does not exist")
+    objects = count_objects(client, collection)
+    previous = alias_target(client, alias)
+    # Collection created before blue/green, under the name of the alias
+    legacy = previous is None and client.collections.exists(alias)
+    current = alias if legacy else previous
+    previous_objects = count_objects(client, current) if current else 0
+    if objects < min_objects:
+        raise ValueError(f"{collection} holds {objects} objects, fewer than {min_objects}: alias {alias} left unchanged")
+    if current and objects < min_ratio * previous_objects:
+        raise ValueError(
+            f"{collection} holds {objects} objects, fewer than {min_ratio:g} x {previous_objects} in {current}: "
+            f"alias {alias} left unchanged (see --min-ratio)"
+        )
+
+    if previous is None:
+        if legacy:
+            # Validated above; the alias replaces it with the next request
+            client.collections.delete(alias)
+        client.alias.create(alias_name=alias, target_collection=collection)
+    elif previous != collection:
+        client.alias.update(alias_name=alias, new_target_collection=collection)
+    invalidate_cache()
+
+    former = [name for name in generations(client, alias) if name != collection]
+    # Generations older than the promoted one go first; newer ones (after a rollback) are kept
+    former = [name for name in former if name < collection]
+    to_delete = former[: max(0, len(former) - keep)]
+    if to_delete and grace_seconds > 0:
+        time.sleep(grace_seconds)
+    for name in to_delete:
+        client.collections.delete(name)
+    return {"alias": alias, "collection": collection, "objects": objects, "previous": current, "deleted": to_delete}
+
+
+def do_job(collection_name: str = "rag_chunks", **index_options) -> Optional[str]:
+    """
+    Recreate the collection empty. Behind an alias, create a new empty generation instead and
+    return its name: the current one keeps serving queries until it is promoted.
+    """
+    index_config = vector_index_config(**index_options)
+    client = connect_local()
+    try:
+        if alias_target(client, collection_name) is None:
+            _ensure_collection(client, collection_name, index_config)
+            return None
+        return create_generation(client, collection_name, index_config)
     finally:
         client.close()
 
@@ -121,12 +310,111 @@ def main(argv: Optional[List[str]] = None) -> int:
         default="rag_chunks",
         help='Weaviate collection name to use/create (default: "rag_chunks")',
     )
+    parser.add_argument(
+        "-i",
+        "--index",
+        choices=INDEX_TYPES,
+        default="hnsw",
+        help="Vector index type (default: hnsw)",
+    )
+    parser.add_argument(
+        "-d",
+        "--distance",
+        choices=DISTANCES,
+        default="cosine",
+        help="Distance metric (default: cosine)",
+    )
+    parser.add_argument("--ef", type=int, default=None, help="HNSW search list size, -1 for dynamic ef (default: server default)")
+    parser.add_argument("--ef-construction", type=int, default=None, help="HNSW build list size (default: server default, 128)")
+    parser.add_argument("--max-connections", type=int, default=None, help="HNSW graph degree (default: server default, 32)")
+    parser.add_argument(
+        "-q",
+        "--quantizer",
+        choices=QUANTIZERS,
+        default="none",
+        help="Vector quantization (default: none)",
+    )
+    parser.add_argument(
+        "--training-limit",
+        type=int,
+        default=None,
+        help="Number of objects after which sq/pq is trained (default: server default, 100000)",
+    )
+    parser.add_argument("--pq-segments", type=int, default=None, help="PQ segments (bytes per vector); must divide 768 (default: server default)")
+    parser.add_argument(
+        "--dynamic-threshold",
+        type=int,
+        default=None,
+        help="Number of objects at which a dynamic index switches from flat to hnsw (default: server default, 10000)",
+    )
+    parser.add_argument(
+        "--blue-green",
+        action="store_true",
+        help="Create a new generation of the collection behind the alias --collection-name, and print its name",
+    )
+    parser.add_argument(
+        "--promote",
+        metavar="GENERATION",
+        default=None,
+        help="Point the alias --collection-name to this generation, then delete the former ones",
+    )
+    parser.add_argument("--min-objects", type=int, default=1, help="Objects required to promote a generation (default: 1)")
+    parser.add_argument(
+        "--min-ratio",
+        type=float,
+        default=0.9,
+        help="Objects required to promote a generation, relative to the current one (default: 0.9)",
+    )
+    parser.add_argument("--keep", type=int, default=0, help="Former generations kept after a promotion (default: 0)")
+    parser.add_argument(
+        "--grace-seconds",
+        type=float,
+        default=5.0,
+        help="Delay between the promotion and the deletion of the former generations (default: 5)",
+    )
     args = parser.parse_args(argv)
 
+    index_options = dict(
+        index_type=args.index,
+        distance=args.distance,
+        ef=args.ef,
+        ef_construction=args.ef_construction,
+        max_connections=args.max_connections,
+        quantizer=args.quantizer,
+        training_limit=args.training_limit,
+        pq_segments=args.pq_segments,
+        dynamic_threshold=args.dynamic_threshold,
+    )
     try:
-        do_job(
-            collection_name=args.collection_name,
-        )
+        if args.promote:
+            client = connect_local()
+            try:
+                done = promote(
+                    client,
+                    args.promote,
+                    args.collection_name,
+                    min_objects=args.min_objects,
+                    min_ratio=args.min_ratio,
+                    keep=args.keep,
+                    grace_seconds=args.grace_seconds,
+                )
+            finally:
+                client.close()
+            print(json.dumps(done, ensure_ascii=False))
+        elif args.blue_green:
+            client = connect_local()
+            try:
+                print(create_generation(client, args.collection_name, vector_index_config(**index_options)))
+            finally:
+                client.close()
+        else:
+            generation = do_job(collection_name=args.collection_name, **index_options)
+            if generation is not None:
+                print(generation)
+                print(
+                    f"{args.collection_name} is an alias: load {generation}, then promote it with --promote {generation}",
+                    file=sys.stderr,
+                )
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
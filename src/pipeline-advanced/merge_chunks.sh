@@ -41,7 +41,10 @@ PROMPT_CONTENT=`cat "$PREFIX.prompt"`
 
 echo
 echo -n "Input tokens: "
-echo "$PROMPT_CONTENT" | ./src/pipeline-advanced/count_tokens.py
+# Tokenizer kept loaded by retrieval_server.py when it is up
+if ! curl -sf -m 30 --data-binary "@$PREFIX.prompt" "${RETRIEVAL_URL:-http://127.0.0.1:8124}/count_tokens" 2> /dev/null; then
+    echo "$PROMPT_CONTENT" | ./src/pipeline-advanced/count_tokens.py
+fi
 echo
 
 if (( OPENAI_LLM )); then
@@ -0,0 +1,57 @@
+"""
+Process-wide registry of lazily loaded models and API clients (embedding model, cross-encoder,
+tokenizer, OpenAI client) and of opened embedding caches, shared by search_chunks.py, rerank.py
+and count_tokens.py, so that a long-running process importing them (retrieval_server.py, an
+evaluation loop) loads each model, and indexes each cache, once instead of once per query.
+
+- get(key, factory): the object registered under key, built by factory() on first use. Concurrent
+  first calls build it once: the others wait for it.
+- using(key, factory): the same object, with the lock of its key held, for objects that are not
+  thread-safe (the fast tokenizers of Hugging Face fail with "Already borrowed" when shared by
+  threads): inference on one model is serialised, different models run in parallel.
+- Keys are tuples, e.g. ("sentence-transformers", model name, backend).
+"""
+
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator
+
+
+_objects: Dict[Hashable, Any] = {}
+_locks: Dict[Hashable, threading.RLock] = {}
+_guard = threading.Lock()
+
+
+def lock(key: Hashable) -> threading.RLock:
+    with _guard:
+        found = _locks.get(key)
+        if found is None:
+            found = _locks[key] = threading.RLock()
+        return found
+
+
+def get(key: Hashable, factory: Callable[[], Any]) -> Any:
+    obj = _objects.get(key)
+    if obj is None:
+        with lock(key):
+            obj = _objects.get(key)
+            if obj is None:
+                obj = _objects[key] = factory()
+    return obj
+
+
+@contextmanager
+def using(key: Hashable, factory: Callable[[], Any]) -> Iterator[Any]:
+    obj = get(key, factory)
+    with lock(key):
+        yield obj
+
+
+def clear() -> None:
+    """
+    Forget every object (they are reloaded on next use).
+    """
+    with _guard:
+        _objects.clear()
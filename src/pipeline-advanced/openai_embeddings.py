@@ -0,0 +1,253 @@
+"""
+Concurrent client for the OpenAI embeddings API, used by create_embeddings.py --openai.
+
+- Packs texts into requests by token count, up to the per-request limits of the API
+  (300k tokens, 2048 inputs), and spreads them so that every concurrent request has work.
+  Tokens are counted with tiktoken when it is installed, estimated from the UTF-8 length otherwise.
+- Keeps up to `concurrency` requests in flight (asyncio, AsyncOpenAI); results are delivered
+  batch by batch, as requests complete.
+- 429: every request waits for the Retry-After delay of the response (or an exponential backoff
+  with jitter when there is none); 5xx, timeouts and connection errors are retried the same way,
+  without pausing the other requests. A request is given up after max_attempts tries.
+- 400 because an input exceeds the context length of the model (or the request the tokens per
+  request): the batch is split in two halves,
+  retried separately, until the rejected input is isolated; that input is then retried truncated
+  to half its length, up to max_truncations times. Its vector, that of the truncated text, is
+  flagged (truncated) so that callers do not cache it as the vector of the whole text.
+  Any other 400 (unknown model, invalid parameter) is raised at once.
+- Vectors are transferred base64-encoded (float32), which is several times smaller than JSON floats.
+
+The API endpoint is taken from $OPENAI_BASE_URL when set, e.g. to run against
+openai_mock_server.py for offline tests:
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAIAPIKEY=test ./src/pipeline-advanced/create_embeddings.py --openai chunks.jsonl
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import email.utils
+import math
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+_MAX_BACKOFF = 60.0
+# "This model's maximum context length is 8192 tokens, however you requested ...",
+# "Requested 310000 tokens, max 300000 tokens per request"
+_CONTEXT_LENGTH_RE = re.compile(r"context[ _]length|tokens per request|too many tokens", re.IGNORECASE)
+
+
+def _normalize_text(s: str) -> str:
+    # Normalize inputs for OpenAI API: replace newlines, avoid empty strings
+    s = s.replace("\r", " ").replace("\n", " ").strip()
+    return s or " "
+
+
+def token_counter(model: str) -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(model)
+        return lambda s: len(encoding.encode(s, disallowed_special=()))
+    except Exception:
+        # Without tiktoken (or its encoding files): over-estimate, at ~3 bytes per token
+        return lambda s: len(s.encode("utf-8")) // 3 + 1
+
+
+def pack_batches(token_counts: Sequence[int], max_tokens: int, max_inputs: int = MAX_INPUTS_PER_REQUEST) -> List[List[int]]:
+    """
+    Group consecutive indices into batches of at most max_tokens tokens and max_inputs inputs
+    (an input larger than max_tokens gets a batch of its own).
+    """
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    used = 0
+    for i, n in enumerate(token_counts):
+        if batch and (used + n > max_tokens or len(batch) >= max_inputs):
+            batches.append(batch)
+            batch = []
+            used = 0
+        batch.append(i)
+        used += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _context_length_exceeded(exc: Exception) -> bool:
+    if getattr(exc, "code", None) == "context_length_exceeded":
+        return True
+    return bool(_CONTEXT_LENGTH_RE.search(str(getattr(exc, "message", None) or exc)))
+
+
+def _decode(embedding) -> np.ndarray:
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4").astype(np.float32)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+class OpenAIEmbedder:
+    """
+    Embed texts with the OpenAI API, `concurrency` requests at a time.
+    iter_embeddings() yields (indices into texts, float32 vectors) as requests complete; the
+    indices of the texts that were embedded truncated are in truncated before their vector is yielded.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        api_key: str,
+        base_url: Optional[str] = None,
+        concurrency: int = 8,
+        max_request_tokens: int = MAX_TOKENS_PER_REQUEST,
+        max_attempts: int = 8,
+        max_truncations: int = 8,
+        timeout: float = 120.0,
+    ) -> None:
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.concurrency = max(1, concurrency)
+        self.max_request_tokens = max_request_tokens
+        self.max_attempts = max_attempts
+        self.max_truncations = max_truncations
+        self.timeout = timeout
+        self.count_tokens = token_counter(model)
+        # Counters of the last run, reported by create_embeddings.py
+        self.requests = 0
+        self.retries = 0
+        self.splits = 0
+        self.truncated: Set[int] = set()
+
+    def iter_embeddings(self, texts: Sequence[str]) -> Iterator[Tuple[List[int], np.ndarray]]:
+        # The event loop runs in a thread of its own, so that callers can consume results as they come
+        results: queue.Queue = queue.Queue()
+        done = object()
+
+        def run() -> None:
+            try:
+                asyncio.run(self._run([_normalize_text(t) for t in texts], results.put))
+            except BaseException as exc:
+                results.put(exc)
+            else:
+                results.put(done)
+
+        thread = threading.Thread(target=run, name="openai-embeddings", daemon=True)
+        thread.start()
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+        thread.join()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        for indices, vectors in self.iter_embeddings(texts):
+            for i, vec in zip(indices, vectors):
+                out[i] = vec
+        return np.stack(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+    async def _run(self, texts: List[str], emit: Callable[[Tuple[List[int], np.ndarray]], None]) -> None:
+        from openai import AsyncOpenAI
+
+        self.requests = self.retries = self.splits = 0
+        self.truncated = set()
+        counts = [self.count_tokens(t) for t in texts]
+        # Smaller requests than the API allows when there are few texts, so that all the concurrent slots are used
+        target = max(1, min(self.max_request_tokens, math.ceil(sum(counts) / self.concurrency)))
+        batches = pack_batches(counts, target)
+
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._resume_at = 0.0
+        # Retries are handled here, with the whole batch in view
+        async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout) as client:
+            await asyncio.gather(*(self._send(client, texts, batch, emit) for batch in batches))
+
+    async def _send(self, client, texts: List[str], batch: List[int], emit) -> None:
+        import openai
+
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        truncations = 0
+        while True:
+            try:
+                async with self._slots:
+                    # A 429 pauses every request, not only the one that received it
+                    while (delay := self._resume_at - loop.time()) > 0:
+                        await asyncio.sleep(delay)
+                    self.requests += 1
+                    resp = await client.embeddings.create(
+                        model=self.model,
+                        input=[texts[i] for i in batch],
+                        encoding_format="base64",
+                    )
+            except openai.BadRequestError as exc:
+                if not _context_length_exceeded(exc):
+                    raise
+                if len(batch) > 1:
+                    self.splits += 1
+                    half = len(batch) // 2
+                    await asyncio.gather(
+                        self._send(client, texts, batch[:half], emit),
+                        self._send(client, texts, batch[half:], emit),
+                    )
+                    return
+                text = texts[batch[0]]
+                if len(text) <= 1 or truncations >= self.max_truncations:
+                    raise
+                truncations += 1
+                texts[batch[0]] = text[: len(text) // 2]
+                self.truncated.add(batch[0])
+                print(f"Warning: input {batch[0]} rejected ({exc}), retrying with its first {len(texts[batch[0]])} characters", file=sys.stderr)
+                continue
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as exc:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                self.retries += 1
+                wait = _retry_after(exc)
+                if wait is None:
+                    wait = min(_MAX_BACKOFF, 2.0 ** attempt) * random.uniform(0.5, 1.0)
+                if isinstance(exc, openai.RateLimitError):
+                    self._resume_at = max(self._resume_at, loop.time() + wait)
+                else:
+                    await asyncio.sleep(wait)
+                continue
+
+            data = sorted(resp.data, key=lambda d: d.index)
+            if len(data) != len(batch):
+                raise RuntimeError(f"OpenAI returned {len(data)} embeddings for {len(batch)} inputs")
+            emit((batch, np.stack([_decode(d.embedding) for d in data])))
+            return
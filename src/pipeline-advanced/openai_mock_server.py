@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Local mock of the OpenAI embeddings endpoint (POST /v1/embeddings), to test the --openai
+mode of create_embeddings.py offline and without cost.
+
+- Vectors are deterministic: unit-norm, seeded by the SHA-256 of the input text, of --dimensions
+  floats; returned as JSON floats or base64 float32, depending on encoding_format.
+- Enforces the limits of the API: --max-inputs per request, --max-request-tokens per request and
+  --max-input-tokens per input (tokens estimated at 4 UTF-8 bytes each), answering 400 otherwise.
+- Injects failures: a 429 with a Retry-After header for a --rate-limit share of the requests,
+  a 500 for an --error-rate share of them, and a context length 400 for any request holding an
+  input that contains --reject (to exercise the bisection of failing batches and the truncation
+  of the rejected input).
+- Waits --latency-ms per request, plus --ms-per-1k-tokens, to mimic the latency of the API.
+
+Usage:
+  ./src/pipeline-advanced/openai_mock_server.py --port 8089 --rate-limit 0.05 --latency-ms 300
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAIAPIKEY=test ./src/pipeline-advanced/create_embeddings.py --openai chunks.jsonl
+
+Prints one line per request on stderr: status, number of inputs, estimated tokens.
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def mock_embedding(text: str, dimensions: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "openai-mock/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(
+        self, status: int, message: str, type_: str, headers: Optional[Dict[str, str]] = None, code: Optional[str] = None
+    ) -> None:
+        self._reply(status, {"error": {"message": message, "type": type_, "param": None, "code": code}}, headers)
+
+    def do_POST(self) -> None:
+        opts = self.server.options
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._error(400, "Invalid JSON body", "invalid_request_error")
+            return
+        if self.path.rstrip("/") not in ("/v1/embeddings", "/embeddings"):
+            self._error(404, f"Unknown path {self.path}", "invalid_request_error")
+            return
+
+        inputs = req.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not isinstance(inputs, list) or not inputs or not all(isinstance(s, str) and s for s in inputs):
+            self._error(400, "'input' must be a non-empty string or array of non-empty strings", "invalid_request_error")
+            return
+        tokens = [_estimate_tokens(s) for s in inputs]
+        status = 200
+        with self.server.lock:
+            roll = self.server.rng.random()
+        try:
+            if roll < opts.rate_limit:
+                status = 429
+                self._error(
+                    429,
+                    "Rate limit reached for requests (mock)",
+                    "requests",
+                    {"retry-after": f"{opts.retry_after:g}", "retry-after-ms": str(int(opts.retry_after * 1000))},
+                )
+                return
+            if roll < opts.rate_limit + opts.error_rate:
+                status = 500
+                self._error(500, "The server had an error while processing your request (mock)", "server_error")
+                return
+            if len(inputs) > opts.max_inputs:
+                status = 400
+                self._error(400, f"'input' must have at most {opts.max_inputs} items", "invalid_request_error")
+                return
+            if sum(tokens) > opts.max_request_tokens:
+                status = 400
+                self._error(
+                    400,
+                    f"Requested {sum(tokens)} tokens, max {opts.max_request_tokens} tokens per request",
+                    "invalid_request_error",
+                )
+                return
+            too_long = next((n for n in tokens if n > opts.max_input_tokens), None)
+            if too_long is not None:
+                status = 400
+                self._error(
+                    400,
+                    f"This model's maximum context length is {opts.max_input_tokens} tokens, however you requested {too_long} tokens",
+                    "invalid_request_error",
+                    code="context_length_exceeded",
+                )
+                return
+            if opts.reject and any(opts.reject in s for s in inputs):
+                status = 400
+                self._error(
+                    400,
+                    f"This model's maximum context length is exceeded (mock: input contains {opts.reject!r})",
+                    "invalid_request_error",
+                    code="context_length_exceeded",
+                )
+                return
+
+            time.sleep((opts.latency_ms + opts.ms_per_1k_tokens * sum(tokens) / 1000.0) / 1000.0)
+            base64_format = req.get("encoding_format") == "base64"
+            data: List[Dict] = []
+            for i, text in enumerate(inputs):
+                vec = mock_embedding(text, opts.dimensions)
+                embedding = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii") if base64_format else vec.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            self._reply(
+                200,
+                {
+                    "object": "list",
+                    "data": data,
+                    "model": req.get("model"),
+                    "usage": {"prompt_tokens": sum(tokens), "total_tokens": sum(tokens)},
+                },
+            )
+        finally:
+            print(f"{status} inputs={len(inputs)} tokens={sum(tokens)}", file=sys.stderr, flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI embeddings API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8089, help="Listen port (default: 8089)")
+    parser.add_argument("--dimensions", type=int, default=3072, help="Size of the vectors (default: 3072, as text-embedding-3-large)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency of each request (default: 0)")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=0.0, help="Additional latency per 1000 input tokens (default: 0)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of requests answered 429 (default: 0)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 responses, in seconds (default: 1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered 500 (default: 0)")
+    parser.add_argument("--reject", default=None, help="Answer 400 to requests holding an input that contains this string")
+    parser.add_argument("--max-inputs", type=int, default=2048, help="Maximum inputs per request (default: 2048)")
+    parser.add_argument("--max-request-tokens", type=int, default=300_000, help="Maximum tokens per request (default: 300000)")
+    parser.add_argument("--max-input-tokens", type=int, default=8192, help="Maximum tokens per input (default: 8192)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the failure injection (default: 0)")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.daemon_threads = True
+    server.options = args
+    server.rng = random.Random(args.seed)
+    server.lock = threading.Lock()
+    print(f"Listening on http://{args.host}:{server.server_port}/v1", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
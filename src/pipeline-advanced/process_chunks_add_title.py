@@ -49,6 +49,19 @@ def _deepest_heading_text(headings: Any) -> Optional[str]:
     return best_text
 
 
+def add_title(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Prefix the "text" of a chunk with its deepest heading + DELIMITER, if a heading exists.
+    The object is modified in place and returned.
+    """
+    text = obj.get("text")
+    deepest = _deepest_heading_text(obj.get("headings"))
+
+    if isinstance(text, str) and deepest:
+        obj["text"] = f"{deepest}{DELIMITER}{text}"
+    return obj
+
+
 def process_file(input_path: str) -> str:
     """
     Read NDJSON from input_path, modify each JSON object by prefixing "text"
@@ -73,14 +86,7 @@ def process_file(input_path: str) -> str:
                 fout.write(line)
                 continue
 
-            text = obj.get("text")
-            headings = obj.get("headings")
-            deepest = _deepest_heading_text(headings)
-
-            if isinstance(text, str) and deepest:
-                obj["text"] = f"{deepest}{DELIMITER}{text}"
-
-            fout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            fout.write(json.dumps(add_title(obj), ensure_ascii=False) + "\n")
 
     return output_path
 
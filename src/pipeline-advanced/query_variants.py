@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Query variants of a question, for the multi-query retrieval of search_chunks.py (see TDL.txt):
+the searches of all the variants are fused, so that chunks worded differently from the
+question are found too.
+
+Kinds of variants, each asked to the local LLM (Ollama, gpt-oss:20b, on $OLLAMA_HOST):
+- rewrite: reformulations of the question (--rewrites of them);
+- keywords: the keywords of the question, most discriminant first (for BM25 in --hybrid);
+- hyde: a typical answer of at most 20 words, closer to the wording of the chunks than the
+  question is (Hypothetical Document Embeddings).
+
+The requests for the kinds run concurrently. A kind whose request fails is left out, with a
+warning on stderr: the question itself is always searched.
+
+Usage:
+  ./src/pipeline-advanced/query_variants.py "Quels sont les composants de la forge ?"
+  ./src/pipeline-advanced/query_variants.py -t keywords,hyde "Quels sont les composants de la forge ?"
+
+Prints one variant per line, as JSON: { "kind": ..., "text": ... }.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+import urllib.request as _urlrequest
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+
+KINDS = ["rewrite", "keywords", "hyde"]
+
+_MODEL = "gpt-oss:20b"
+
+_PROMPTS: Dict[str, str] = {
+    "rewrite": (
+        "Dans un contexte de systèmes informatiques, reformule la question suivante de {n} façons différentes, "
+        "en gardant son sens, pour une recherche RAG. Réponds sans raisonnement, une reformulation par ligne, "
+        "sans numérotation ni autre texte. Voici la question : '{question}'"
+    ),
+    # Prompts of TDL.txt
+    "keywords": (
+        "Réponds en une phrase et sans raisonnement. Donne-moi les mots clés de la question suivante, "
+        "du plus discriminant au moins discriminant, pour une recherche RAG par mots clés : \"{question}\""
+    ),
+    "hyde": (
+        "Dans un contexte de systèmes informatiques, donne moi une réponse typique de 20 mots maximum "
+        "correspondant à la question suivante, pour que je puisse identifier, à l'aide d'embeddings, des chunks "
+        "correspondant à la question, pour implémenter un RAG. Voici la question : '{question}'"
+    ),
+}
+
+# "1. ", "- ", "* " (or several of them) at the start of a line of the answer
+_BULLET_RE = re.compile(r"^\s*(?:(?:[-*•]|\d+[.)])\s*)+")
+
+
+def _chat(prompt: str, model: str = _MODEL, timeout: float = 60.0) -> str:
+    host = os.environ.get("OLLAMA_HOST") or "localhost"
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": False}
+    req = _urlrequest.Request(
+        f"http://{host}:11434/v1/chat/completions",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with _urlrequest.urlopen(req, timeout=timeout) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    return (data["choices"][0]["message"].get("content") or "").strip()
+
+
+def _parse(kind: str, answer: str, rewrites: int) -> List[str]:
+    if kind == "rewrite":
+        lines = [_BULLET_RE.sub("", line).strip().strip("\"'") for line in answer.splitlines()]
+        return [line for line in lines if line][:rewrites]
+    answer = " ".join(answer.split()).strip("\"'")
+    return [answer] if answer else []
+
+
+def generate_variants(
+    question: str, kinds: Optional[List[str]] = None, rewrites: int = 3, model: str = _MODEL, timeout: float = 60.0
+) -> List[Dict[str, str]]:
+    """
+    Variants of the question, in the order of kinds: [{ "kind": ..., "text": ... }, ...],
+    without duplicates nor the question itself.
+    """
+    kinds = kinds or KINDS
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        raise ValueError(f"Unknown variant kind(s) {', '.join(unknown)}, expected: {', '.join(KINDS)}")
+
+    def ask(kind: str) -> List[str]:
+        try:
+            return _parse(kind, _chat(_PROMPTS[kind].format(question=question, n=rewrites), model=model, timeout=timeout), rewrites)
+        except Exception as exc:
+            print(f"Warning: no {kind} variant: {exc}", file=sys.stderr)
+            return []
+
+    with ThreadPoolExecutor(max_workers=len(kinds)) as pool:
+        answers = list(pool.map(ask, kinds))
+
+    seen = {question.strip().lower()}
+    variants: List[Dict[str, str]] = []
+    for kind, texts in zip(kinds, answers):
+        for text in texts:
+            if text.lower() not in seen:
+                seen.add(text.lower())
+                variants.append({"kind": kind, "text": text})
+    return variants
+
+
+def parse_kinds(value: str) -> List[str]:
+    return [kind.strip() for kind in value.split(",") if kind.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate query variants of a question with the local LLM (Ollama).")
+    parser.add_argument("question", help="User question (string)")
+    parser.add_argument(
+        "-t",
+        "--kinds",
+        default=",".join(KINDS),
+        help=f"Comma-separated kinds of variants (default: {','.join(KINDS)})",
+    )
+    parser.add_argument("-n", "--rewrites", type=int, default=3, help="Number of rewrites (default: 3)")
+    parser.add_argument("--model", default=_MODEL, help=f"Ollama model (default: {_MODEL})")
+    args = parser.parse_args(argv)
+
+    try:
+        variants = generate_variants(args.question, parse_kinds(args.kinds), rewrites=args.rewrites, model=args.model)
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    for variant in variants:
+        print(json.dumps(variant, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
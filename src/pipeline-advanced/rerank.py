@@ -18,11 +18,22 @@ Rerank retrieved chunks for a given question using a Cross-Encoder.
       }
 
 - Behavior:
-  - Use cross-encoder/ms-marco-MiniLM-L-6-v2 from sentence-transformers to score (question, text) pairs.
+  - Cascade: a cheap first pass (--prefilter) orders the chunks and keeps the --top-m (default 100)
+    most promising ones, adding a "prefilter" score to each chunk:
+    - bm25 (default): reciprocal rank fusion of the input order (the ranking of the search, by
+      bi-encoder distance) and of a BM25 score of the text for the words of the question, over
+      the candidates;
+    - distance: the input order only;
+    - tiny: a small distilled cross-encoder (ms-marco-TinyBERT-L-2-v2, 256 tokens).
+    --top-m 0 skips the first pass.
+  - Use cross-encoder/ms-marco-MiniLM-L-6-v2 from sentence-transformers to score (question, text) pairs,
+    for the chunks kept by the first pass only.
   - Truncate inputs to 512 model tokens for reranking (model-side truncation).
-  - Add a "reranker" float score to each JSON object.
-  - Sort all chunks by "reranker" descending (best first).
+  - Add a "reranker" float score to each JSON object kept.
+  - Sort the chunks kept by "reranker" descending (best first), followed by the others in first pass order.
   - Write all chunks (not truncated) to <input>.reranked.jq in JSONL order.
+  - Report the latency of each stage on stderr (JSON). With --eval, also rerank all the chunks
+    and report the recall@-k (default 50) of the cascade against it.
 
 Note:
 - We only truncate at model input time; we always write back the original (untruncated) chunk text.
@@ -32,9 +43,13 @@ from __future__ import annotations
 
 import argparse
 import json
+import math
+import re
 import sys
+import time
+from collections import Counter
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 try:
     from sentence_transformers import CrossEncoder
@@ -45,6 +60,18 @@ except Exception as exc:  # pragma: no cover
     )
     raise
 
+import model_registry
+
+
+_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# First pass of the cascade with --prefilter tiny
+_TINY_MODEL_NAME = "cross-encoder/ms-marco-TinyBERT-L-2-v2"
+
+PREFILTERS = ["bm25", "distance", "tiny"]
+# Constant of reciprocal rank fusion, as search_chunks.RRF_K
+_RRF_K = 60
+_WORD_RE = re.compile(r"\w+")
+
 
 def read_jsonl(path: Path) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
@@ -80,30 +107,153 @@ def build_pairs(question: str, items: List[Dict[str, Any]]) -> List[List[str]]:
     return pairs
 
 
-def rerank(question: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    if not items:
-        return []
+def load_cross_encoder(model_name: str = _MODEL_NAME, max_length: int = 512) -> CrossEncoder:
+    # Ensure max_length=512 for model-side truncation
+    return CrossEncoder(model_name, max_length=max_length)
 
-    # Load CrossEncoder; ensure max_length=512 for model-side truncation
-    model = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2", max_length=512)
+
+def _cross_encode(question: str, items: List[Dict[str, Any]], model_name: str = _MODEL_NAME, max_length: int = 512) -> List[float]:
     pairs = build_pairs(question, items)
 
-    # Predict scores; model tokenization will truncate to max_length
-    scores = model.predict(pairs, batch_size=32, show_progress_bar=False)
+    # Predict scores; model tokenization will truncate to max_length.
+    # The CrossEncoder is loaded once per process, see model_registry.py
+    with model_registry.using(("cross-encoder", model_name), lambda: load_cross_encoder(model_name, max_length)) as model:
+        scores = model.predict(pairs, batch_size=32, show_progress_bar=False)
+    return [float(score) for score in scores]
+
+
+def rerank(question: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not items:
+        return []
 
     # Attach scores
-    for obj, score in zip(items, scores):
-        obj["reranker"] = float(score)
+    for obj, score in zip(items, _cross_encode(question, items)):
+        obj["reranker"] = score
 
     # Sort by score descending
     items_sorted = sorted(items, key=lambda x: x.get("reranker", float("-inf")), reverse=True)
     return items_sorted
 
 
+def bm25_scores(question: str, texts: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    """
+    Okapi BM25 score of each text for the words of the question, the texts being the corpus
+    (document frequencies and average length are those of the candidates).
+    """
+    docs = [_WORD_RE.findall(text.lower()) for text in texts]
+    terms = set(_WORD_RE.findall(question.lower()))
+    avg_len = sum(len(doc) for doc in docs) / len(docs) if docs else 0.0
+    df = {term: sum(1 for doc in docs if term in doc) for term in terms}
+    scores: List[float] = []
+    for doc in docs:
+        tf = Counter(t for t in doc if t in terms)
+        norm = k1 * (1.0 - b + b * len(doc) / avg_len) if avg_len else k1
+        scores.append(
+            sum(
+                math.log(1.0 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5)) * tf[term] * (k1 + 1.0) / (tf[term] + norm)
+                for term in tf
+            )
+        )
+    return scores
+
+
+def prefilter(question: str, items: List[Dict[str, Any]], method: str = "bm25") -> List[Dict[str, Any]]:
+    """
+    Cheap first pass of the cascade: items from the most to the least promising, with a
+    "prefilter" score (higher is better). The items are expected in the order of the search
+    (bi-encoder distance, or hybrid score).
+    - distance: the order of the search, unchanged;
+    - bm25: reciprocal rank fusion of the order of the search and of bm25_scores();
+    - tiny: scores of a small distilled cross-encoder (_TINY_MODEL_NAME, 256 tokens).
+    """
+    if method not in PREFILTERS:
+        raise ValueError(f"Unknown prefilter {method!r}, expected one of: {', '.join(PREFILTERS)}")
+    if method == "tiny":
+        scores = _cross_encode(question, items, model_name=_TINY_MODEL_NAME, max_length=256)
+    elif method == "bm25":
+        texts = [obj.get("text") if isinstance(obj.get("text"), str) else str(obj.get("text", "")) for obj in items]
+        keyword_scores = bm25_scores(question, texts)
+        keyword_ranks = {pos: rank for rank, pos in enumerate(sorted(range(len(items)), key=lambda i: -keyword_scores[i]), start=1)}
+        scores = [1.0 / (_RRF_K + pos + 1) + 1.0 / (_RRF_K + keyword_ranks[pos]) for pos in range(len(items))]
+    else:
+        scores = [-float(pos) for pos in range(len(items))]
+    for obj, score in zip(items, scores):
+        obj["prefilter"] = score
+    return sorted(items, key=lambda x: x["prefilter"], reverse=True)
+
+
+def cascade_rerank(
+    question: str, items: List[Dict[str, Any]], top_m: int = 100, method: str = "bm25"
+) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Two-stage reranking: prefilter() keeps the top_m most promising items, and only those are
+    scored by the cross-encoder; the others follow, in prefilter order, without "reranker" score.
+    top_m <= 0, or at least the number of items, reranks them all (no first pass).
+    Returns the items and the duration of each stage in milliseconds.
+    """
+    timings: Dict[str, float] = {}
+    tail: List[Dict[str, Any]] = []
+    if 0 < top_m < len(items):
+        start = time.perf_counter()
+        ordered = prefilter(question, items, method)
+        timings["prefilter"] = (time.perf_counter() - start) * 1000.0
+        items, tail = ordered[:top_m], ordered[top_m:]
+    start = time.perf_counter()
+    ranked = rerank(question, items)
+    timings["rerank"] = (time.perf_counter() - start) * 1000.0
+    return ranked + tail, timings
+
+
+def evaluate_cascade(question: str, items: List[Dict[str, Any]], top_m: int = 100, method: str = "bm25", k: int = 50) -> Dict[str, Any]:
+    """
+    Compare the cascade to the cross-encoder over all the items: recall@k of the cascade (share
+    of the k best items of the full reranking found among its k best) and latencies.
+    """
+    if not items:
+        raise ValueError("No item to rerank")
+    # Models loaded before the timings
+    cascade_rerank(question, [dict(items[0]), dict(items[0])], top_m=1, method=method)
+    start = time.perf_counter()
+    full = rerank(question, [dict(obj) for obj in items])
+    full_ms = (time.perf_counter() - start) * 1000.0
+    cascade, timings = cascade_rerank(question, [dict(obj) for obj in items], top_m=top_m, method=method)
+    k = min(k, len(items))
+    expected = {obj.get("chunk_id") for obj in full[:k]}
+    found = {obj.get("chunk_id") for obj in cascade[:k]}
+    return {
+        "candidates": len(items),
+        "top_m": top_m,
+        "prefilter": method,
+        "latency_ms": timings,
+        "full_rerank_ms": full_ms,
+        f"recall_at_{k}": len(expected & found) / k if k else 1.0,
+    }
+
+
 def main(argv: List[str] | None = None) -> int:
     parser = argparse.ArgumentParser(description="Rerank chunks for a question using a Cross-Encoder.")
     parser.add_argument("question", help="User question (string)")
     parser.add_argument("input", help="Path to JSONL input file to rerank")
+    parser.add_argument(
+        "-m",
+        "--top-m",
+        type=int,
+        default=100,
+        help="Number of candidates kept by the first pass for the cross-encoder; 0 reranks them all (default: 100)",
+    )
+    parser.add_argument(
+        "-p",
+        "--prefilter",
+        choices=PREFILTERS,
+        default="bm25",
+        help="First pass: bm25 (search order fused with BM25), distance (search order) or tiny (small cross-encoder) (default: bm25)",
+    )
+    parser.add_argument(
+        "--eval",
+        action="store_true",
+        help="Also rerank all the candidates with the cross-encoder, to report the recall@-k of the cascade",
+    )
+    parser.add_argument("-k", type=int, default=50, help="Cut-off of the recall of --eval (default: 50)")
     args = parser.parse_args(argv)
 
     in_path = Path(args.input)
@@ -113,7 +263,10 @@ def main(argv: List[str] | None = None) -> int:
 
     try:
         items = read_jsonl(in_path)
-        ranked = rerank(args.question, items)
+        if args.eval:
+            print(json.dumps(evaluate_cascade(args.question, items, args.top_m, args.prefilter, args.k)), file=sys.stderr)
+        ranked, timings = cascade_rerank(args.question, items, top_m=args.top_m, method=args.prefilter)
+        print(json.dumps({"candidates": len(items), "top_m": args.top_m, "latency_ms": timings}), file=sys.stderr)
         out_path = Path(f"{str(in_path)}.reranked.jq")
         write_jsonl(out_path, ranked)
         print(str(out_path))
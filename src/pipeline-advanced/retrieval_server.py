@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Long-running retrieval service for scripts/request.sh, keeping warm what each question otherwise
+reloads in fresh processes: the embedding model (search_chunks.py), the cross-encoder (rerank.py),
+the tokenizer (count_tokens.py) and a Weaviate connection.
+
+Endpoints:
+- POST /retrieve, JSON body:
+    { "question": "...", "rerank": false, "limit": 50, "candidates": 500,
+      "collection": "rag_chunks", "openai": false,
+      "hybrid": false, "alpha": 0.7, "fusion": "relative-score",
+      "variants": [], "expand": false, "top_m": 100, "prefilter": "bm25" }
+  Runs the steps of request.sh: vector (or hybrid, see search_chunks.py) search of limit chunks,
+  fused with the searches of the variants and, with expand (true, or a list of kinds), of
+  variants generated by the local LLM (query_variants.py) if any, or of candidates chunks reranked
+  by the cascade of rerank.py (the top_m chunks of the prefilter pass scored by the cross-encoder;
+  0 scores them all) and cut to limit; then the deepest heading is prefixed to each text
+  (process_chunks_add_title.py). Answers the chunks as NDJSON, in the format of the
+  <chunks>.embeddings.ndjson file request.sh passes to merge_chunks.sh, with a Server-Timing
+  header giving the duration of each step.
+- POST /count_tokens: the raw text as body, answers its number of tokens (count_tokens.py,
+  special tokens included).
+- GET /health: answers "ok".
+
+Requests are served by concurrent threads, sharing the models of model_registry.py (each behind
+its own lock: the tokenizers of the models are not thread-safe) and the Weaviate connections of
+weaviate_pool.py (checked, and replaced when a search fails on them); all are loaded at startup.
+
+Usage:
+  ./src/pipeline-advanced/retrieval_server.py --port 8124 &
+  curl -s -d '{"question": "contrat de maintenance", "rerank": true}' http://127.0.0.1:8124/retrieve
+
+Prints one line per request on stderr: status, path, duration.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import search_chunks
+from count_tokens import count_tokens
+from embedding_models import BACKENDS
+from process_chunks_add_title import add_title
+from query_variants import KINDS, generate_variants
+from rerank import PREFILTERS, cascade_rerank, rerank
+from weaviate_pool import shared_pool
+
+
+class _Resources:
+    """
+    Models and Weaviate connections shared by the request threads: those of model_registry.py and
+    weaviate_pool.py, loaded at startup rather than by the first question.
+    """
+
+    def __init__(self, backend: Optional[str], tokenizer_name: str) -> None:
+        self.backend = backend
+        self.tokenizer_name = tokenizer_name
+        search_chunks._compute_query_embedding("warm-up", backend=backend)
+        rerank("warm-up", [{"text": "warm-up"}])
+        try:
+            count_tokens("warm-up", model_name=tokenizer_name)
+            self.tokenizer_loaded = True
+        except Exception as exc:
+            # /count_tokens answers 503; merge_chunks.sh then runs count_tokens.py
+            print(f"Warning: tokenizer not loaded: {exc}", file=sys.stderr)
+            self.tokenizer_loaded = False
+        shared_pool().run(lambda client: client.is_ready())
+
+    def search(self, queries: List[str], limit: int, opts: Dict[str, Any]) -> List[Dict[str, Any]]:
+        search_args = dict(
+            limit=limit,
+            collection_name=opts["collection"],
+            use_openai=opts["openai"],
+            backend=self.backend,
+            hybrid=opts["hybrid"],
+            alpha=opts["alpha"],
+            fusion=opts["fusion"],
+        )
+        if len(queries) > 1:
+            return search_chunks.multi_search(queries, **search_args)
+        return search_chunks.search_weaviate(queries[0], **search_args)
+
+    def rerank(
+        self, question: str, items: List[Dict[str, Any]], top_m: int, method: str
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+        return cascade_rerank(question, items, top_m=top_m, method=method)
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text, model_name=self.tokenizer_name)
+
+    def close(self) -> None:
+        shared_pool().close()
+
+
+def parse_request(body: bytes) -> Dict[str, Any]:
+    """
+    Options of a /retrieve body, with their defaults; raises ValueError if it is invalid.
+    """
+    req = json.loads(body or b"{}")
+    if not isinstance(req, dict):
+        raise ValueError("expected a JSON object")
+    question = req.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("'question' must be a non-empty string")
+    try:
+        limit = int(req.get("limit") or 50)
+        candidates = int(req.get("candidates") or 500)
+        top_m = int(req.get("top_m", 100))
+    except (TypeError, ValueError):
+        raise ValueError("'limit', 'candidates' and 'top_m' must be integers")
+    if limit < 1 or candidates < 1 or top_m < 0:
+        raise ValueError("'limit' and 'candidates' must be positive, 'top_m' not negative")
+    prefilter = req.get("prefilter") or "bm25"
+    if prefilter not in PREFILTERS:
+        raise ValueError(f"'prefilter' must be one of: {', '.join(PREFILTERS)}")
+    try:
+        alpha = float(req.get("alpha", 0.7))
+    except (TypeError, ValueError):
+        raise ValueError("'alpha' must be a number")
+    if not 0.0 <= alpha <= 1.0:
+        raise ValueError("'alpha' must be between 0 and 1")
+    fusion = req.get("fusion") or "relative-score"
+    if fusion not in search_chunks.FUSIONS:
+        raise ValueError(f"'fusion' must be one of: {', '.join(search_chunks.FUSIONS)}")
+    variants = req.get("variants") or []
+    if not isinstance(variants, list) or not all(isinstance(v, str) for v in variants):
+        raise ValueError("'variants' must be a list of strings")
+    expand = req.get("expand") or []
+    if expand is True:
+        expand = list(KINDS)
+    if not isinstance(expand, list) or any(kind not in KINDS for kind in expand):
+        raise ValueError(f"'expand' must be true or a list of: {', '.join(KINDS)}")
+    return {
+        "question": question,
+        "rerank": bool(req.get("rerank")),
+        "limit": limit,
+        "candidates": candidates,
+        "collection": req.get("collection") or "rag_chunks",
+        "openai": bool(req.get("openai")),
+        "hybrid": bool(req.get("hybrid")),
+        "alpha": alpha,
+        "fusion": fusion,
+        "variants": variants,
+        "expand": expand,
+        "top_m": top_m,
+        "prefilter": prefilter,
+    }
+
+
+def retrieve(resources: _Resources, opts: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Chunks answering the options of parse_request(), and the duration of each step in milliseconds.
+    """
+    question = opts["question"]
+    limit = opts["limit"]
+    timings: Dict[str, float] = {}
+
+    queries = [question] + opts["variants"]
+    if opts["expand"]:
+        start = time.perf_counter()
+        queries += [v["text"] for v in generate_variants(question, opts["expand"])]
+        timings["variants"] = (time.perf_counter() - start) * 1000.0
+    start = time.perf_counter()
+    # Reranked against the question itself
+    chunks = resources.search(queries, opts["candidates"] if opts["rerank"] else limit, opts)
+    timings["search"] = (time.perf_counter() - start) * 1000.0
+    if opts["rerank"]:
+        chunks, rerank_timings = resources.rerank(question, chunks, opts["top_m"], opts["prefilter"])
+        chunks = chunks[:limit]
+        timings.update(rerank_timings)
+    # As written to JSONL by search_chunks.py and read back by process_chunks_add_title.py
+    chunks = [add_title(json.loads(json.dumps(c, ensure_ascii=False, default=str))) for c in chunks]
+    return chunks, timings
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "awsgpu-retrieval/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _text(self, status: int, text: str) -> None:
+        self._reply(status, (text + "\n").encode("utf-8"), "text/plain; charset=utf-8")
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/health":
+            self._text(200, "ok")
+        else:
+            self._text(404, f"Unknown path {self.path}")
+
+    def do_POST(self) -> None:
+        resources: _Resources = self.server.resources
+        start = time.perf_counter()
+        status = 200
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = self.path.rstrip("/")
+        try:
+            if path == "/retrieve":
+                try:
+                    opts = parse_request(body)
+                except ValueError as exc:
+                    status = 400
+                    self._text(status, f"Error: {exc}")
+                    return
+                chunks, timings = retrieve(resources, opts)
+                payload = "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in chunks).encode("utf-8")
+                server_timing = ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+                self._reply(status, payload, "application/x-ndjson; charset=utf-8", {"Server-Timing": server_timing})
+            elif path == "/count_tokens":
+                if not resources.tokenizer_loaded:
+                    status = 503
+                    self._text(status, "Error: tokenizer not loaded")
+                    return
+                self._text(status, str(resources.count_tokens(body.decode("utf-8"))))
+            else:
+                status = 404
+                self._text(status, f"Unknown path {self.path}")
+        except Exception as exc:
+            status = 500
+            self._text(status, f"Error: {exc}")
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            print(f"{status} {path} {elapsed:.0f}ms", file=sys.stderr, flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Long-running retrieval service for request.sh (warm models and Weaviate connection).")
+    parser.add_argument("--host", default="127.0.0.1", help="Listen address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8124, help="Listen port (default: 8124)")
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Inference backend of the local model, see embedding_models.py (default: $EMB_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default="openai/gpt-oss-20b",
+        help="Hugging Face model ID of the tokenizer of /count_tokens (default: openai/gpt-oss-20b)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        resources = _Resources(args.backend, args.tokenizer)
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.daemon_threads = True
+    server.resources = resources
+    print(f"Listening on http://{args.host}:{server.server_port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        resources.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
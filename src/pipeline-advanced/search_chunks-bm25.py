@@ -2,7 +2,7 @@
 """
 Search nearest chunks in Weaviate using BM25 (keyword) search.
 
-- Connects to a local Weaviate instance (gRPC + REST).
+- Connects to a local Weaviate instance (gRPC + REST), through the shared pool of weaviate_pool.py.
 - Uses Weaviate's BM25 keyword search over the 'text' property (inverted index).
 - No embeddings are used.
 - Prints results to stdout, one JSON object per line.
@@ -21,11 +21,10 @@ import argparse
 import json
 import sys
 from typing import Any, Dict, List
-import os
 
+from weaviate_pool import shared_pool
 
 try:
-    import weaviate
     from weaviate.classes.query import MetadataQuery
     from weaviate.collections.classes.grpc import QueryNested
 except Exception as exc:
@@ -33,23 +32,13 @@ except Exception as exc:
     raise
 
 
+def search_weaviate(query: str, limit: int = 50, collection_name: str = "rag_chunks", client=None) -> List[Dict[str, Any]]:
+    """
+    Best BM25 chunks of the query, searched on client if given (left open), else on a connection
+    of the shared pool (weaviate_pool.py).
+    """
 
-
-def _connect_local():
-    # Connect to a local Weaviate (default URL/env). Adjust here if needed.
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
-    else:
-        # Pas d'URL fournie, on utilise la connexion locale par défaut
-        return weaviate.connect_to_local()
-
-    
-
-
-def search_weaviate(query: str, limit: int = 50, collection_name: str = "rag_chunks") -> List[Dict[str, Any]]:
-    client = _connect_local()
-    try:
+    def search(client) -> List[Dict[str, Any]]:
         coll = client.collections.get(collection_name)
 
         results = coll.query.bm25(
@@ -86,8 +75,10 @@ def search_weaviate(query: str, limit: int = 50, collection_name: str = "rag_chu
                 }
             )
         return out
-    finally:
-        client.close()
+
+    if client is not None:
+        return search(client)
+    return shared_pool().run(search)
 
 
 def main(argv: List[str] | None = None) -> int:
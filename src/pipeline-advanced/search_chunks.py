@@ -4,17 +4,41 @@ Search nearest chunks in Weaviate using a text query.
 
 - Connects to a local Weaviate instance (gRPC + REST).
 - Embeds the input text query with sentence-transformers ('paraphrase-xlm-r-multilingual-v1') by default.
+- With --backend onnx / onnx-int8 (or $EMB_BACKEND), the local model runs on ONNX Runtime (see embedding_models.py);
+  use the backend the documents were embedded with.
 - If --openai is provided, uses OpenAI 'text-embedding-3-large' (requires env OPENAIAPIKEY).
+- Query embeddings go through the shared embedding cache (embedding_cache.py): a repeated query
+  neither loads the model nor calls the API. The cache is opened (its keys indexed) once per
+  process and model, see model_registry.py.
 - Runs a vector search against the stored embeddings (vectorizer = none).
+- With --hybrid, runs a hybrid search instead: the vector search fused with a BM25 keyword search
+  over the text (as search_chunks-bm25.py), --alpha weighing the vector side (1: vector only,
+  0: BM25 only). --fusion chooses how the two rankings are fused:
+  - relative-score (default) or ranked: by Weaviate, in one query (query.hybrid), from the scores
+    normalized to [0, 1] or from the ranks;
+  - rrf: locally, by reciprocal rank fusion of both searches (weights alpha and 1 - alpha), see
+    reciprocal_rank_fusion(), also used to fuse the results of several queries.
+  Results then carry a "score" (higher is better) instead of a distance.
+- Multi-query retrieval: with --variant (given variants of the query) and/or --expand (variants
+  generated by the local LLM: rewrites, keywords, typical answer, see query_variants.py), the
+  query and its variants are embedded in one batch and searched concurrently, and the rankings
+  fused by reciprocal rank fusion, one result per chunk_id (see multi_search()): the searches
+  take about the time of one, the generation of the variants comes on top of it.
+- The model (or OpenAI client) and the Weaviate connection are kept for the life of the process
+  (model_registry.py, weaviate_pool.py), for long-running callers of search_weaviate().
 - Prints results to stdout, one JSON object per line.
 
 Usage:
   ./src/pipeline-advanced/search_chunks.py "your query text"
   ./src/pipeline-advanced/search_chunks.py -k 25 -c rag_chunks "contrat de maintenance"
   ./src/pipeline-advanced/search_chunks.py --openai "votre question"
+  ./src/pipeline-advanced/search_chunks.py --hybrid --alpha 0.5 --fusion ranked "contrat de maintenance"
+  ./src/pipeline-advanced/search_chunks.py -k 500 --expand "Quels sont les composants de la forge ?"
+  ./src/pipeline-advanced/search_chunks.py -V "forge logicielle Jenkins" "Quels sont les composants de la forge ?"
 
 Each result line includes:
   { chunk_id, text, distance, approx_tokens, keywords, headings, heading, full_headings, created_at }
+and, with --hybrid, --variant or --expand, score.
 """
 
 from __future__ import annotations
@@ -22,16 +46,20 @@ from __future__ import annotations
 import argparse
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 import os
 
 import numpy as np
-import sentence_transformers
-from sentence_transformers import SentenceTransformer
+
+import model_registry
+from embedding_cache import EmbeddingCache
+from embedding_models import BACKENDS, backend_version, default_backend, load_model
+from query_variants import KINDS, generate_variants, parse_kinds
+from weaviate_pool import shared_pool
 
 try:
-    import weaviate
-    from weaviate.classes.query import MetadataQuery
+    from weaviate.classes.query import HybridFusion, MetadataQuery
     from weaviate.collections.classes.grpc import QueryNested
 except Exception as exc:
     print("Error: weaviate-client is required. Install with: pip install weaviate-client", file=sys.stderr)
@@ -41,84 +69,247 @@ except Exception as exc:
 _MODEL_NAME = "paraphrase-xlm-r-multilingual-v1"
 #_MODEL_NAME = "all-mpnet-base-v2"
 
+FUSIONS = ["relative-score", "ranked", "rrf"]
+# Constant of reciprocal rank fusion, as in Cormack et al. (2009)
+RRF_K = 60
+
+
+def _embed_query(text: str, use_openai: bool = False, backend: str | None = None) -> List[float]:
+    return _embed_queries([text], use_openai=use_openai, backend=backend)[0]
+
+
+def _embed_queries(texts: List[str], use_openai: bool = False, backend: str | None = None) -> List[List[float]]:
+    if use_openai:
+        try:
+            import openai
 
-def _connect_local():
-    # Connect to a local Weaviate (default URL/env). Adjust here if needed.
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
+            openai_version = getattr(openai, "__version__", "unknown")
+        except Exception:
+            # Reported by _compute_query_embeddings()
+            openai_version = "unknown"
+        model_name, model_version = "text-embedding-3-large", openai_version
     else:
-        # Pas d'URL fournie, on utilise la connexion locale par défaut
-        return weaviate.connect_to_local()
+        model_name, model_version = _MODEL_NAME, backend_version(backend)
+    # Opening the cache maps the indexes of all its segments: done once per process
+    cache_id = ("embedding-cache", model_name, model_version)
+    open_cache = lambda: EmbeddingCache(model_name, model_version)
+    with model_registry.using(cache_id, open_cache) as cache:
+        keys = [cache.key(text) for text in texts]
+        missing = {key: text for key, text, vec in zip(keys, texts, cache.get_many(keys)) if vec is None}
+    if missing:
+        # The queries not in the cache are embedded in one batch, without holding the cache
+        vectors = _compute_query_embeddings(list(missing.values()), use_openai=use_openai, backend=backend)
+        with model_registry.using(cache_id, open_cache) as cache:
+            cache.put_many(list(zip(missing.keys(), vectors)))
+    with model_registry.using(cache_id, open_cache) as cache:
+        # float32 as stored, so that a query gets the same vector whether it was cached or not
+        found = [vec.tolist() for vec in cache.get_many(keys)]
+        # Records the segments that served hits (LRU eviction); the cache stays open
+        cache.close()
+    return found
+
+
+def _openai_client(api_key: str):
+    try:
+        from openai import OpenAI
+    except Exception:
+        print("Error: openai package is required for --openai. Install with: pip install openai", file=sys.stderr)
+        raise
+    return OpenAI(api_key=api_key)
+
+
+def _compute_query_embedding(text: str, use_openai: bool = False, backend: str | None = None) -> List[float]:
+    return _compute_query_embeddings([text], use_openai=use_openai, backend=backend)[0]
+
 
-    
-def _embed_query(text: str, use_openai: bool = False) -> List[float]:
+def _compute_query_embeddings(texts: List[str], use_openai: bool = False, backend: str | None = None) -> List[List[float]]:
+    # Models and clients are loaded once per process, see model_registry.py
     if use_openai:
         api_key = os.environ.get("OPENAIAPIKEY")
         if not api_key:
             raise RuntimeError("OPENAIAPIKEY environment variable is not set.")
-        try:
-            from openai import OpenAI
-        except Exception:
-            print("Error: openai package is required for --openai. Install with: pip install openai", file=sys.stderr)
-            raise
-        client = OpenAI(api_key=api_key)
-        resp = client.embeddings.create(model="text-embedding-3-large", input=text)
-        return [float(x) for x in resp.data[0].embedding]
-    model = SentenceTransformer(_MODEL_NAME)
-    vec = model.encode([text], convert_to_numpy=True, show_progress_bar=False)
-    if isinstance(vec, list):
-        emb = [float(x) for x in vec[0]]
-    elif isinstance(vec, np.ndarray):
-        emb = vec[0].astype(float).tolist()
-    else:
-        emb = [float(x) for x in np.array(vec)[0].astype(float).tolist()]
-    return emb
+        # The OpenAI client is thread-safe: no lock
+        client = model_registry.get(("openai", api_key), lambda: _openai_client(api_key))
+        resp = client.embeddings.create(model="text-embedding-3-large", input=texts)
+        return [[float(x) for x in item.embedding] for item in sorted(resp.data, key=lambda item: item.index)]
+    backend = backend or default_backend()
+    with model_registry.using(("sentence-transformers", _MODEL_NAME, backend), lambda: load_model(_MODEL_NAME, backend)) as model:
+        vec = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(vec, dtype=float).tolist()
 
 
-def search_weaviate(query: str, limit: int = 50, collection_name: str = "rag_chunks", use_openai: bool = False) -> List[Dict[str, Any]]:
-    vector = _embed_query(query, use_openai=use_openai)
+_RETURN_PROPERTIES = [
+    "chunk_id",
+    "text",
+    "approx_tokens",
+    "keywords",
+    "created_at",
+    QueryNested(name="headings", properties=["h1", "h2", "h3", "h4", "h5", "h6"]),
+    QueryNested(name="heading", properties=["h1", "h2", "h3", "h4", "h5", "h6"]),
+    "full_headings",
+]
 
-    client = _connect_local()
-    try:
+
+def _record(obj, score: bool = False) -> Dict[str, Any]:
+    props = obj.properties or {}
+    rec = {
+        "chunk_id": props.get("chunk_id"),
+        "text": props.get("text"),
+        "distance": getattr(obj.metadata, "distance", None),
+        "approx_tokens": props.get("approx_tokens"),
+        "keywords": props.get("keywords"),
+        "headings": props.get("headings"),
+        "heading": props.get("heading"),
+        "full_headings": props.get("full_headings"),
+        "created_at": props.get("created_at"),
+    }
+    if score:
+        rec["score"] = getattr(obj.metadata, "score", None)
+    return rec
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Dict[str, Any]]],
+    limit: int | None = None,
+    weights: List[float] | None = None,
+    k: int = RRF_K,
+) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked result lists: each chunk scores the sum over the lists of weight / (k + rank),
+    rank starting at 1, and appears once (by chunk_id), with the fields of its first occurrence
+    completed by the later ones (e.g. the distance of a vector result). Sets "score".
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    fused: Dict[str, Dict[str, Any]] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, rec in enumerate(ranking, start=1):
+            chunk_id = rec.get("chunk_id")
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (k + rank)
+            if chunk_id not in fused:
+                fused[chunk_id] = dict(rec)
+            else:
+                for name, value in rec.items():
+                    if fused[chunk_id].get(name) is None:
+                        fused[chunk_id][name] = value
+    out = sorted(fused.values(), key=lambda rec: scores[rec.get("chunk_id")], reverse=True)
+    for rec in out:
+        rec["score"] = scores[rec.get("chunk_id")]
+    return out[:limit] if limit is not None else out
+
+
+def search_weaviate(
+    query: str,
+    limit: int = 50,
+    collection_name: str = "rag_chunks",
+    use_openai: bool = False,
+    backend: str | None = None,
+    client=None,
+    hybrid: bool = False,
+    alpha: float = 0.7,
+    fusion: str = "relative-score",
+    vector: List[float] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Nearest chunks of the query, searched on client if given (left open), else on a connection
+    of the shared pool (weaviate_pool.py). vector is the embedding of the query, if already computed.
+    With hybrid, the vector search is fused with a BM25 search over "text": alpha weighs the
+    vector side (1: vector only, 0: BM25 only), fusion is one of FUSIONS (see the module doc).
+    """
+    if fusion not in FUSIONS:
+        raise ValueError(f"Unknown fusion {fusion!r}, expected one of: {', '.join(FUSIONS)}")
+    if vector is None:
+        vector = _embed_query(query, use_openai=use_openai, backend=backend)
+
+    def search(client) -> List[Dict[str, Any]]:
         coll = client.collections.get(collection_name)
 
-        results = coll.query.near_vector(
+        if not hybrid:
+            results = coll.query.near_vector(
+                near_vector=vector,
+                limit=limit,
+                target_vector="text",
+                return_properties=_RETURN_PROPERTIES,
+                return_metadata=MetadataQuery(distance=True),
+            )
+            return [_record(obj) for obj in results.objects or []]
+
+        if fusion != "rrf":
+            # One query, fused by Weaviate
+            results = coll.query.hybrid(
+                query=query,
+                vector=vector,
+                target_vector="text",
+                query_properties=["text"],
+                alpha=alpha,
+                fusion_type=HybridFusion.RANKED if fusion == "ranked" else HybridFusion.RELATIVE_SCORE,
+                limit=limit,
+                return_properties=_RETURN_PROPERTIES,
+                return_metadata=MetadataQuery(score=True),
+            )
+            return [_record(obj, score=True) for obj in results.objects or []]
+
+        # Local fusion of both searches, on the same connection
+        by_vector = coll.query.near_vector(
             near_vector=vector,
             limit=limit,
             target_vector="text",
-            return_properties=[
-                "chunk_id",
-                "text",
-                "approx_tokens",
-                "keywords",
-                "created_at",
-                QueryNested(name="headings", properties=["h1", "h2", "h3", "h4", "h5", "h6"]),
-                QueryNested(name="heading", properties=["h1", "h2", "h3", "h4", "h5", "h6"]),
-                "full_headings",
-            ],
+            return_properties=_RETURN_PROPERTIES,
             return_metadata=MetadataQuery(distance=True),
         )
+        by_keywords = coll.query.bm25(
+            query=query,
+            limit=limit,
+            query_properties=["text"],
+            return_properties=_RETURN_PROPERTIES,
+        )
+        return reciprocal_rank_fusion(
+            [[_record(obj) for obj in by_vector.objects or []], [_record(obj) for obj in by_keywords.objects or []]],
+            limit=limit,
+            weights=[alpha, 1.0 - alpha],
+        )
 
-        out: List[Dict[str, Any]] = []
-        for obj in results.objects or []:
-            props = obj.properties or {}
-            out.append(
-                {
-                    "chunk_id": props.get("chunk_id"),
-                    "text": props.get("text"),
-                    "distance": getattr(obj.metadata, "distance", None),
-                    "approx_tokens": props.get("approx_tokens"),
-                    "keywords": props.get("keywords"),
-                    "headings": props.get("headings"),
-                    "heading": props.get("heading"),
-                    "full_headings": props.get("full_headings"),
-                    "created_at": props.get("created_at"),
-                }
-            )
-        return out
-    finally:
-        client.close()
+    if client is not None:
+        return search(client)
+    return shared_pool().run(search)
+
+
+def multi_search(
+    queries: List[str],
+    limit: int = 50,
+    collection_name: str = "rag_chunks",
+    use_openai: bool = False,
+    backend: str | None = None,
+    hybrid: bool = False,
+    alpha: float = 0.7,
+    fusion: str = "relative-score",
+) -> List[Dict[str, Any]]:
+    """
+    Multi-query retrieval: the question and its variants (queries[0] being the question) are
+    embedded in one batch, searched concurrently (one connection of the shared pool each), each
+    for limit chunks, and their rankings fused by reciprocal rank fusion, one result per chunk_id.
+    """
+    queries = list(dict.fromkeys(q for q in queries if q and q.strip()))
+    if not queries:
+        raise ValueError("No query")
+    vectors = _embed_queries(queries, use_openai=use_openai, backend=backend)
+
+    def search(pair) -> List[Dict[str, Any]]:
+        query, vector = pair
+        return search_weaviate(
+            query,
+            limit=limit,
+            collection_name=collection_name,
+            hybrid=hybrid,
+            alpha=alpha,
+            fusion=fusion,
+            vector=vector,
+        )
+
+    # More threads than connections in the pool would only wait for one
+    with ThreadPoolExecutor(max_workers=min(len(queries), shared_pool().size)) as executor:
+        rankings = list(executor.map(search, zip(queries, vectors)))
+    return reciprocal_rank_fusion(rankings, limit=limit)
 
 
 def main(argv: List[str] | None = None) -> int:
@@ -142,10 +333,68 @@ def main(argv: List[str] | None = None) -> int:
         action="store_true",
         help="Use OpenAI embeddings (text-embedding-3-large) for the query; requires env OPENAIAPIKEY",
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Inference backend of the local model, see embedding_models.py (default: $EMB_BACKEND or torch)",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="Hybrid search: vector search fused with a BM25 keyword search over the text",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.7,
+        help="Weight of the vector search in --hybrid, from 0 (BM25 only) to 1 (vector only) (default: 0.7)",
+    )
+    parser.add_argument(
+        "--fusion",
+        choices=FUSIONS,
+        default="relative-score",
+        help="Fusion of --hybrid: relative-score or ranked (by Weaviate), or rrf (local) (default: relative-score)",
+    )
+    parser.add_argument(
+        "-V",
+        "--variant",
+        action="append",
+        default=[],
+        help="Query variant searched along with the query, results fused by RRF (repeatable)",
+    )
+    parser.add_argument(
+        "--expand",
+        action="store_true",
+        help="Search also variants of the query generated by the local LLM, see query_variants.py",
+    )
+    parser.add_argument(
+        "--expand-kinds",
+        default=",".join(KINDS),
+        help=f"Comma-separated kinds of the variants of --expand (default: {','.join(KINDS)})",
+    )
     args = parser.parse_args(argv)
+    if not 0.0 <= args.alpha <= 1.0:
+        parser.error("--alpha must be between 0 and 1")
 
     try:
-        results = search_weaviate(args.query, limit=args.limit, collection_name=args.collection_name, use_openai=args.openai)
+        variants = list(args.variant)
+        if args.expand:
+            variants += [v["text"] for v in generate_variants(args.query, parse_kinds(args.expand_kinds))]
+        search_args = dict(
+            limit=args.limit,
+            collection_name=args.collection_name,
+            use_openai=args.openai,
+            backend=args.backend,
+            hybrid=args.hybrid,
+            alpha=args.alpha,
+            fusion=args.fusion,
+        )
+        if variants:
+            results = multi_search([args.query] + variants, **search_args)
+        else:
+            results = search_weaviate(args.query, **search_args)
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
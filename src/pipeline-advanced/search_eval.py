@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Compare the retrieval quality of the search modes of search_chunks.py: the vector search used by
+request.sh, against hybrid searches (vector + BM25) for several fusions and alphas.
+
+- Questions and their relevant chunks come from a JSONL file (--qrels), one line per question:
+    { "question": "...", "relevant": ["CCTP.docx.html.md.converted-6", ...] }
+- Without --qrels, --synthetic N picks N chunks of the collection at random and uses the
+  keywords of each (create_chunks.py) as the question, the chunk itself being the only relevant
+  one. Such questions share their words with the chunk, which favours BM25: use real questions
+  to choose alpha.
+- For each configuration (vector, then hybrid for each --fusions and --alphas), every question is
+  searched once, for the largest --k; the query embeddings are computed (or read from the
+  embedding cache) once, beforehand, and passed to every search, so that the latencies are those
+  of the searches.
+
+Metrics, averaged over the questions:
+- recall@k: share of the relevant chunks among the first k results;
+- mrr: inverse of the rank of the first relevant result (0 if none);
+- latency_ms: mean and p95 of the search (embedding cached).
+
+Usage:
+  ./src/pipeline-advanced/search_eval.py --qrels questions.jsonl
+  ./src/pipeline-advanced/search_eval.py --synthetic 200 --alphas 0.5,0.7 --fusions relative-score,rrf
+
+Prints one JSON line per configuration.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import search_chunks
+from embedding_models import BACKENDS
+from weaviate_pool import shared_pool
+
+
+def load_qrels(path: str) -> List[Tuple[str, List[str]]]:
+    qrels: List[Tuple[str, List[str]]] = []
+    with Path(path).open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            relevant = item.get("relevant") or []
+            if isinstance(relevant, str):
+                relevant = [relevant]
+            if item.get("question") and relevant:
+                qrels.append((item["question"], list(relevant)))
+    if not qrels:
+        raise ValueError(f"No question with relevant chunks in {path}")
+    return qrels
+
+
+def synthetic_qrels(collection_name: str, n: int, seed: int = 0) -> List[Tuple[str, List[str]]]:
+    def read(client) -> List[Tuple[str, List[str]]]:
+        coll = client.collections.get(collection_name)
+        found: List[Tuple[str, List[str]]] = []
+        for obj in coll.iterator(return_properties=["chunk_id", "keywords"]):
+            keywords = obj.properties.get("keywords") or []
+            if obj.properties.get("chunk_id") and keywords:
+                found.append((" ".join(keywords), [obj.properties["chunk_id"]]))
+        return found
+
+    candidates = shared_pool().run(read)
+    if not candidates:
+        raise ValueError("No chunk with keywords in the collection")
+    return random.Random(seed).sample(candidates, min(n, len(candidates)))
+
+
+def evaluate(
+    qrels: List[Tuple[str, List[str]]],
+    vectors: List[List[float]],
+    ks: List[int],
+    collection_name: str = "rag_chunks",
+    backend: Optional[str] = None,
+    hybrid: bool = False,
+    alpha: float = 0.7,
+    fusion: str = "relative-score",
+) -> Dict[str, Any]:
+    recalls: Dict[int, List[float]] = {k: [] for k in ks}
+    reciprocal_ranks: List[float] = []
+    latencies: List[float] = []
+    for (question, relevant), vector in zip(qrels, vectors):
+        start = time.perf_counter()
+        results = search_chunks.search_weaviate(
+            question,
+            limit=max(ks),
+            collection_name=collection_name,
+            backend=backend,
+            hybrid=hybrid,
+            alpha=alpha,
+            fusion=fusion,
+            vector=vector,
+        )
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        ranked = [rec.get("chunk_id") for rec in results]
+        for k in ks:
+            recalls[k].append(len(set(ranked[:k]) & set(relevant)) / len(relevant))
+        first = next((rank for rank, chunk_id in enumerate(ranked, start=1) if chunk_id in relevant), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+
+    report: Dict[str, Any] = {"mode": "hybrid" if hybrid else "vector"}
+    if hybrid:
+        report.update({"fusion": fusion, "alpha": alpha})
+    report.update({f"recall_at_{k}": float(np.mean(recalls[k])) for k in ks})
+    report["mrr"] = float(np.mean(reciprocal_ranks))
+    report["latency_ms"] = {"mean": float(np.mean(latencies)), "p95": float(np.percentile(latencies, 95))}
+    return report
+
+
+def _floats(value: str) -> List[float]:
+    return [float(x) for x in value.split(",") if x.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare recall and MRR of vector and hybrid searches of search_chunks.py.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--qrels", help="JSONL file of questions and relevant chunk_ids")
+    source.add_argument("--synthetic", type=int, help="Number of chunks whose keywords are used as questions")
+    parser.add_argument(
+        "-c",
+        "--collection-name",
+        default="rag_chunks",
+        help='Weaviate collection name (default: "rag_chunks")',
+    )
+    parser.add_argument("-k", default="10,50", help="Comma-separated cut-offs of recall@k (default: 10,50)")
+    parser.add_argument("--alphas", default="0.25,0.5,0.7,0.9", help="Comma-separated alphas of the hybrid searches (default: 0.25,0.5,0.7,0.9)")
+    parser.add_argument(
+        "--fusions",
+        default=",".join(search_chunks.FUSIONS),
+        help=f"Comma-separated fusions of the hybrid searches (default: {','.join(search_chunks.FUSIONS)})",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=BACKENDS,
+        default=None,
+        help="Inference backend of the local model, see embedding_models.py (default: $EMB_BACKEND or torch)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the choice of the --synthetic chunks (default: 0)")
+    args = parser.parse_args(argv)
+
+    try:
+        ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+        alphas = _floats(args.alphas)
+        fusions = [f.strip() for f in args.fusions.split(",") if f.strip()]
+        unknown = [f for f in fusions if f not in search_chunks.FUSIONS]
+        if unknown or not ks or min(ks) < 1 or any(not 0.0 <= a <= 1.0 for a in alphas):
+            raise ValueError("invalid -k, --alphas or --fusions")
+        if args.qrels:
+            qrels = load_qrels(args.qrels)
+        else:
+            qrels = synthetic_qrels(args.collection_name, args.synthetic, seed=args.seed)
+        # Embeddings first, in one batch, passed to the searches of every configuration
+        vectors = search_chunks._embed_queries([question for question, _ in qrels], backend=args.backend)
+
+        configs: List[Dict[str, Any]] = [{"hybrid": False}]
+        configs += [{"hybrid": True, "fusion": f, "alpha": a} for f in fusions for a in alphas]
+        for config in configs:
+            report = evaluate(qrels, vectors, ks, collection_name=args.collection_name, backend=args.backend, **config)
+            report["questions"] = len(qrels)
+            print(json.dumps(report, ensure_ascii=False), flush=True)
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
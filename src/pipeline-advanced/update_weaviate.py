@@ -3,11 +3,34 @@
 Upload precomputed embeddings into a local Weaviate instance.
 
 - Input: NDJSON file of embeddings (one JSON object per line), with fields:
-  { chunk_id, text, embedding: [floats], model: {name, version}, created_at, approx_tokens, keywords, headings, heading, full_headings }
+  { chunk_id, text, embedding_row, approx_tokens, keywords, headings, heading, full_headings, content_hash }
+  The vectors are read from the .npy file next to it (<input without .ndjson>.npy, float32 or float16,
+  memory-mapped), at row embedding_row, and the model and created_at of all the lines from the
+  .meta.json file next to it. Lines carrying an inline "embedding": [floats], "model" or "created_at"
+  (former format) are still accepted.
 
 - Behavior:
-  - Creates a Weaviate collection with a schema that does NOT perform vectorization (vectorizer = none), and enables named multi-vectors: "text" plus "h1".."h6".
-  - Inserts each line as an object with the main text embedding under "text".
+  - The collection must exist (see init_or_reset_collection.py): its schema does NOT perform
+    vectorization (vectorizer = none), and the main text embedding goes to the named vector "text".
+  - Each object gets a deterministic uuid, derived from its document (the chunk_id without its
+    sequence number), its content_hash and the rank of that hash in the document (see object_uuid()),
+    so that an object keeps its uuid when an edit elsewhere in the document renumbers the chunks.
+  - Upsert: the objects of the document (by source_file) already in the collection are listed first
+    (uuid, chunk_id and sync_digest only). Each object gets a sync_digest property, a digest of all
+    its properties (model name and version included, created_at excluded, see object_digest()).
+    Objects present with the same chunk_id and sync_digest are skipped; the others (new or changed
+    content, renumbered, embedded with another model or backend, or with other keywords or
+    approx_tokens) are sent; objects of the document that are no longer in the input are deleted,
+    once the new ones are stored. Re-uploading an edited document thus only sends its delta, and re-uploading the same
+    file sends nothing. --full sends every object anyway.
+  - Objects are sent with the batch import of the client: dynamic batch sizes by default, or
+    --batch-size objects per request with --concurrent-requests requests in flight. Objects
+    rejected by Weaviate are collected and sent again (same uuid, so never duplicated), up to
+    --max-retries times.
+  - Each object also gets a source_file property (its document), so that weaviate_infos.py counts
+    the chunks per file with an aggregate query; the cache of these counts is cleared after the upload.
+  - Reports the number of inserted (among which renumbered), unchanged and deleted objects, and the
+    upload rate (objects per second).
 
 Notes:
 - Requires: weaviate-client (v4)
@@ -17,28 +40,33 @@ Notes:
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import sys
+import time
+import uuid
+from collections import Counter
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 try:
-    import weaviate
-    from weaviate.classes.config import Configure, Property, DataType
+    from weaviate.classes.query import Filter, Sort
 except Exception as exc:
     print("Error: weaviate-client is required. Install with: pip install weaviate-client", file=sys.stderr)
     raise
 
+from create_chunks import content_hash
+from weaviate_infos import invalidate_cache
+from weaviate_pool import connect_local
+
+
+# Namespace of the object uuids (uuid5); changing it would give every stored object a new identity
+_UUID_NAMESPACE = uuid.UUID("5f1c3a1e-8b0e-4c4e-9a53-3d0f6c2b7a10")
+_FETCH_PAGE = 1000
+
 
-def _connect_local():
-    # Connect to a local Weaviate (default URL/env). Adjust here if needed.
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
-    else:
-        # Pas d'URL fournie, on utilise la connexion locale par défaut
-        return weaviate.connect_to_local()
 
 
 def _to_float_list(vec: Any) -> Optional[List[float]]:
@@ -50,76 +78,295 @@ def _to_float_list(vec: Any) -> Optional[List[float]]:
         return None
 
 
-def upload_embeddings_to_weaviate(input_path: str, collection_name: str = "rag_chunks", recreate: bool = True) -> int:
+def _open_vectors(input_path: str) -> Optional[np.ndarray]:
+    vectors_path = Path(input_path).with_suffix(".npy")
+    if not vectors_path.exists():
+        return None
+    return np.load(vectors_path, mmap_mode="r")
+
+
+def _read_metadata(input_path: str) -> Dict[str, Any]:
+    meta_path = Path(input_path).with_suffix(".meta.json")
+    if not meta_path.exists():
+        return {}
+    with meta_path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def upload_embeddings_to_weaviate(
+    input_path: str,
+    collection_name: str = "rag_chunks",
+    full: bool = False,
+    batch_size: int = 0,
+    concurrent_requests: int = 2,
+    max_retries: int = 3,
+) -> Dict[str, int]:
     """
-    Read an embeddings NDJSON file and upload objects with their vectors to Weaviate.
-    Returns the number of inserted objects.
+    Read an embeddings NDJSON file and upsert its objects, with their vectors, into Weaviate.
+    Returns the counts of sync_objects().
     """
     src = Path(input_path)
     if not src.exists():
         raise FileNotFoundError(f"Input file not found: {src}")
 
-    client = _connect_local()
+    vectors = _open_vectors(input_path)
+    meta = _read_metadata(input_path)
+    client = connect_local()
     try:
         coll = client.collections.get(collection_name)
-
-        inserted = 0
-        # Insert one by one using data.insert to support named vectors across client versions.
         with src.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    item: Dict[str, Any] = json.loads(line)
-                except json.JSONDecodeError:
-                    # Skip malformed lines
-                    continue
-
-                text_vec = _to_float_list(item.get("embedding"))
-                if not text_vec:
-                    # Skip if no main text vector
-                    continue
-
-                # Build named vectors payload: main "text" only.
-                vectors: Dict[str, List[float]] = {"text": text_vec}
-
-                # Collect properties; keep types simple as defined in schema above.
-                props: Dict[str, Any] = {
-                    "chunk_id": item.get("chunk_id"),
-                    "text": item.get("text"),
-                    "approx_tokens": item.get("approx_tokens"),
-                    "keywords": item.get("keywords") or [],
-                    "created_at": item.get("created_at"),
-                    "model": item.get("model") or {},
-                }
-                # Only include 'headings' if it's a non-empty object (Weaviate OBJECT cannot be empty)
-                headings_val = item.get("headings")
-                if isinstance(headings_val, dict):
-                    hv = {k: v for k, v in headings_val.items() if isinstance(v, str) and v}
-                    if hv:
-                        props["headings"] = hv
-
-                # Only include 'heading' if it's a non-empty object
-                heading_val = item.get("heading")
-                if isinstance(heading_val, dict):
-                    hv2 = {k: v for k, v in heading_val.items() if isinstance(v, str) and v}
-                    if hv2:
-                        props["heading"] = hv2
-
-                # Include 'full_headings' when present and non-empty
-                full_headings_val = item.get("full_headings")
-                if isinstance(full_headings_val, str) and full_headings_val:
-                    props["full_headings"] = full_headings_val
-
-                coll.data.insert(properties=props, vector=vectors)
-                inserted += 1
-
-        return inserted
+            return sync_objects(
+                coll,
+                _read_objects(f, vectors, meta),
+                full=full,
+                batch_size=batch_size,
+                concurrent_requests=concurrent_requests,
+                max_retries=max_retries,
+            )
     finally:
         client.close()
 
 
+def _read_objects(lines: Iterable[str], vectors: Optional[np.ndarray], meta: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item: Dict[str, Any] = json.loads(line)
+        except json.JSONDecodeError:
+            # Skip malformed lines
+            continue
+
+        row = item.get("embedding_row")
+        if vectors is not None and isinstance(row, int) and 0 <= row < len(vectors):
+            # float32 view of the memmap row: no per-float Python objects on our side
+            text_vec: Any = np.asarray(vectors[row], dtype=np.float32)
+        else:
+            text_vec = _to_float_list(item.get("embedding"))
+        if text_vec is None or not len(text_vec):
+            # Skip if no main text vector
+            continue
+        yield object_properties(item, meta), text_vec
+
+
+def object_properties(item: Dict[str, Any], meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Weaviate properties of an embeddings NDJSON record; meta holds the model and created_at
+    of the whole file (see _read_metadata()), used when the record has none.
+    """
+    # Collect properties; keep types simple as defined in schema above.
+    props: Dict[str, Any] = {
+        "chunk_id": item.get("chunk_id"),
+        # Counted per file by weaviate_infos.py
+        "source_file": document_of(item.get("chunk_id") or ""),
+        "text": item.get("text"),
+        "approx_tokens": item.get("approx_tokens"),
+        "keywords": item.get("keywords") or [],
+        "created_at": item.get("created_at", meta.get("created_at")),
+        "model": item.get("model") or meta.get("model") or {},
+        # Files written before content_hash existed: same hash as create_chunks.py would give
+        "content_hash": item.get("content_hash") or content_hash(item.get("headings") or {}, item.get("text") or ""),
+    }
+    # Only include 'headings' if it's a non-empty object (Weaviate OBJECT cannot be empty)
+    headings_val = item.get("headings")
+    if isinstance(headings_val, dict):
+        hv = {k: v for k, v in headings_val.items() if isinstance(v, str) and v}
+        if hv:
+            props["headings"] = hv
+
+    # Only include 'heading' if it's a non-empty object
+    heading_val = item.get("heading")
+    if isinstance(heading_val, dict):
+        hv2 = {k: v for k, v in heading_val.items() if isinstance(v, str) and v}
+        if hv2:
+            props["heading"] = hv2
+
+    # Include 'full_headings' when present and non-empty
+    full_headings_val = item.get("full_headings")
+    if isinstance(full_headings_val, str) and full_headings_val:
+        props["full_headings"] = full_headings_val
+    return props
+
+
+def document_of(chunk_id: str) -> str:
+    # "<file>-<index>" -> "<file>", as weaviate_purge.py
+    return chunk_id.rsplit("-", 1)[0]
+
+
+def object_uuid(document: str, digest: str, occurrence: int = 0) -> str:
+    """
+    Deterministic uuid of a chunk: uuid5 of its document, its content_hash and its rank among the
+    chunks of the document with the same hash (identical paragraphs repeated in a document).
+    """
+    return str(uuid.uuid5(_UUID_NAMESPACE, f"{document}\x1f{digest}\x1f{occurrence}"))
+
+
+def object_digest(props: Dict[str, Any]) -> str:
+    """
+    Digest of what is sent for an object: all its properties, among which the model (name and
+    version, the backend included, so that the vector is covered too), but not created_at, which
+    changes with every embeddings file.
+    """
+    payload = {k: v for k, v in props.items() if k not in ("created_at", "sync_digest")}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def existing_objects(coll, document: str) -> Dict[str, Tuple[str, Optional[str]]]:
+    """
+    uuid -> (chunk_id, sync_digest) of the objects of a document already in the collection (no
+    vectors fetched); the sync_digest of objects stored before it existed is None.
+    Filters on source_file and pages by content_hash (keyset), since Weaviate refuses offsets beyond
+    QUERY_MAXIMUM_RESULTS and its cursor does not take filters.
+    """
+    found: Dict[str, Tuple[str, Optional[str]]] = {}
+    where = Filter.by_property("source_file").equal(document)
+    by_hash = Filter.by_property("content_hash")
+
+    def fetch(filters, offset: int = 0) -> List[Any]:
+        resp = coll.query.fetch_objects(
+            filters=filters,
+            limit=_FETCH_PAGE,
+            offset=offset,
+            sort=Sort.by_property("content_hash"),
+            return_properties=["chunk_id", "source_file", "sync_digest", "content_hash"],
+        )
+        objs = resp.objects or []
+        for obj in objs:
+            # Collections created before source_file was field-tokenized: equal() also matches
+            # documents with the same words in their names
+            if obj.properties.get("source_file") == document:
+                found[str(obj.uuid)] = (obj.properties.get("chunk_id") or "", obj.properties.get("sync_digest"))
+        return objs
+
+    last: Optional[str] = None
+    while True:
+        objs = fetch(where if last is None else where & by_hash.greater_than(last))
+        if len(objs) < _FETCH_PAGE:
+            return found
+        last = objs[-1].properties.get("content_hash")
+        # The next page starts after this hash: the other chunks with it (repeated in the
+        # document) that did not fit in the page are read first
+        offset = 0
+        while len(fetch(where & by_hash.equal(last), offset)) == _FETCH_PAGE:
+            offset += _FETCH_PAGE
+
+
+def _batch(coll, batch_size: int, concurrent_requests: int):
+    if batch_size > 0:
+        return coll.batch.fixed_size(batch_size=batch_size, concurrent_requests=concurrent_requests)
+    return coll.batch.dynamic()
+
+
+def upload_objects(
+    coll,
+    objects: Iterable[Tuple[Dict[str, Any], Any, Optional[str]]],
+    batch_size: int = 0,
+    concurrent_requests: int = 2,
+    max_retries: int = 3,
+) -> int:
+    """
+    Insert (properties, main text vector, uuid) triples into the collection, as they come, by batches
+    (dynamic sizes unless batch_size > 0); an object with the uuid of a stored one replaces it.
+    Objects that fail are retried in new batches, up to max_retries times.
+    Returns the number of inserted objects.
+    """
+    added = 0
+    retry: List[Any] = []
+    for attempt in range(max_retries + 1):
+        with _batch(coll, batch_size, concurrent_requests) as batch:
+            if not attempt:
+                for props, text_vec, obj_uuid in objects:
+                    # Named vectors payload: main "text" only.
+                    batch.add_object(properties=props, vector={"text": text_vec}, uuid=obj_uuid)
+                    added += 1
+            else:
+                for obj in retry:
+                    # Same uuid: an object that was stored despite the error is replaced, not duplicated
+                    batch.add_object(properties=obj.properties, vector=obj.vector, uuid=obj.uuid)
+        failed = coll.batch.failed_objects
+        if not failed:
+            return added
+        retry = [err.object_ for err in failed]
+        if attempt < max_retries:
+            print(f"Warning: {len(failed)} objects failed ({failed[0].message}), retrying", file=sys.stderr)
+            time.sleep(min(30.0, 2.0 ** attempt))
+    raise RuntimeError(
+        f"{len(failed)} of {added} objects could not be inserted after {max_retries} retries: {failed[0].message}"
+    )
+
+
+def delete_objects(coll, uuids: List[str]) -> int:
+    deleted = 0
+    for start in range(0, len(uuids), _FETCH_PAGE):
+        part = uuids[start : start + _FETCH_PAGE]
+        coll.data.delete_many(where=Filter.by_id().contains_any(part))
+        deleted += len(part)
+    return deleted
+
+
+def sync_objects(
+    coll,
+    objects: Iterable[Tuple[Dict[str, Any], Any]],
+    full: bool = False,
+    batch_size: int = 0,
+    concurrent_requests: int = 2,
+    max_retries: int = 3,
+) -> Dict[str, int]:
+    """
+    Upsert (properties, main text vector) pairs, grouped by document, into the collection:
+    objects already stored with the same uuid, chunk_id and sync_digest (object_digest(), set on
+    the properties sent) are skipped (unless full), the others
+    are inserted, and the objects of these documents that are not among them are deleted at the end.
+    Returns the number of objects inserted (of which renumbered: already stored, with another
+    chunk_id), unchanged and deleted.
+    """
+    stored: Dict[str, Dict[str, Tuple[str, Optional[str]]]] = {}
+    seen: set = set()
+    occurrences: Counter = Counter()
+    counts = {"inserted": 0, "renumbered": 0, "unchanged": 0, "deleted": 0}
+
+    def delta() -> Iterator[Tuple[Dict[str, Any], Any, str]]:
+        for props, text_vec in objects:
+            document = document_of(props.get("chunk_id") or "")
+            if document not in stored:
+                stored[document] = existing_objects(coll, document)
+            digest = props["content_hash"]
+            obj_uuid = object_uuid(document, digest, occurrences[(document, digest)])
+            occurrences[(document, digest)] += 1
+            seen.add(obj_uuid)
+            props["sync_digest"] = object_digest(props)
+            previous = stored[document].get(obj_uuid)
+            if not full and previous == (props.get("chunk_id"), props["sync_digest"]):
+                counts["unchanged"] += 1
+                continue
+            if previous is not None and previous[0] != props.get("chunk_id"):
+                # Same content, new sequence number: sent again for its chunk_id property
+                counts["renumbered"] += 1
+            yield props, text_vec, obj_uuid
+
+    try:
+        counts["inserted"] = upload_objects(
+            coll, delta(), batch_size=batch_size, concurrent_requests=concurrent_requests, max_retries=max_retries
+        )
+        # Stale objects go once their replacements are stored, so that the document is never missing
+        stale = [u for objs in stored.values() for u in objs if u not in seen]
+        counts["deleted"] = delete_objects(coll, stale)
+    finally:
+        # Even after a failure: part of the objects may have been written
+        invalidate_cache()
+    return counts
+
+
+def summary(counts: Dict[str, int], collection_name: str, elapsed: float) -> str:
+    rate = f"{counts['inserted'] / elapsed:.0f}" if elapsed > 0 else "-"
+    return (
+        f"Inserted {counts['inserted']} objects into Weaviate collection '{collection_name}' "
+        f"({counts['renumbered']} renumbered, {counts['unchanged']} unchanged, {counts['deleted']} deleted) "
+        f"in {elapsed:.1f}s ({rate} objects/s)."
+    )
+
+
 def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(
         description="Upload NDJSON embeddings into a local Weaviate instance (no re-embedding)."
@@ -138,21 +385,52 @@ def main(argv: Optional[List[str]] = None) -> int:
         "-n",
         "--no-recreate",
         action="store_true",
-        help="Ne pas recréer la collection et son schéma s'ils existent déjà.",
+        help="Deprecated, ignored: the collection is never recreated, objects are upserted into it",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Send every object, including those already stored unchanged",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=0,
+        help="Objects per batch request; 0 lets the client size batches dynamically (default: 0)",
+    )
+    parser.add_argument(
+        "--concurrent-requests",
+        type=int,
+        default=2,
+        help="Batch requests in flight, with --batch-size (default: 2)",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=3,
+        help="Number of times failed objects are sent again (default: 3)",
     )
     args = parser.parse_args(argv)
+    if args.no_recreate:
+        print("Warning: -n/--no-recreate is deprecated and has no effect", file=sys.stderr)
 
+    started = time.monotonic()
     try:
-        count = upload_embeddings_to_weaviate(
+        counts = upload_embeddings_to_weaviate(
             args.input,
             collection_name=args.collection_name,
-            recreate=(not args.no_recreate),
+            full=args.full,
+            batch_size=args.batch_size,
+            concurrent_requests=args.concurrent_requests,
+            max_retries=args.max_retries,
         )
     except Exception as exc:
         print(f"Error: {exc}", file=sys.stderr)
         return 1
 
-    print(f"Inserted {count} objects into Weaviate collection '{args.collection_name}'.")
+    elapsed = time.monotonic() - started
+    print(summary(counts, args.collection_name, elapsed))
     return 0
 
 
@@ -2,39 +2,46 @@
 """
 Interroge Weaviate pour:
 - afficher le nombre total d'objets dans la collection (par défaut: "rag_chunks"),
-- lister les différents noms de fichiers (dérivés de chunk_id "<fichier>-<index>")
-  avec, entre parenthèses, le nombre de chunks associés.
+- lister les différents noms de fichiers avec, entre parenthèses, le nombre de chunks associés.
+
+Les comptes sont calculés par Weaviate (aggregate groupé sur la propriété source_file, renseignée
+à l'ingestion par update_weaviate.py), sans rapatrier les objets. Pour une collection dont des
+objets n'ont pas encore source_file (chargés avant son ajout), on revient au parcours de tous les
+objets, le nom de fichier étant alors dérivé de chunk_id "<fichier>-<index>".
 
 Exemple de chunk_id:
 "CCTP.docx.html.md.converted-6" -> fichier: "CCTP.docx.html.md.converted"
+
+Le résultat est conservé dans un cache local ($INFOS_CACHE_DIR, ou ~/.cache/awsgpu/infos par
+défaut), vidé par chaque écriture dans Weaviate faite par les scripts du pipeline (ingestion,
+purge, réinitialisation, bascule d'alias): voir invalidate_cache(). --refresh l'ignore.
 """
 
 from __future__ import annotations
 
 import argparse
+import json
 import os
 import re
+import shutil
 import sys
 from collections import defaultdict
+from pathlib import Path
 from typing import Dict, Optional, Tuple
 
 try:
-    import weaviate
+    from weaviate.classes.aggregate import GroupByAggregate
 except Exception:
     print("Erreur: weaviate-client est requis. Installez-le avec: pip install weaviate-client", file=sys.stderr)
     raise
 
+from weaviate_pool import connect_local
+
+
+# Nombre maximal de fichiers distincts rapportés par l'aggregate groupé
+_MAX_FILES = 100000
+
 
-def _connect_local():
-    """
-    Connexion à une instance Weaviate locale.
-    Peut utiliser la variable d'environnement WEAVIATE_HOST si fournie.
-    """
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
-    else:
-        return weaviate.connect_to_local()
 
 
 _CHUNK_ID_RE = re.compile(r"^(?P<file>.+)-(?P<index>\d+)$")
@@ -51,60 +58,136 @@ def _file_from_chunk_id(chunk_id: str) -> Optional[str]:
     return m.group("file")
 
 
-def collect_counts(collection_name: str) -> Tuple[int, Dict[str, int]]:
+def default_cache_dir() -> Path:
+    return Path(os.environ.get("INFOS_CACHE_DIR") or Path.home() / ".cache" / "awsgpu" / "infos")
+
+
+def _cache_path(collection_name: str) -> Path:
+    return default_cache_dir() / f"{collection_name.lower()}.json"
+
+
+def _read_cache(collection_name: str) -> Optional[Tuple[int, Dict[str, int]]]:
+    try:
+        with _cache_path(collection_name).open("r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return int(cached["total"]), {str(k): int(v) for k, v in cached["files"].items()}
+    except Exception:
+        return None
+
+
+def _write_cache(collection_name: str, total: int, per_file: Dict[str, int]) -> None:
+    path = _cache_path(collection_name)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"total": total, "files": per_file}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        # Le cache n'est qu'une optimisation
+        pass
+
+
+def invalidate_cache() -> None:
+    """
+    Vide le cache des comptes, de toutes les collections: une écriture dans une génération
+    (voir init_or_reset_collection.py) change aussi les comptes de l'alias qui la désigne.
+    À appeler après toute écriture ou suppression d'objets.
+    """
+    shutil.rmtree(default_cache_dir(), ignore_errors=True)
+
+
+def _aggregate_counts(coll) -> Optional[Tuple[int, Dict[str, int]]]:
+    """
+    Comptes calculés par Weaviate. Retourne None si des objets n'ont pas de source_file
+    (ou si la collection n'a pas cette propriété).
+    """
+    total = coll.aggregate.over_all(total_count=True).total_count or 0
+    try:
+        resp = coll.aggregate.over_all(
+            group_by=GroupByAggregate(prop="source_file", limit=_MAX_FILES),
+            total_count=True,
+        )
+    except Exception:
+        return None
+    per_file = {str(g.grouped_by.value): g.total_count or 0 for g in resp.groups if g.grouped_by.value}
+    if sum(per_file.values()) != total:
+        return None
+    return total, per_file
+
+
+def _scan_counts(coll) -> Tuple[int, Dict[str, int]]:
     """
     Récupère tous les objets et agrège:
     - total d'objets,
     - nombre de chunks par nom de fichier (dérivé de chunk_id).
     """
-    client = _connect_local()
+    total = 0
+    per_file = defaultdict(int)
+
+    limit = 1000
+    after = None
+
+    while True:
+        resp = coll.query.fetch_objects(
+            limit=limit,
+            return_properties=["chunk_id"],
+            after=after,
+        )
+        objs = getattr(resp, "objects", None) or []
+        for obj in objs:
+            props = getattr(obj, "properties", None) or {}
+            chunk_id = props.get("chunk_id")
+            if isinstance(chunk_id, str):
+                fname = _file_from_chunk_id(chunk_id)
+                if fname:
+                    per_file[fname] += 1
+            total += 1
+
+        # Prefer server-provided cursor; otherwise fall back to last object's UUID
+        server_cursor = (
+            getattr(resp, "cursor", None)
+            or getattr(resp, "next_cursor", None)
+            or getattr(getattr(resp, "page_info", None), "end_cursor", None)
+        )
+
+        if len(objs) < limit:
+            break
+
+        after = server_cursor or (getattr(objs[-1], "uuid", None) or getattr(objs[-1], "id", None))
+        if not after:
+            break
+
+    return total, dict(per_file)
+
+
+def collect_counts(collection_name: str, use_cache: bool = True) -> Tuple[int, Dict[str, int]]:
+    """
+    Retourne le total d'objets et le nombre de chunks par nom de fichier: depuis le cache local
+    s'il est présent, sinon par un aggregate groupé sur source_file, ou à défaut par un parcours
+    de tous les objets.
+    """
+    if use_cache:
+        cached = _read_cache(collection_name)
+        if cached is not None:
+            return cached
+
+    client = connect_local()
     try:
         coll = client.collections.get(collection_name)
-
-        total = 0
-        per_file = defaultdict(int)
-
-        limit = 1000
-        after = None
-
-        while True:
-            resp = coll.query.fetch_objects(
-                limit=limit,
-                return_properties=["chunk_id"],
-                after=after,
-            )
-            objs = getattr(resp, "objects", None) or []
-            for obj in objs:
-                props = getattr(obj, "properties", None) or {}
-                chunk_id = props.get("chunk_id")
-                if isinstance(chunk_id, str):
-                    fname = _file_from_chunk_id(chunk_id)
-                    if fname:
-                        per_file[fname] += 1
-                total += 1
-
-            # Prefer server-provided cursor; otherwise fall back to last object's UUID
-            server_cursor = (
-                getattr(resp, "cursor", None)
-                or getattr(resp, "next_cursor", None)
-                or getattr(getattr(resp, "page_info", None), "end_cursor", None)
-            )
-
-            if len(objs) < limit:
-                break
-
-            after = server_cursor or (getattr(objs[-1], "uuid", None) or getattr(objs[-1], "id", None))
-            if not after:
-                break
-
-        return total, dict(per_file)
+        counts = _aggregate_counts(coll)
+        if counts is None:
+            counts = _scan_counts(coll)
     finally:
         client.close()
 
+    _write_cache(collection_name, *counts)
+    return counts
+
 
 def main(argv=None) -> int:
     parser = argparse.ArgumentParser(
-        description="Affiche le total d'objets et la répartition par fichier (d'après chunk_id) dans une collection Weaviate."
+        description="Affiche le total d'objets et la répartition par fichier (d'après source_file) dans une collection Weaviate."
     )
     parser.add_argument(
         "-c",
@@ -112,10 +195,15 @@ def main(argv=None) -> int:
         default="rag_chunks",
         help='Nom de la collection Weaviate (défaut: "rag_chunks")',
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore le cache local et interroge Weaviate",
+    )
     args = parser.parse_args(argv)
 
     try:
-        total, per_file = collect_counts(args.collection_name)
+        total, per_file = collect_counts(args.collection_name, use_cache=not args.refresh)
     except Exception as exc:
         print(f"Erreur: {exc}", file=sys.stderr)
         return 1
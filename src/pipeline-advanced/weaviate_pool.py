@@ -0,0 +1,154 @@
+"""
+Pool of connections to the local Weaviate, shared by search_chunks.py, search_chunks-bm25.py and
+weaviate_purge.py, so that a long-running process importing them (retrieval_server.py, an
+evaluation loop) does not open a connection (REST + gRPC handshakes) per query.
+
+- Up to size clients are opened, on demand; a caller finding them all in use waits for one.
+- Health checks: a client idle for more than check_interval seconds is checked (is_ready()) before
+  being handed out, and a client on which an operation failed is checked when it is given back;
+  unhealthy clients are closed and replaced by new connections.
+- run(fn) calls fn(client), once more on another client if the first one turned out unhealthy
+  (Weaviate restarted, connection dropped).
+- shared_pool() is the pool of the process, closed at exit.
+
+Connects to $WEAVIATE_HOST if set, else to the default local URL.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+try:
+    import weaviate
+except Exception as exc:
+    print("Error: weaviate-client is required. Install with: pip install weaviate-client", file=sys.stderr)
+    raise
+
+
+def connect_local():
+    """
+    New client of the local Weaviate: $WEAVIATE_HOST if set, else the default local URL. The one
+    connect helper of the scripts, pooled or not.
+    """
+    weaviate_host = os.environ.get("WEAVIATE_HOST")
+    if weaviate_host:
+        return weaviate.connect_to_local(host=weaviate_host)
+    else:
+        return weaviate.connect_to_local()
+
+
+def _healthy(client) -> bool:
+    try:
+        return client.is_connected() and client.is_ready()
+    except Exception:
+        return False
+
+
+def _close(client) -> None:
+    try:
+        client.close()
+    except Exception:
+        pass
+
+
+class WeaviatePool:
+    def __init__(self, size: int = 4, check_interval: float = 30.0, connect: Callable[[], Any] = connect_local) -> None:
+        if size < 1:
+            raise ValueError("size must be >= 1")
+        self.size = size
+        self.check_interval = check_interval
+        self._connect = connect
+        # (client, time of its last successful use or check), most recently used last
+        self._idle: List[Tuple[Any, float]] = []
+        self._opened = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        while True:
+            with self._cond:
+                while not self._idle and self._opened >= self.size:
+                    self._cond.wait()
+                if self._idle:
+                    client, checked = self._idle.pop()
+                else:
+                    client, checked = None, 0.0
+                    self._opened += 1
+            if client is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+            if time.monotonic() - checked <= self.check_interval or _healthy(client):
+                return client
+            _close(client)
+            self._forget()
+
+    def _forget(self) -> None:
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def _release(self, client, healthy: bool) -> None:
+        if not healthy:
+            _close(client)
+            self._forget()
+            return
+        with self._cond:
+            self._idle.append((client, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        client = self._acquire()
+        healthy = True
+        try:
+            yield client
+        except Exception:
+            healthy = _healthy(client)
+            raise
+        finally:
+            self._release(client, healthy)
+
+    def run(self, fn: Callable[[Any], Any]) -> Any:
+        for attempt in (0, 1):
+            client = self._acquire()
+            try:
+                result = fn(client)
+            except Exception:
+                healthy = _healthy(client)
+                self._release(client, healthy)
+                if attempt or healthy:
+                    raise
+                continue
+            self._release(client, True)
+            return result
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for client, _ in idle:
+            _close(client)
+
+
+_shared: Optional[WeaviatePool] = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool() -> WeaviatePool:
+    """
+    Pool of the process; $WEAVIATE_POOL_SIZE clients at most (default: 4).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = WeaviatePool(size=int(os.environ.get("WEAVIATE_POOL_SIZE") or 4))
+            atexit.register(_shared.close)
+        return _shared
@@ -5,34 +5,25 @@ dont le chunk_id correspond à un fichier donné.
 
 Format attendu de chunk_id: "<fichier>-<index>"
 Exemple: "CCTP.docx.html.md.converted-6" -> fichier: "CCTP.docx.html.md.converted"
+
+Vide ensuite le cache des comptes de weaviate_infos.py.
 """
 
 from __future__ import annotations
 
 import argparse
-import os
 import re
 import sys
 from typing import List, Optional
 
 try:
-    import weaviate
     from weaviate.classes.query import Filter
 except Exception:
     print("Erreur: weaviate-client est requis. Installez-le avec: pip install weaviate-client", file=sys.stderr)
     raise
 
-
-def _connect_local():
-    """
-    Connexion à une instance Weaviate locale.
-    Peut utiliser la variable d'environnement WEAVIATE_HOST si fournie.
-    """
-    weaviate_host = os.environ.get("WEAVIATE_HOST")
-    if weaviate_host:
-        return weaviate.connect_to_local(host=weaviate_host)
-    else:
-        return weaviate.connect_to_local()
+from weaviate_infos import invalidate_cache
+from weaviate_pool import shared_pool
 
 
 def purge_by_filename(file_name: str, collection_name: str = "rag_chunks") -> int:
@@ -43,8 +34,8 @@ def purge_by_filename(file_name: str, collection_name: str = "rag_chunks") -> in
     if not file_name:
         raise ValueError("file_name ne doit pas être vide")
 
-    client = _connect_local()
-    try:
+    # Connexion du pool partagé (weaviate_pool.py), rendue au pool à la fin
+    with shared_pool().connection() as client:
         coll = client.collections.get(collection_name)
 
         # Construire un filtre "like" et compter via pagination filtrée (client >=4.16.9)
@@ -80,10 +71,9 @@ def purge_by_filename(file_name: str, collection_name: str = "rag_chunks") -> in
 
         # Suppression en masse
         coll.data.delete_many(where=where_filter)
+        invalidate_cache()
 
         return total_match
-    finally:
-        client.close()
 
 
 def main(argv: Optional[List[str]] = None) -> int:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Regression corpus of create_chunks.py: seeded, fuzzed Markdown documents mixing the constructs the
+chunker treats specially (headings, lists, pipe and HTML tables, image descriptions, indented
+lines, form feeds and carriage returns), and their chunks as produced by a reference version.
+
+Regenerate it (documents and expected outputs) from the baseline create_chunks.py:
+  git show e9d4440:src/pipeline-advanced/create_chunks.py > /tmp/create_chunks_baseline.py
+  ./tests/data/create_chunks/generate_corpus.py --baseline /tmp/create_chunks_baseline.py
+
+Writes corpus/doc-NNN.md and expected/doc-NNN.md.<chunk size>.chunks.jq next to this script;
+tests/test_create_chunks_regression.py compares the current output against them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import random
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+HERE = Path(__file__).resolve().parent
+DOCUMENTS = 50
+CHUNK_SIZES = [3, 40, 200]
+
+_WORDS = "le la contrat maintenance sécurité | données forge Jenkins table image RGPD serveur the and with".split()
+
+
+def generate_document(seed: int) -> str:
+    rng = random.Random(seed)
+
+    def w(n: int) -> str:
+        return " ".join(rng.choice(_WORDS) for _ in range(n))
+
+    pieces: List[Callable[[], str]] = [
+        lambda: "#" * rng.randint(1, 7) + " " + w(rng.randint(0, 4)),
+        lambda: "# a | b",
+        lambda: w(rng.randint(1, 30)),
+        lambda: "",
+        lambda: "   ",
+        lambda: "\t" + w(3),
+        lambda: "  " + w(3),
+        lambda: rng.choice(["- ", "* ", "+ ", "1. ", "2) ", "  - ", "-"]) + w(rng.randint(0, 6)),
+        lambda: "| h1 | h2 |\n|---|---|\n" + "\n".join(f"| {w(2)} | {w(1)} |" for _ in range(rng.randint(0, 4))),
+        lambda: "| a | b |",
+        lambda: "|---|:---:|",
+        lambda: "<table><tr><td>" + w(3) + "</td></tr></table>",
+        lambda: "<TABLE>\n<tr><td>"
+        + w(2)
+        + "<table><tr><td>x</td></tr></table></td></tr>\n"
+        + rng.choice(["# inside", "- li", ""])
+        + "\n</table >",
+        lambda: "  <table>\n" + w(4),
+        lambda: w(2) + " <IMAGE DESCRIPTION START>" + w(5) + "<IMAGE DESCRIPTION END> " + w(2),
+        lambda: "<IMAGE DESCRIPTION START>"
+        + w(5)
+        + "\n"
+        + rng.choice(["# h in img", "- li", "", w(4)])
+        + "\n"
+        + w(2)
+        + "<IMAGE DESCRIPTION END>"
+        + rng.choice(["", " tail"]),
+        lambda: "<IMAGE DESCRIPTION START>" + w(3),
+        lambda: "a\x0cb",
+        lambda: "x\r\ny",
+    ]
+    lines = [rng.choice(pieces)() for _ in range(rng.randint(5, 400))]
+    return "\n".join(lines) + rng.choice(["", "\n"])
+
+
+def _load(path: str):
+    spec = importlib.util.spec_from_file_location("create_chunks_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Regenerate the create_chunks.py regression corpus and its expected outputs.")
+    parser.add_argument("--baseline", required=True, help="Path to the reference create_chunks.py")
+    args = parser.parse_args(argv)
+
+    baseline = _load(args.baseline)
+    (HERE / "corpus").mkdir(exist_ok=True)
+    (HERE / "expected").mkdir(exist_ok=True)
+    for seed in range(DOCUMENTS):
+        name = f"doc-{seed:03d}.md"
+        doc_path = HERE / "corpus" / name
+        # newline="": the carriage returns of the document are kept as generated
+        with doc_path.open("w", encoding="utf-8", newline="") as f:
+            f.write(generate_document(seed))
+        text = doc_path.read_text(encoding="utf-8")
+        for size in CHUNK_SIZES:
+            chunks = baseline.build_chunks_from_markdown(text, chunk_size_tokens=size, source=name)
+            with (HERE / "expected" / f"{name}.{size}.chunks.jq").open("w", encoding="utf-8") as f:
+                for ch in chunks:
+                    f.write(json.dumps(ch, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
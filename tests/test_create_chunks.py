@@ -0,0 +1,102 @@
+"""
+content_hash() must identify a chunk by its headings and text only, and diff_chunks() must pair
+the chunks of two runs by that hash, whatever their chunk_id.
+
+Run from the repository root:
+  python -m unittest tests.test_create_chunks
+"""
+
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+import create_chunks  # noqa: E402
+
+
+DOCUMENT = [
+    "# Guide\n",
+    "\n",
+    "## Install\n",
+    "\n",
+    "Download the package and unpack it in a directory of your choice.\n",
+    "\n",
+    "## Configure\n",
+    "\n",
+    "Edit the configuration file to set the address of the server.\n",
+    "\n",
+    "## Run\n",
+    "\n",
+    "Start the service, then check its log for errors.\n",
+]
+
+
+def identities(lines):
+    return [
+        (ch["chunk_id"], ch["content_hash"])
+        for ch in create_chunks.iter_chunks_from_markdown(lines, chunk_size_tokens=40, source="guide.md")
+    ]
+
+
+class ContentHashTest(unittest.TestCase):
+    def test_stable(self) -> None:
+        headings = {"h1": "Guide", "h2": "Install"}
+        self.assertEqual(create_chunks.content_hash(headings, "some text"), create_chunks.content_hash(dict(headings), "some text"))
+
+    def test_whitespace_is_normalized(self) -> None:
+        headings = {"h1": "Guide"}
+        self.assertEqual(
+            create_chunks.content_hash(headings, "a reflowed\nparagraph  of text"),
+            create_chunks.content_hash(headings, " a reflowed paragraph of\ttext\n"),
+        )
+
+    def test_text_and_headings_matter(self) -> None:
+        base = create_chunks.content_hash({"h1": "Guide"}, "text")
+        self.assertNotEqual(base, create_chunks.content_hash({"h1": "Guide"}, "other text"))
+        self.assertNotEqual(base, create_chunks.content_hash({"h1": "Manual"}, "text"))
+        self.assertNotEqual(base, create_chunks.content_hash({"h2": "Guide"}, "text"))
+
+
+class DiffChunksTest(unittest.TestCase):
+    def test_added_removed_unchanged(self) -> None:
+        previous = [("1", "a"), ("2", "b"), ("3", "c")]
+        current = [("1", "a"), ("2", "x"), ("3", "c")]
+        self.assertEqual(
+            create_chunks.diff_chunks(previous, current),
+            {
+                "added": [{"chunk_id": "2", "content_hash": "x"}],
+                "removed": [{"chunk_id": "2", "content_hash": "b"}],
+                "unchanged": [
+                    {"chunk_id": "1", "previous_chunk_id": "1", "content_hash": "a"},
+                    {"chunk_id": "3", "previous_chunk_id": "3", "content_hash": "c"},
+                ],
+            },
+        )
+
+    def test_duplicates_are_paired_in_order(self) -> None:
+        delta = create_chunks.diff_chunks([("1", "a"), ("2", "a")], [("5", "a")])
+        self.assertEqual(delta["unchanged"], [{"chunk_id": "5", "previous_chunk_id": "1", "content_hash": "a"}])
+        self.assertEqual(delta["removed"], [{"chunk_id": "2", "content_hash": "a"}])
+        self.assertEqual(delta["added"], [])
+
+    def test_renumbered_document(self) -> None:
+        # A section inserted after the title shifts the chunk_id of the sections below it, not their hash
+        previous = identities(DOCUMENT)
+        current = identities(DOCUMENT[:2] + ["## Overview\n", "\n", "What the guide is about.\n", "\n"] + DOCUMENT[2:])
+        delta = create_chunks.diff_chunks(previous, current)
+        self.assertEqual([a["chunk_id"] for a in delta["added"]], ["guide-2"])
+        self.assertEqual(delta["removed"], [])
+        self.assertEqual(
+            [(u["previous_chunk_id"], u["chunk_id"]) for u in delta["unchanged"]],
+            [("guide-1", "guide-1"), ("guide-2", "guide-3"), ("guide-3", "guide-4"), ("guide-4", "guide-5")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
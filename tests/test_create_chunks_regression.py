@@ -0,0 +1,55 @@
+"""
+create_chunks.py must chunk the regression corpus (tests/data/create_chunks, see generate_corpus.py
+there) exactly as the baseline version did.
+
+Later changes added fields to the output on purpose: the content_hash of each chunk is left out of
+the comparison, and keywords are taken by raw frequency (with_keywords=True), as the baseline did,
+instead of by TF-IDF.
+
+Run from the repository root:
+  python -m unittest tests.test_create_chunks_regression
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA = ROOT / "tests" / "data" / "create_chunks"
+CHUNK_SIZES = [3, 40, 200]
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+import create_chunks  # noqa: E402
+
+
+def chunks_jsonl(path: Path, chunk_size_tokens: int) -> str:
+    lines = []
+    for ch in create_chunks.iter_chunks_from_markdown(
+        create_chunks.read_markdown_lines(path),
+        chunk_size_tokens=chunk_size_tokens,
+        source=path.name,
+        with_keywords=True,
+    ):
+        ch.pop("content_hash", None)
+        lines.append(json.dumps(ch, ensure_ascii=False) + "\n")
+    return "".join(lines)
+
+
+class CreateChunksRegressionTest(unittest.TestCase):
+    def test_corpus_matches_baseline(self) -> None:
+        documents = sorted((DATA / "corpus").glob("*.md"))
+        self.assertTrue(documents, f"No document in {DATA / 'corpus'}")
+        for path in documents:
+            for size in CHUNK_SIZES:
+                with self.subTest(document=path.name, chunk_size_tokens=size):
+                    expected = (DATA / "expected" / f"{path.name}.{size}.chunks.jq").read_text(encoding="utf-8")
+                    self.assertEqual(chunks_jsonl(path, size), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+NpyRowWriter must write .npy files that np.load reads back, and the length-sorted batches of
+encode_local() must map every vector back to its text, whatever the batch order.
+
+Run from the repository root (needs sentence-transformers, not a GPU):
+  python -m unittest tests.test_create_embeddings
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+try:
+    import create_embeddings  # noqa: E402
+except ImportError:
+    # sentence-transformers missing
+    create_embeddings = None
+
+
+class StubModel:
+    # Tokens estimated from the text length (no tokenizer); the vector of a text is (its length, 1)
+    max_seq_length = None
+    tokenizer = None
+
+    def __init__(self) -> None:
+        self.batch_sizes = []
+
+    def encode(self, texts, batch_size, convert_to_numpy, show_progress_bar):
+        self.batch_sizes.append(len(texts))
+        return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+
+@unittest.skipIf(create_embeddings is None, "sentence-transformers is not installed")
+class NpyRowWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "vectors.npy"
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_rows_read_back(self) -> None:
+        rows = np.arange(35, dtype=np.float32).reshape(7, 5)
+        writer = create_embeddings.NpyRowWriter(self.path)
+        writer.write(rows[:3])
+        writer.write(rows[3:4])
+        writer.write(rows[4:])
+        writer.close()
+
+        with self.path.open("rb") as f:
+            self.assertEqual(np.lib.format.read_magic(f), (1, 0))
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            self.assertEqual(f.tell(), create_embeddings.NpyRowWriter._HEADER_SIZE)
+        self.assertEqual((shape, fortran_order, dtype), ((7, 5), False, np.dtype("float32")))
+        np.testing.assert_array_equal(np.load(self.path), rows)
+        np.testing.assert_array_equal(np.load(self.path, mmap_mode="r"), rows)
+
+    def test_float16(self) -> None:
+        rows = np.linspace(-1, 1, 12, dtype=np.float32).reshape(3, 4)
+        writer = create_embeddings.NpyRowWriter(self.path, dtype="float16")
+        writer.write(rows)
+        writer.close()
+        loaded = np.load(self.path)
+        self.assertEqual(loaded.dtype, np.float16)
+        np.testing.assert_array_equal(loaded, rows.astype(np.float16))
+
+    def test_no_rows(self) -> None:
+        create_embeddings.NpyRowWriter(self.path).close()
+        self.assertEqual(np.load(self.path).shape, (0, 0))
+
+
+@unittest.skipIf(create_embeddings is None, "sentence-transformers is not installed")
+class LengthSortedBatchesTest(unittest.TestCase):
+    def test_every_index_once_longest_first(self) -> None:
+        lengths = [5, 120, 7, 64, 7, 300, 1, 64]
+        batches = create_embeddings.length_sorted_batches(lengths, token_budget=256, max_batch_size=3)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(lengths))))
+        flat = [lengths[i] for batch in batches for i in batch]
+        self.assertEqual(flat, sorted(lengths, reverse=True))
+        for batch in batches:
+            self.assertLessEqual(len(batch), 3)
+            # Padded to its first (longest) text; a text longer than the budget goes alone
+            self.assertTrue(len(batch) == 1 or len(batch) * lengths[batch[0]] <= 256)
+
+    def test_encode_local_keeps_the_original_order(self) -> None:
+        texts = ["x" * n for n in (40, 4, 400, 12, 4, 80, 2000, 8)]
+        model = StubModel()
+        out = [None] * len(texts)
+        for positions, vectors in create_embeddings.encode_local(model, texts):
+            for i, vec in zip(positions, vectors):
+                self.assertIsNone(out[i])
+                out[i] = vec
+        self.assertEqual([vec[0] for vec in out], [len(t) for t in texts])
+        self.assertEqual(sum(model.batch_sizes), len(texts))
+
+
+if __name__ == "__main__":
+    unittest.main()
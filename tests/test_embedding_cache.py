@@ -0,0 +1,116 @@
+"""
+EmbeddingCache must give back the vectors it stored, in this process and after a reopen (through
+the sorted key index of each segment), and evict the least recently used segments first.
+
+Run from the repository root:
+  python -m unittest tests.test_embedding_cache
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+
+ROOT = Path(__file__).resolve().parent.parent
+DIM = 256
+# Rows of DIM float32 that fill a segment of 1 MB
+SEGMENT_ROWS = 1024
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def open(self, **kwargs) -> EmbeddingCache:
+        return EmbeddingCache("model", "1", cache_dir=self.tmp.name, max_mb=kwargs.pop("max_mb", 100), segment_mb=1, **kwargs)
+
+    def entries(self, cache: EmbeddingCache, start: int, count: int):
+        keys = [cache.key(f"text {i}") for i in range(start, start + count)]
+        return keys, self.rng.standard_normal((count, DIM)).astype(np.float32)
+
+    def assert_vectors(self, found, vectors) -> None:
+        self.assertEqual(len(found), len(vectors))
+        for got, expected in zip(found, vectors):
+            np.testing.assert_array_equal(got, expected)
+
+    def test_round_trip_and_reopen(self) -> None:
+        cache = self.open()
+        keys, vectors = self.entries(cache, 0, 100)
+        cache.put_many(list(zip(keys, vectors)))
+        self.assert_vectors(cache.get_many(keys), vectors)
+        cache.close()
+
+        reopened = self.open()
+        self.assertEqual(len(reopened), 100)
+        self.assert_vectors(reopened.get_many(keys), vectors)
+        self.assert_vectors([reopened.get(keys[7])], vectors[7:8])
+        self.assertIsNone(reopened.get(reopened.key("never stored")))
+
+    def test_put_many_skips_stored_keys(self) -> None:
+        cache = self.open()
+        keys, vectors = self.entries(cache, 0, 10)
+        cache.put_many(list(zip(keys, vectors)))
+        cache.put_many(list(zip(keys, vectors + 1)))
+        reopened = self.open()
+        self.assertEqual(len(reopened), 10)
+        self.assert_vectors(reopened.get_many(keys), vectors)
+
+    def test_keys_sharing_a_prefix(self) -> None:
+        cache = self.open()
+        keys, vectors = self.entries(cache, 0, 2)
+        keys[1] = keys[0][:8] + keys[1][8:]
+        cache.put_many(list(zip(keys, vectors)))
+        self.assert_vectors(self.open().get_many(keys), vectors)
+
+    def test_index_rebuilt_when_missing(self) -> None:
+        cache = self.open()
+        keys, vectors = self.entries(cache, 0, 50)
+        cache.put_many(list(zip(keys, vectors)))
+        for path in Path(cache.dir).glob("*.idx"):
+            path.unlink()
+        self.assert_vectors(self.open().get_many(keys), vectors)
+        self.assertTrue(list(Path(cache.dir).glob("*.idx")))
+
+    def test_evicts_least_recently_used_segment(self) -> None:
+        cache = self.open()
+        batches = [self.entries(cache, i * SEGMENT_ROWS, SEGMENT_ROWS) for i in range(3)]
+        for keys, vectors in batches:
+            cache.put_many(list(zip(keys, vectors)))
+        self.assertEqual(cache._list_segments(), [0, 1, 2])
+
+        # Segment 0 served a hit after segment 1 was written to
+        os.utime(cache._keys_path(0), (2_000_000_000, 2_000_000_000))
+        os.utime(cache._keys_path(1), (1_000_000_000, 1_000_000_000))
+        segment_bytes = sum(
+            path.stat().st_size for path in (cache._keys_path(0), cache._vectors_path(0), cache._index_path(0))
+        )
+        cache.max_bytes = 2 * segment_bytes + segment_bytes // 2
+        cache._evict(keep=2)
+        self.assertEqual(cache._list_segments(), [0, 2])
+        self.assertFalse(cache._index_path(1).exists())
+
+        # The newest segment is kept whatever the limit
+        cache.max_bytes = 0
+        cache._evict(keep=2)
+        self.assertEqual(cache._list_segments(), [2])
+        reopened = self.open()
+        self.assertEqual(reopened.get_many(batches[0][0][:1]), [None])
+        self.assert_vectors(reopened.get_many(batches[2][0]), batches[2][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+OpenAIEmbedder must return the vector of every text through rate limits, server errors and
+rejected inputs, here those of openai_mock_server.py; pack_batches() and _retry_after() are
+checked on their own.
+
+Run from the repository root (the mock test needs the openai package):
+  python -m unittest tests.test_openai_embeddings
+"""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / "src" / "pipeline-advanced"
+DIMENSIONS = 8
+REJECT = "REJECT-ME"
+
+sys.path.insert(0, str(SRC))
+
+from openai_embeddings import OpenAIEmbedder, pack_batches, _retry_after  # noqa: E402
+from openai_mock_server import mock_embedding  # noqa: E402
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+
+def http_error(headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+class PackBatchesTest(unittest.TestCase):
+    def test_token_limit(self) -> None:
+        self.assertEqual(pack_batches([4, 4, 4, 4, 4], max_tokens=10), [[0, 1], [2, 3], [4]])
+
+    def test_input_limit(self) -> None:
+        self.assertEqual(pack_batches([1] * 5, max_tokens=100, max_inputs=2), [[0, 1], [2, 3], [4]])
+
+    def test_oversized_input_gets_its_own_batch(self) -> None:
+        self.assertEqual(pack_batches([3, 50, 3], max_tokens=10), [[0], [1], [2]])
+
+    def test_empty(self) -> None:
+        self.assertEqual(pack_batches([], max_tokens=10), [])
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_milliseconds_first(self) -> None:
+        self.assertEqual(_retry_after(http_error({"retry-after-ms": "250", "retry-after": "3"})), 0.25)
+
+    def test_seconds(self) -> None:
+        self.assertEqual(_retry_after(http_error({"retry-after": "2.5"})), 2.5)
+
+    def test_http_date(self) -> None:
+        wait = _retry_after(http_error({"retry-after": formatdate(time.time() + 30, usegmt=True)}))
+        self.assertGreater(wait, 25)
+        self.assertLessEqual(wait, 31)
+
+    def test_past_http_date(self) -> None:
+        self.assertEqual(_retry_after(http_error({"retry-after": formatdate(time.time() - 30, usegmt=True)})), 0.0)
+
+    def test_missing_or_invalid(self) -> None:
+        self.assertIsNone(_retry_after(http_error({})))
+        self.assertIsNone(_retry_after(http_error({"retry-after": "soon"})))
+        self.assertIsNone(_retry_after(ValueError("no response")))
+
+
+@unittest.skipIf(openai is None, "openai is not installed")
+class MockServerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = subprocess.Popen(
+            [
+                sys.executable,
+                str(SRC / "openai_mock_server.py"),
+                "--port", "0",
+                "--dimensions", str(DIMENSIONS),
+                "--rate-limit", "0.2",
+                "--retry-after", "0.01",
+                "--error-rate", "0.1",
+                "--reject", REJECT,
+                "--seed", "1",
+            ],
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        # "Listening on http://127.0.0.1:<port>/v1", then one line per request
+        self.base_url = self.server.stderr.readline().split()[-1]
+        # Drained so that the server never blocks on a full pipe
+        self.drain = threading.Thread(target=self.server.stderr.read, daemon=True)
+        self.drain.start()
+
+    def tearDown(self) -> None:
+        self.server.terminate()
+        self.server.wait()
+        self.drain.join()
+        self.server.stderr.close()
+
+    def test_embed(self) -> None:
+        texts = [f"chunk {i}: " + " ".join(["lorem ipsum"] * (i % 7 + 1)) for i in range(60)]
+        # Its first half, sent after the truncation, no longer holds the rejected string
+        rejected = 17
+        texts[rejected] = "x" * 40 + REJECT
+        embedder = OpenAIEmbedder("text-embedding-3-large", "test", base_url=self.base_url, concurrency=4)
+
+        vectors = embedder.embed(texts)
+
+        self.assertEqual(vectors.shape, (len(texts), DIMENSIONS))
+        for i, text in enumerate(texts):
+            expected = mock_embedding(text[: len(text) // 2] if i == rejected else text, DIMENSIONS)
+            np.testing.assert_array_equal(vectors[i], expected, err_msg=f"text {i}")
+        self.assertEqual(embedder.truncated, {rejected})
+        self.assertGreater(embedder.splits, 0)
+        self.assertGreater(embedder.retries, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
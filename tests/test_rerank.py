@@ -0,0 +1,125 @@
+"""
+bm25_scores() and prefilter() must order the candidates of the cascade, and cascade_rerank()
+must only send the top_m of them to the cross-encoder, here a stub that scores known texts.
+
+Run from the repository root (needs sentence-transformers, not a model or a GPU):
+  python -m unittest tests.test_rerank
+"""
+
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+try:
+    import rerank  # noqa: E402
+except ImportError:
+    # sentence-transformers missing
+    rerank = None
+
+
+QUESTION = "rotate api key"
+# In the order of the search: the best keyword match comes last
+TEXTS = [
+    "Install the client with pip.",
+    "The service listens on port 8080.",
+    "Logs are kept for thirty days.",
+    "An API key is required for every request.",
+    "Rotate the API key from the console, then restart the service.",
+]
+# Scores of the stub cross-encoder
+RELEVANCE = {TEXTS[0]: 0.1, TEXTS[1]: 0.3, TEXTS[2]: 0.2, TEXTS[3]: 0.6, TEXTS[4]: 0.9}
+
+
+def candidates():
+    return [{"chunk_id": f"doc-{i}", "text": text} for i, text in enumerate(TEXTS, start=1)]
+
+
+def ids(items):
+    return [obj["chunk_id"] for obj in items]
+
+
+@unittest.skipIf(rerank is None, "sentence-transformers is not installed")
+class Bm25ScoresTest(unittest.TestCase):
+    def test_matching_texts_first(self) -> None:
+        scores = rerank.bm25_scores(QUESTION, TEXTS)
+        self.assertEqual(scores[:3], [0.0, 0.0, 0.0])
+        self.assertGreater(scores[4], scores[3])
+        self.assertGreater(scores[3], 0.0)
+
+    def test_rare_terms_weigh_more(self) -> None:
+        scores = rerank.bm25_scores("common rare", ["common rare", "common", "common", "common other"])
+        self.assertGreater(scores[0], scores[1])
+        scores = rerank.bm25_scores("common rare", ["rare x", "common x", "common y", "common z"])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_shorter_texts_weigh_more(self) -> None:
+        scores = rerank.bm25_scores("key", ["key", "key " + "filler " * 20])
+        self.assertGreater(scores[0], scores[1])
+
+    def test_no_text(self) -> None:
+        self.assertEqual(rerank.bm25_scores(QUESTION, []), [])
+
+
+@unittest.skipIf(rerank is None, "sentence-transformers is not installed")
+class CascadeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scored = []
+
+        def cross_encode(question, items, model_name=rerank._MODEL_NAME, max_length=512):
+            self.scored.append((model_name, ids(items)))
+            return [RELEVANCE[obj["text"]] for obj in items]
+
+        patcher = mock.patch.object(rerank, "_cross_encode", cross_encode)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefilter_distance_keeps_the_search_order(self) -> None:
+        ordered = rerank.prefilter(QUESTION, candidates(), "distance")
+        self.assertEqual(ids(ordered), ids(candidates()))
+        self.assertEqual([obj["prefilter"] for obj in ordered], sorted((obj["prefilter"] for obj in ordered), reverse=True))
+
+    def test_prefilter_bm25_moves_keyword_matches_up(self) -> None:
+        # Last for the search but first for BM25: second, after the first result of the search
+        ordered = ids(rerank.prefilter(QUESTION, candidates(), "bm25"))
+        self.assertEqual(ordered[:2], ["doc-1", "doc-5"])
+        self.assertEqual(sorted(ordered), ids(candidates()))
+
+    def test_prefilter_tiny_uses_the_small_cross_encoder(self) -> None:
+        ordered = rerank.prefilter(QUESTION, candidates(), "tiny")
+        self.assertEqual(ids(ordered), ["doc-5", "doc-4", "doc-2", "doc-3", "doc-1"])
+        self.assertEqual(self.scored, [(rerank._TINY_MODEL_NAME, ids(candidates()))])
+
+    def test_prefilter_unknown(self) -> None:
+        with self.assertRaises(ValueError):
+            rerank.prefilter(QUESTION, candidates(), "random")
+
+    def test_cascade_reranks_top_m_only(self) -> None:
+        items, timings = rerank.cascade_rerank(QUESTION, candidates(), top_m=2, method="bm25")
+        self.assertEqual(self.scored, [(rerank._MODEL_NAME, ["doc-1", "doc-5"])])
+        self.assertEqual(ids(items[:2]), ["doc-5", "doc-1"])
+        self.assertEqual([obj["reranker"] for obj in items[:2]], [0.9, 0.1])
+        # The others follow in prefilter order, without a cross-encoder score
+        self.assertTrue(all("reranker" not in obj for obj in items[2:]))
+        self.assertEqual(sorted(ids(items)), ids(candidates()))
+        self.assertEqual(set(timings), {"prefilter", "rerank"})
+
+    def test_cascade_without_first_pass(self) -> None:
+        for top_m in (0, len(TEXTS)):
+            with self.subTest(top_m=top_m):
+                self.scored = []
+                items, timings = rerank.cascade_rerank(QUESTION, candidates(), top_m=top_m)
+                self.assertEqual(ids(items), ["doc-5", "doc-4", "doc-2", "doc-3", "doc-1"])
+                self.assertEqual(len(self.scored), 1)
+                self.assertEqual(set(timings), {"rerank"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+parse_request() must fill in the defaults of a /retrieve body and reject invalid ones with a
+ValueError (answered 400 by the server), before any model or Weaviate is used.
+
+Run from the repository root (needs weaviate-client and sentence-transformers, not a server):
+  python -m unittest tests.test_retrieval_server
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+try:
+    import retrieval_server  # noqa: E402
+except ImportError:
+    # weaviate-client or sentence-transformers missing
+    retrieval_server = None
+
+
+def parse(**req):
+    return retrieval_server.parse_request(json.dumps(req).encode("utf-8"))
+
+
+@unittest.skipIf(retrieval_server is None, "weaviate-client or sentence-transformers is not installed")
+class ParseRequestTest(unittest.TestCase):
+    def test_defaults(self) -> None:
+        self.assertEqual(
+            parse(question="How do I install it?"),
+            {
+                "question": "How do I install it?",
+                "rerank": False,
+                "limit": 50,
+                "candidates": 500,
+                "collection": "rag_chunks",
+                "openai": False,
+                "hybrid": False,
+                "alpha": 0.7,
+                "fusion": "relative-score",
+                "variants": [],
+                "expand": [],
+                "top_m": 100,
+                "prefilter": "bm25",
+            },
+        )
+
+    def test_options(self) -> None:
+        opts = parse(question="q", limit="5", top_m=0, alpha=1, fusion="rrf", variants=["v"], expand=True, prefilter="tiny")
+        self.assertEqual(opts["limit"], 5)
+        self.assertEqual(opts["top_m"], 0)
+        self.assertEqual(opts["alpha"], 1.0)
+        self.assertEqual(opts["fusion"], "rrf")
+        self.assertEqual(opts["variants"], ["v"])
+        self.assertEqual(opts["expand"], ["rewrite", "keywords", "hyde"])
+        self.assertEqual(opts["prefilter"], "tiny")
+
+    def test_rejected(self) -> None:
+        invalid = {
+            "not JSON": b"{question",
+            "not an object": b'["question"]',
+            "no question": b"{}",
+            "blank question": {"question": "  "},
+            "question not a string": {"question": 3},
+            "limit not an integer": {"question": "q", "limit": "many"},
+            "negative limit": {"question": "q", "limit": -1},
+            "candidates not an integer": {"question": "q", "candidates": "0x"},
+            "negative top_m": {"question": "q", "top_m": -1},
+            "alpha not a number": {"question": "q", "alpha": "high"},
+            "alpha above 1": {"question": "q", "alpha": 1.5},
+            "unknown fusion": {"question": "q", "fusion": "sum"},
+            "variants not a list": {"question": "q", "variants": "v"},
+            "variant not a string": {"question": "q", "variants": [1]},
+            "unknown expansion": {"question": "q", "expand": ["translate"]},
+            "unknown prefilter": {"question": "q", "prefilter": "random"},
+        }
+        for name, body in invalid.items():
+            with self.subTest(name):
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode("utf-8")
+                with self.assertRaises(ValueError):
+                    retrieval_server.parse_request(body)
+
+
+if __name__ == "__main__":
+    unittest.main()
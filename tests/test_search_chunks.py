@@ -0,0 +1,66 @@
+"""
+reciprocal_rank_fusion() must score each chunk by the sum of weight / (k + rank) over the
+rankings it appears in, list it once, and keep the fields of all its occurrences.
+
+Run from the repository root (needs weaviate-client and sentence-transformers, not a server):
+  python -m unittest tests.test_search_chunks
+"""
+
+from __future__ import annotations
+
+import sys
+import unittest
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+try:
+    import search_chunks  # noqa: E402
+except ImportError:
+    # weaviate-client or sentence-transformers missing
+    search_chunks = None
+
+
+def ranking(*chunk_ids, **fields):
+    return [{"chunk_id": chunk_id, **fields} for chunk_id in chunk_ids]
+
+
+@unittest.skipIf(search_chunks is None, "weaviate-client or sentence-transformers is not installed")
+class ReciprocalRankFusionTest(unittest.TestCase):
+    def test_scores_and_order(self) -> None:
+        fused = search_chunks.reciprocal_rank_fusion([ranking("a", "b", "c"), ranking("c", "a")], k=60)
+        self.assertEqual([rec["chunk_id"] for rec in fused], ["a", "c", "b"])
+        self.assertAlmostEqual(fused[0]["score"], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(fused[1]["score"], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(fused[2]["score"], 1 / 62)
+
+    def test_default_k(self) -> None:
+        fused = search_chunks.reciprocal_rank_fusion([ranking("a")])
+        self.assertAlmostEqual(fused[0]["score"], 1 / (search_chunks.RRF_K + 1))
+
+    def test_weights(self) -> None:
+        rankings = [ranking("a", "b"), ranking("b", "a")]
+        self.assertEqual([rec["chunk_id"] for rec in search_chunks.reciprocal_rank_fusion(rankings, weights=[1.0, 3.0])], ["b", "a"])
+        self.assertEqual([rec["chunk_id"] for rec in search_chunks.reciprocal_rank_fusion(rankings, weights=[3.0, 1.0])], ["a", "b"])
+
+    def test_fields_are_merged(self) -> None:
+        vector = ranking("a", "b", distance=0.2, text="vector")
+        keyword = ranking("b", "a", distance=None, text="keyword")
+        fused = search_chunks.reciprocal_rank_fusion([keyword, vector])
+        for rec in fused:
+            # First occurrence first; its missing fields come from the later ones
+            self.assertEqual(rec["text"], "keyword")
+            self.assertEqual(rec["distance"], 0.2)
+        self.assertEqual(keyword[0]["distance"], None, "the input records are left unchanged")
+
+    def test_limit(self) -> None:
+        fused = search_chunks.reciprocal_rank_fusion([ranking("a", "b", "c")], limit=2)
+        self.assertEqual([rec["chunk_id"] for rec in fused], ["a", "b"])
+        self.assertEqual(search_chunks.reciprocal_rank_fusion([], limit=5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
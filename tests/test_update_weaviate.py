@@ -0,0 +1,205 @@
+"""
+The uuid and sync_digest of an object must not change from one run to the next,
+upload_objects() must retry the objects a batch rejected, and sync_objects() must only send the
+delta of a document, here to an in-memory collection that interprets the filters, sort and paging
+of existing_objects().
+
+Run from the repository root (needs weaviate-client, not a Weaviate server):
+  python -m unittest tests.test_update_weaviate
+"""
+
+from __future__ import annotations
+
+import io
+import sys
+import unittest
+from contextlib import redirect_stderr
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT / "src" / "pipeline-advanced"))
+
+try:
+    import update_weaviate  # noqa: E402
+except ImportError:
+    # weaviate-client missing
+    update_weaviate = None
+
+
+META = {"model": {"name": "model", "version": "1"}, "created_at": "2026-01-01T00:00:00Z"}
+
+
+def matches(where, props) -> bool:
+    if hasattr(where, "filters"):
+        return all(matches(f, props) for f in where.filters)
+    value = props.get(where.target)
+    operator = where.operator.value
+    if operator == "Equal":
+        return value == where.value
+    if operator == "GreaterThan":
+        return value is not None and value > where.value
+    raise NotImplementedError(operator)
+
+
+class FakeCollection:
+    """
+    The parts of a Weaviate collection that update_weaviate uses, over a dict uuid -> properties.
+    """
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.sent = []
+        # chunk_id -> number of batches that still reject it
+        self.failures = {}
+        self.batch_sizes = []
+        self.query = SimpleNamespace(fetch_objects=self._fetch_objects)
+        self.data = SimpleNamespace(delete_many=self._delete_many)
+        self.batch = SimpleNamespace(dynamic=self._batch, fixed_size=self._fixed_size, failed_objects=[])
+
+    def _fetch_objects(self, filters, limit, offset, sort, return_properties):
+        found = sorted(
+            (props.get(sort.sorts[0].prop), uuid, props) for uuid, props in self.objects.items() if matches(filters, props)
+        )
+        return SimpleNamespace(
+            objects=[
+                SimpleNamespace(uuid=uuid, properties={k: props.get(k) for k in return_properties})
+                for _, uuid, props in found[offset : offset + limit]
+            ]
+        )
+
+    def _delete_many(self, where):
+        for uuid in where.value:
+            self.objects.pop(uuid, None)
+
+    def _fixed_size(self, batch_size, concurrent_requests):
+        self.batch_sizes.append(batch_size)
+        return self._batch()
+
+    def _batch(self):
+        collection = self
+
+        class Batch:
+            def __enter__(self):
+                collection.batch.failed_objects = []
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def add_object(self, properties, vector, uuid):
+                chunk_id = properties["chunk_id"]
+                if collection.failures.get(chunk_id):
+                    collection.failures[chunk_id] -= 1
+                    obj = SimpleNamespace(properties=properties, vector=vector, uuid=uuid)
+                    collection.batch.failed_objects.append(SimpleNamespace(object_=obj, message="timeout"))
+                    return
+                collection.objects[uuid] = dict(properties)
+                collection.sent.append(chunk_id)
+
+        return Batch()
+
+
+def document(name, paragraphs):
+    return [
+        (update_weaviate.object_properties({"chunk_id": f"{name}-{i}", "text": text, "headings": {"h1": name}}, META), [0.0])
+        for i, text in enumerate(paragraphs, start=1)
+    ]
+
+
+@unittest.skipIf(update_weaviate is None, "weaviate-client is not installed")
+class IdentityTest(unittest.TestCase):
+    def test_object_uuid_is_stable(self) -> None:
+        # Changing these values gives every stored object a new uuid: a full re-upload
+        self.assertEqual(update_weaviate.object_uuid("guide.md", "ab" * 32), "9c1dcf74-9370-51cc-94b5-3b3a87c60613")
+        self.assertEqual(update_weaviate.object_uuid("guide.md", "ab" * 32, 1), "623b8aa0-9922-5052-bb76-6ecaca44e8f3")
+        self.assertNotEqual(update_weaviate.object_uuid("other.md", "ab" * 32), update_weaviate.object_uuid("guide.md", "ab" * 32))
+
+    def test_object_digest_is_stable(self) -> None:
+        props = {"chunk_id": "guide.md-1", "text": "hello", "model": {"name": "m", "version": "1"}, "created_at": "2026-01-01T00:00:00Z"}
+        digest = update_weaviate.object_digest(props)
+        self.assertEqual(digest, "19f13a4883eb2408793d8659825c707e212c1b7678e7b9ff7737e9b6b147e742")
+        # Neither the order of the properties, created_at nor a former sync_digest count
+        reordered = dict(reversed(list(props.items())), created_at="2027-06-30T12:00:00Z", sync_digest="x")
+        self.assertEqual(update_weaviate.object_digest(reordered), digest)
+        self.assertNotEqual(update_weaviate.object_digest({**props, "model": {"name": "m", "version": "2"}}), digest)
+
+
+@unittest.skipIf(update_weaviate is None, "weaviate-client is not installed")
+class UploadObjectsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(update_weaviate.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coll = FakeCollection()
+
+    def upload(self, objects, **kwargs):
+        triples = [(props, vec, update_weaviate.object_uuid("guide.md", props["content_hash"])) for props, vec in objects]
+        with redirect_stderr(io.StringIO()):
+            return update_weaviate.upload_objects(self.coll, iter(triples), **kwargs)
+
+    def test_failed_objects_are_retried(self) -> None:
+        self.coll.failures = {"guide.md-2": 2}
+        self.assertEqual(self.upload(document("guide.md", ["alpha", "beta", "gamma"])), 3)
+        self.assertEqual(self.coll.sent, ["guide.md-1", "guide.md-3", "guide.md-2"])
+        self.assertEqual(len(self.coll.objects), 3)
+
+    def test_gives_up_after_max_retries(self) -> None:
+        self.coll.failures = {"guide.md-1": 3}
+        with self.assertRaisesRegex(RuntimeError, "1 of 2 objects could not be inserted after 2 retries"):
+            self.upload(document("guide.md", ["alpha", "beta"]), max_retries=2)
+
+    def test_fixed_size_batches(self) -> None:
+        self.upload(document("guide.md", ["alpha", "beta"]), batch_size=64)
+        self.assertEqual(self.coll.batch_sizes, [64])
+        self.upload(document("guide.md", ["alpha", "beta"]))
+        self.assertEqual(self.coll.batch_sizes, [64])
+
+
+@unittest.skipIf(update_weaviate is None, "weaviate-client is not installed")
+class SyncObjectsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(update_weaviate, "invalidate_cache")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coll = FakeCollection()
+
+    def sync(self, objects, **kwargs):
+        self.coll.sent = []
+        return update_weaviate.sync_objects(self.coll, objects, **kwargs)
+
+    def test_delta(self) -> None:
+        paragraphs = ["alpha", "beta", "gamma", "delta"]
+        self.sync(document("notes.md", ["unrelated"]))
+        counts = self.sync(document("guide.md", paragraphs))
+        self.assertEqual(counts, {"inserted": 4, "renumbered": 0, "unchanged": 0, "deleted": 0})
+
+        counts = self.sync(document("guide.md", paragraphs))
+        self.assertEqual(counts, {"inserted": 0, "renumbered": 0, "unchanged": 4, "deleted": 0})
+
+        # A paragraph inserted in the middle renumbers the chunks after it, a removed one is deleted
+        counts = self.sync(document("guide.md", ["alpha", "new", "beta", "gamma"]))
+        self.assertEqual(counts, {"inserted": 3, "renumbered": 2, "unchanged": 1, "deleted": 1})
+        self.assertEqual(self.coll.sent, ["guide.md-2", "guide.md-3", "guide.md-4"])
+        stored = sorted(p["chunk_id"] for p in self.coll.objects.values())
+        self.assertEqual(stored, ["guide.md-1", "guide.md-2", "guide.md-3", "guide.md-4", "notes.md-1"])
+
+        counts = self.sync(document("guide.md", ["alpha", "new", "beta", "gamma"]), full=True)
+        self.assertEqual(counts, {"inserted": 4, "renumbered": 0, "unchanged": 0, "deleted": 0})
+
+    def test_repeated_paragraphs_over_several_pages(self) -> None:
+        # More chunks with the same hash than a page holds: none may be lost between pages
+        paragraphs = ["same"] * 7 + [f"other {i}" for i in range(5)]
+        with mock.patch.object(update_weaviate, "_FETCH_PAGE", 3):
+            self.sync(document("guide.md", paragraphs))
+            self.assertEqual(len(update_weaviate.existing_objects(self.coll, "guide.md")), len(paragraphs))
+            counts = self.sync(document("guide.md", paragraphs))
+        self.assertEqual(counts["unchanged"], len(paragraphs))
+        self.assertEqual(counts["deleted"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()